@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+'''
+Compact fixed length addresses derived from public keys.
+Balances, recipients and miners are identified by address, the full
+public key is only needed where a signature has to be checked.
+'''
+from hashlib import sha256
+from . import Constants
+
+def to_address(public_key):
+    '''
+    Returns the address (hex digest) of a PEM public key (str or bytes).
+    Values that already are addresses are returned unchanged.
+    '''
+    if isinstance(public_key, bytes):
+        public_key = public_key.decode()
+    if is_address(public_key):
+        return public_key
+    return sha256(public_key.encode()).hexdigest()[:Constants.ADDRESS_SIZE * 2]
+
+def is_address(value):
+    '''
+    Checks that value is a well formed address
+    '''
+    if type(value) != str or len(value) != Constants.ADDRESS_SIZE * 2:
+        return False
+    try:
+        bytes.fromhex(value)
+    except ValueError:
+        return False
+    return True
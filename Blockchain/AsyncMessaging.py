@@ -0,0 +1,143 @@
+'''
+asyncio version of the Messaging layer, for nodes that serve many
+connections at once. Messages are sent in the same frames and pass the
+same checks as with Messaging, so async and select based nodes can talk
+to each other. Every network wait has a timeout, so a slow or dead peer
+only holds up the task that is talking to it.
+'''
+
+import asyncio
+import struct
+from .Messaging import Messaging, MessageTypes
+from .Framing import FRAME_HEADER_FORMAT, FRAME_HEADER_SIZE
+from . import Constants
+
+class AsyncMessaging:
+    @staticmethod
+    async def connect(addr, timeout=Constants.NETWORK_TIMEOUT):
+        '''
+        Opens a connection to a node.
+        Returns: (reader, writer) if successful, None otherwise
+        '''
+        try:
+            return await asyncio.wait_for(asyncio.open_connection(addr[0], addr[1]), timeout)
+        except (OSError, asyncio.TimeoutError):
+            return None
+
+    @staticmethod
+    async def close(writer):
+        writer.close()
+        Messaging._dropStreams(writer)
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+
+    @staticmethod
+    async def pingNode(addr, timeout=Constants.NETWORK_TIMEOUT):
+        '''
+        Checks if a node is alive by connecting to it.
+        Returns: 1 if alive, 0 otherwise
+        '''
+        connection = await AsyncMessaging.connect(addr, timeout)
+        if connection is None:
+            return 0
+        await AsyncMessaging.close(connection[1])
+        return 1
+
+    @staticmethod
+    async def readMessage(reader, writer=None, timeout=None):
+        '''
+        Reads one complete message. If the connection closes, times out or
+        sends something that isn't a frame, the writer (if given) is closed.
+        Returns: None if invalid message or connection issue, otherwise a dict
+        representing the message
+        '''
+        try:
+            header = await asyncio.wait_for(reader.readexactly(FRAME_HEADER_SIZE), timeout)
+            length, flags = struct.unpack(FRAME_HEADER_FORMAT, header)
+            if length > Constants.MAX_MESSAGE_SIZE:
+                raise ValueError(f"Frame of {length} bytes is too large")
+            payload = await asyncio.wait_for(reader.readexactly(length), timeout)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, OSError, ValueError):
+            # part of a frame may have been read, so the stream can't be used anymore
+            if writer is not None:
+                writer.close()
+            return None
+        try:
+            message = Messaging._decodeFrame(flags, payload, reader)
+        except ValueError as e:
+            # the connection's zlib stream is broken, nothing more can be read from it
+            print(e)
+            Messaging._dropStreams(reader, writer)
+            if writer is not None:
+                writer.close()
+            return None
+        if message is not None and writer is not None:
+            Messaging._noteFeatures(writer, message)
+        return message
+
+    @staticmethod
+    async def sendMessage(writer, message, timeout=Constants.NETWORK_TIMEOUT):
+        '''
+        Sends a message and waits (up to the timeout) until it has been
+        handed to the operating system. The connection is closed on failure.
+        Returns: 1 if successful, 0 otherwise
+        '''
+        try:
+            writer.write(Messaging._encodeMessage(message, writer))
+            await asyncio.wait_for(writer.drain(), timeout)
+        except (OSError, ValueError, asyncio.TimeoutError) as e:
+            print(e)
+            writer.close()
+            return 0
+        return 1
+
+    @staticmethod
+    async def sendTo(addr, message, timeout=Constants.NETWORK_TIMEOUT):
+        '''
+        Sends a message to a node over a new connection and closes it.
+        Returns: 1 if successful, 0 otherwise
+        '''
+        connection = await AsyncMessaging.connect(addr, timeout)
+        if connection is None:
+            return 0
+        rc = await AsyncMessaging.sendMessage(connection[1], message, timeout)
+        await AsyncMessaging.close(connection[1])
+        return rc
+
+    @staticmethod
+    async def broadcast(addrs, message, timeout=Constants.NETWORK_TIMEOUT):
+        '''
+        Sends a message to every node at once
+        Returns: the number of nodes it was sent to
+        '''
+        results = await asyncio.gather(*[AsyncMessaging.sendTo(addr, message, timeout) for addr in addrs])
+        return sum(results)
+
+    @staticmethod
+    async def request(addr, message, timeout=Constants.NETWORK_TIMEOUT):
+        '''
+        Sends a message to a node and waits for its response
+        Returns: the response if successful, None otherwise
+        '''
+        connection = await AsyncMessaging.connect(addr, timeout)
+        if connection is None:
+            return None
+        reader, writer = connection
+        response = None
+        if await AsyncMessaging.sendMessage(writer, message, timeout):
+            response = await AsyncMessaging.readMessage(reader, writer, timeout)
+        await AsyncMessaging.close(writer)
+        return response
+
+    @staticmethod
+    async def getNeighbors(addr, timeout=Constants.NETWORK_TIMEOUT):
+        '''
+        Gets the neighbors of a full node.
+        Returns: list of neighbors (can be empty) if successful, None otherwise
+        '''
+        response = await AsyncMessaging.request(addr, {"Type": MessageTypes.Get_Neighbors}, timeout)
+        if response is None:
+            return None
+        return response.get("Neighbors", None)
@@ -6,18 +6,40 @@ BlockChain.py
 This file contains the Block and BlockChain classes for use
 in the blockchain network.
 '''
+import os
 import random
 import json
+import struct
+import bisect
 from hashlib import sha256
 from .Transaction import Transaction
+from .Merkle import MerkleTree
+from .Address import to_address
+from .Checkpoint import default_checkpoints, balances_digest
+from . import Constants
 from collections import defaultdict
+from types import MappingProxyType
+
+# version, index, prev hash, merkle root, miner address, nonce
+HEADER_FORMAT = ">II32s32s20sQ"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+# the nonce is packed last so everything before it can be hashed once
+NONCE_FORMAT = ">Q"
+NONCE_OFFSET = HEADER_SIZE - struct.calcsize(NONCE_FORMAT)
 
 class Block:
-    def __init__(self, index, prev_hash, pk, nonce=None, transactions=None, hash=None):
+    # blocks are kept for the life of the node, so skip the per object dict
+    __slots__ = ("index", "prev_hash", "miner_address", "nonce", "transactions", "hash", "_sealed")
+
+    def __init__(self, index, prev_hash, miner, nonce=None, transactions=None, hash=None):
+        '''
+        Miner is the address (or public key) the coinbase is paid to.
+        Once the block has a hash (it was mined or received) it can't be modified.
+        '''
         self.index = index
         self.prev_hash = prev_hash
-        self.miner_pk = pk
-        if nonce:
+        self.miner_address = to_address(miner)
+        if nonce is not None:
             self.nonce = nonce
         else:
             self.nonce = random.randint(0, Constants.DIFFICULTY * 100000000)
@@ -25,19 +47,45 @@ class Block:
             self.transactions = transactions
         else:
             self.transactions = []
-        self.hash = None
+        self.hash = hash
+
+    def __setattr__(self, name, value):
+        if getattr(self, "_sealed", False):
+            raise AttributeError(f"Block {self.hash} has been mined and can no longer be modified")
+        object.__setattr__(self, name, value)
+        if name == "hash" and value is not None:
+            # transactions are frozen along with the rest of the block
+            object.__setattr__(self, "transactions", tuple(self.transactions))
+            object.__setattr__(self, "_sealed", True)
+
+    def __reduce__(self):
+        return (Block, (self.index, self.prev_hash, self.miner_address, self.nonce,
+                        list(self.transactions), self.hash))
 
     def add_transaction(self, transaction):
+        if getattr(self, "_sealed", False):
+            raise AttributeError(f"Block {self.hash} has been mined and can no longer be modified")
         self.transactions.append(transaction)
 
-    def verify_transaction_authenticities(self, send_bad_transaction=False):
+    def verify_transaction_authenticities(self, send_bad_transaction=False, processes=1):
         '''
         Checks signatures of all transcations.
         Includes option to return the bad block if one is found.
+        Processes other than 1 spreads the checks across a process pool
+        (None uses every core), but a block holds fewer transactions than
+        PARALLEL_VERIFY_THRESHOLD so they are still checked in this process.
+        Only verify_blockchain batches enough of them to use the pool.
         DOES NOT CHECK IF THE SENDER CAN SEND THE BALANCE
         (it is quicker to just do that when we validate the block)
         '''
         # return True
+        if processes != 1:
+            bad = Transaction.verify_batch(self.transactions, processes)
+            if bad == -1:
+                return True
+            if send_bad_transaction:
+                return self.transactions[bad]
+            return False
         for t in self.transactions:
             if not t.verify_transaction_authenticity():
                 if send_bad_transaction:
@@ -45,6 +93,15 @@ class Block:
                 return False
         return True
 
+    def has_repeated_transactions(self):
+        '''
+        Checks if a transaction appears in the block more than once.
+        The Merkle tree pairs the last node of an odd level with itself,
+        so repeating the last transactions of a block leaves its root (and
+        hash) unchanged. Such a block must be rejected, not replayed.
+        '''
+        return len({t.tid for t in self.transactions}) != len(self.transactions)
+
     def verify_transactions_are_fundable(self, user_balances: defaultdict):
         '''
         Takes in a BlockChain object's dictionary of user balances and
@@ -70,20 +127,29 @@ class Block:
         j = {}
         j["Block_Index"]  = self.index
         j["Prev_Hash"]    = self.prev_hash
-        j["Miner_PK"]     = self.miner_pk
+        j["Miner_Address"] = self.miner_address
         j["Nonce"]        = self.nonce
         j["Transactions"] = []
         for t in self.transactions:
-            j["Transactions"].append(str(t))
+            j["Transactions"].append(t.to_json())
         j["Hash"]         = self.hash
         return j
 
+    @staticmethod
+    def from_json(j):
+        '''
+        Builds a Block from the dictionary made by to_json
+        '''
+        transactions = [Transaction.from_json(t) for t in j["Transactions"]]
+        return Block(j["Block_Index"], j["Prev_Hash"], j["Miner_Address"], j["Nonce"],
+                     transactions, j["Hash"])
+
     def __str__(self):
         block_str = ""
         block_str += "Block index: " + str(self.index) + "\n"
         block_str += "Prev Hash: " + str(self.prev_hash) + "\n"
         block_str += "Nonce: " + str(self.nonce) + "\n"
-        block_str += "Coinbase: " + str(Constants.COINBASE) + " -> " + str(self.miner_pk) + "\n"
+        block_str += "Coinbase: " + str(Constants.COINBASE) + " -> " + str(self.miner_address) + "\n"
         block_str += "Transactions\n"
         for t in self.transactions:
             block_str += str(t) + "\n"
@@ -91,29 +157,189 @@ class Block:
             block_str += "Hash: " + self.hash
         return block_str
 
-    def string_for_mining(self):
-        block_str = ""
-        block_str += "Block index: " + str(self.index) + "\n"
-        block_str += "Prev Hash: " + str(self.prev_hash) + "\n"
-        block_str += "Nonce: " + str(self.nonce) + "\n"
-        block_str += "Coinbase: " + str(Constants.COINBASE) + " -> " + str(self.miner_pk) + "\n"
-        block_str += "Transactions\n"
-        for t in self.transactions:
-            block_str += str(t) + "\n"
+    def merkle_root(self):
+        '''
+        Returns the Merkle root of the block's transactions
+        '''
+        return MerkleTree([t.canonical() for t in self.transactions]).root()
 
-        return block_str
+    def header(self):
+        '''
+        Returns the fixed size binary header of the block. This is what
+        the proof of work is computed over.
+        '''
+        return self.mining_prefix() + Block.mining_suffix(self.nonce)
+
+    def compute_hash(self):
+        '''
+        Returns the hex sha256 of the block header.
+        Raises ValueError if the block's fields can't be packed into a header.
+        '''
+        return sha256(self.header()).hexdigest()
+
+    def verify_proof_of_work(self):
+        '''
+        Checks that the block's hash is the hash of its header
+        and meets the required difficulty
+        '''
+        try:
+            hash = self.compute_hash()
+        except ValueError:
+            # malformed index or previous hash
+            return False
+        if hash != self.hash:
+            return False
+        return self.hash.startswith(Constants.DIFFICULTY * "0")
+
+    def mining_prefix(self):
+        '''
+        Everything in the header that comes before the nonce.
+        The nonce is kept last so this part can be hashed once per block.
+        '''
+        try:
+            prefix = struct.pack(HEADER_FORMAT, Constants.BLOCK_VERSION, int(self.index),
+                                 bytes.fromhex(self.prev_hash), self.merkle_root(),
+                                 bytes.fromhex(self.miner_address), 0)
+        except (struct.error, TypeError) as e:
+            raise ValueError(f"Block can not be packed into a header: {e}")
+        return prefix[:NONCE_OFFSET]
+
+    @staticmethod
+    def mining_suffix(nonce):
+        return struct.pack(NONCE_FORMAT, nonce)
+
+    def mining_state(self):
+        '''
+        Returns a sha256 object that has already consumed the mining prefix.
+        Copy it and feed it the suffix for each nonce to be tested.
+        '''
+        return sha256(self.mining_prefix())
+
+    @staticmethod
+    def hash_nonce(state, nonce):
+        '''
+        Hashes a nonce on top of a state from mining_state
+        without modifying the state
+        '''
+        h = state.copy()
+        h.update(Block.mining_suffix(nonce))
+        return h.hexdigest()
+
+    @staticmethod
+    def unpack_header(header):
+        '''
+        Splits a binary header back into a dictionary of its fields
+        (hashes are returned as hex strings)
+        '''
+        version, index, prev_hash, merkle_root, miner_digest, nonce = struct.unpack(HEADER_FORMAT, header)
+        return {"Version": version, "Block_Index": index, "Prev_Hash": prev_hash.hex(),
+                "Merkle_Root": merkle_root.hex(), "Miner_Digest": miner_digest.hex(),
+                "Nonce": nonce, "Hash": sha256(header).hexdigest()}
+
+class HeaderBlock(Block):
+    '''
+    A block that is only known by its header, e.g. one below a snapshot
+    that a chain was started from. It has no transactions, so its merkle
+    root is taken from the header.
+    '''
+    __slots__ = ("root",)
+
+    def __init__(self, header):
+        fields = Block.unpack_header(header)
+        self.root = bytes.fromhex(fields["Merkle_Root"])
+        super().__init__(fields["Block_Index"], fields["Prev_Hash"], fields["Miner_Digest"],
+                         fields["Nonce"], [], fields["Hash"])
+
+    def __reduce__(self):
+        return (HeaderBlock, (self.header(),))
+
+    def merkle_root(self):
+        return self.root
+
+class GenesisBlock(dict):
+    '''
+    The genesis block, which persists as a dictionary unlike other blocks.
+    One is shared by every chain in the process, so it can't be modified.
+    balances maps the address of each genesis public key to its balance.
+    '''
+    __slots__ = ("balances",)
+
+    def __init__(self, transactions):
+        '''
+        Transactions is a list of (public key, balance) pairs
+        '''
+        block = {"Block_Index": 0, "Transactions": tuple(tuple(T) for T in transactions)}
+        # genesis can have any hash (doesn't need to be mined for a specific
+        # difficulty)
+        block["Hash"] = sha256(json.dumps(block).encode()).hexdigest()
+        super().__init__(block)
+        self.balances = MappingProxyType({to_address(T[0]): int(T[1]) for T in block["Transactions"]})
+
+    def __reduce__(self):
+        return (GenesisBlock, (self["Transactions"],))
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("The genesis block can not be modified")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+
+# path -> GenesisBlock, so each genesis file is only read and hashed once
+_genesis_cache = {}
+
+def load_genesis(path=None):
+    '''
+    Returns the genesis block from the given file (Constants.GENESIS_PATH by
+    default), reading it only the first time it is asked for.
+    Raises ValueError if its hash isn't Constants.GENESIS_HASH.
+    '''
+    path = os.path.abspath(path if path is not None else Constants.GENESIS_PATH)
+    genesis = _genesis_cache.get(path)
+    if genesis is None:
+        with open(path) as f:
+            genesis = GenesisBlock(json.load(f).items())
+        if genesis["Hash"] != Constants.GENESIS_HASH:
+            raise ValueError(f"{path} does not contain the genesis block")
+        _genesis_cache[path] = genesis
+    return genesis
 
 class BlockChain:
-    def __init__(self, data:list=None):
+    def __init__(self, data:list=None, store=None):
         '''
         If creating a blockchain for the first time, don't specify data.
         If using existing blocks, data will be a list of blocks as Block objects.
+        If a store is given, the chain starts with the blocks saved in it
+        and every block added afterwards is saved to it. A BlockStore only
+        saves blocks. A SQLiteStore also keeps the balances and accepted
+        transactions, so none of the chain is held in memory.
         '''
         self.block_chain = []
         self.length = 0
-        self.accepted_transactions = set()
+        # tid -> (height, position in block) of every accepted transaction
+        self.accepted_transactions = {}
+        # block hash -> block
+        self.block_index = {}
+        # address -> list of (height, tid, balance change) in height order, the tid
+        # is None for genesis balances, coinbase rewards and snapshot balances
+        self.address_history = defaultdict(list)
+        # (balance deltas, tids) of each block after genesis, so blocks
+        # can be disconnected from the tip without replaying the chain
+        self.undo_log = []
         self.user_balances = defaultdict(int)
-        self.add_block(self.create_genesis(), True)
+        self.store = None
+        # the snapshot the chain was started from, if any
+        self.snapshot = None
+        # blocks up to this height are the block objects that a successful
+        # verify_blockchain checked (or the headers of the snapshot)
+        self.verified_height = 0
+        genesis = self.create_genesis()
+        self.add_block(genesis, True)
+        if store is not None:
+            if store.keeps_state:
+                self._use_state_store(store, genesis)
+            else:
+                for block in store.blocks():
+                    self.add_block(block)
+            self.store = store
         if data:
             # read in the data to create the blockchain
             for block in data:
@@ -121,28 +347,86 @@ class BlockChain:
 
     def create_genesis(self, data=None) -> dict:
         '''
-        Import a genesis text file, if it exists
-        Otherwise, create a block where data will be a list of
-        genesis transactions (PK, balance)
+        Use the genesis block from Constants.GENESIS_PATH (see load_genesis)
+        unless data is given, in which case create a block where data will
+        be a list of genesis transactions (PK, balance)
+        Balances are keyed by the address of each genesis public key
 
         Genesis persists as a dictionary, unlike other blocks
         '''
-        block = {}
-        block["Block_Index"] = 0
-        block["Transactions"] = []
         if data:
-            block["Transactions"] = data
+            block = GenesisBlock(data)
         else:
-            with open("genesis.json") as f:
-                block["Transactions"] = list(json.load(f).items())
+            block = load_genesis()
         self.length = 1
-        for T in block["Transactions"]:
-            self.user_balances[T[0]] = int(T[1])
-        # genesis can have any hash (doesn't need to be mined for a specific
-        # difficulty)
-        block["Hash"] = sha256(json.dumps(block).encode()).hexdigest()
+        self.user_balances.update(block.balances)
         return block
 
+    @staticmethod
+    def from_snapshot(snapshot, digest):
+        '''
+        Starts a chain from a ledger snapshot (see Snapshot.py) instead of
+        replaying every block. No header commits to the balances, so they
+        are only trusted if the snapshot has the given digest, which must
+        come from somewhere other than the node that sent the snapshot
+        (e.g. the operator, from a node they run). The headers must also
+        link back to our genesis block, and the balances must add up to the
+        coins that exist at its height. Blocks up to the snapshot are
+        header only, and verifying the chain later resumes from the snapshot.
+        Returns: the new BlockChain, or None if the snapshot doesn't check out
+        '''
+        if snapshot.digest() != digest:
+            return None
+        blockchain = BlockChain()
+        supply = sum(blockchain.user_balances.values()) + snapshot.height * Constants.COINBASE
+        if not snapshot.verify_headers(blockchain.get_hash_at(0)):
+            return None
+        if sum(snapshot.balances.values()) != supply or min(snapshot.balances.values(), default=0) < 0:
+            return None
+        for header in snapshot.headers:
+            block = HeaderBlock(header)
+            blockchain.block_chain.append(block)
+            blockchain.block_index[block.hash] = block
+        blockchain.length = snapshot.height + 1
+        blockchain.user_balances = defaultdict(int, snapshot.balances)
+        blockchain.accepted_transactions = dict(snapshot.transactions)
+        # history before the snapshot isn't known, start from its balances
+        blockchain.address_history = defaultdict(list, {address: [(snapshot.height, None, balance)]
+                                                        for address, balance in snapshot.balances.items()})
+        blockchain.snapshot = snapshot
+        blockchain.verified_height = snapshot.height
+        return blockchain
+
+    def _use_state_store(self, store, genesis):
+        '''
+        Switches the chain's blocks, balances and accepted transactions
+        over to views of a store that keeps them
+        '''
+        stored_genesis = store.genesis_hash()
+        if stored_genesis is None:
+            store.init_genesis(genesis, self.user_balances)
+        elif stored_genesis != genesis["Hash"]:
+            raise ValueError("Store was created with a different genesis block")
+        self.user_balances = store.balances
+        self.accepted_transactions = store.transaction_ids
+        self.block_index = store.block_index(genesis)
+        self.address_history = store.address_history(genesis)
+        self.block_chain = store.block_list(genesis)
+        self.length = len(self.block_chain)
+
+    @staticmethod
+    def block_deltas(block):
+        '''
+        Returns the balance changes a block makes (address -> delta),
+        including the coinbase paid to its miner
+        '''
+        deltas = defaultdict(int)
+        for T in block.transactions:
+            deltas[T.recipient] += int(T.amount)
+            deltas[T.sender] -= int(T.amount)
+        deltas[block.miner_address] += Constants.COINBASE
+        return deltas
+
     def add_block(self, block, genesis=False):
         '''
         Adds a block item to the block chain list.
@@ -152,25 +436,105 @@ class BlockChain:
         '''
         # add transcations
         if genesis:
+            for address, balance in block.balances.items():
+                self.address_history[address].append((0, None, balance))
             self.block_chain.append(block)
+            self.block_index[block["Hash"]] = block
             self.length = 1
             return True
-        if not genesis:
-            for T in block.transactions:
-                self.user_balances[T.recipient] += int(T.amount)
-                self.user_balances[T.sender] -= int(T.amount)
-                self.accepted_transactions.add(T.tid)
-            self.user_balances[block.miner_pk] += Constants.COINBASE
+        deltas = BlockChain.block_deltas(block)
+        if self.store is not None and self.store.keeps_state:
+            # the store updates the balances and transactions with the block
+            self.store.append(block, deltas)
+            self.length += 1
+            return True
+        for address, delta in deltas.items():
+            self.user_balances[address] += delta
+        for i, T in enumerate(block.transactions):
+            self.accepted_transactions[T.tid] = (block.index, i)
+            self.address_history[T.sender].append((block.index, T.tid, -int(T.amount)))
+            self.address_history[T.recipient].append((block.index, T.tid, int(T.amount)))
+        self.address_history[block.miner_address].append((block.index, None, Constants.COINBASE))
+        if self.store is not None:
+            self.store.append(block, deltas)
+        self.undo_log.append((deltas, [T.tid for T in block.transactions]))
+        self.block_index[block.hash] = block
         self.block_chain.append(block)
         self.length += 1
         return True
 
+    def disconnect_block(self):
+        '''
+        Removes the tip block and undoes everything add_block did for it,
+        using the undo log instead of replaying the chain.
+        Returns: the removed block
+        '''
+        if self.length <= 1:
+            raise ValueError("The genesis block can not be disconnected")
+        if self.snapshot is not None and self.length - 1 <= self.snapshot.height:
+            raise ValueError("Blocks in the snapshot the chain started from can not be disconnected")
+        if self.store is not None and self.store.keeps_state:
+            block = self.block_chain[self.length-1]
+            self.store.pop(block, BlockChain.block_deltas(block))
+            self.length -= 1
+            self.verified_height = min(self.verified_height, self.length - 1)
+            return block
+        block = self.block_chain.pop()
+        deltas, tids = self.undo_log.pop()
+        for address, delta in deltas.items():
+            self.user_balances[address] -= delta
+            if not self.user_balances[address]:
+                del self.user_balances[address]
+            # history entries for the block are at the end of each list
+            history = self.address_history[address]
+            while history and history[-1][0] == block.index:
+                history.pop()
+            if not history:
+                del self.address_history[address]
+        for tid in tids:
+            del self.accepted_transactions[tid]
+        del self.block_index[block.hash]
+        if self.store is not None:
+            self.store.pop(block, deltas)
+        self.length -= 1
+        self.verified_height = min(self.verified_height, self.length - 1)
+        return block
+
+    def reorganize(self, fork_height, blocks):
+        '''
+        Switches the chain to a competing branch: disconnects every block
+        above fork_height, then validates and adds the given blocks (which
+        must continue from the block at fork_height). The cost depends on
+        how deep the fork is, not on the length of the chain.
+        If a new block is invalid the original branch is restored.
+        Returns: -1 if the chain switched branches, otherwise the index of
+                 the first block that could not be added (0 if the chain
+                 can't branch off at fork_height)
+        '''
+        if fork_height < 0 or fork_height >= self.length:
+            return 0
+        if self.snapshot is not None and fork_height < self.snapshot.height:
+            return 0
+        disconnected = []
+        while self.length - 1 > fork_height:
+            disconnected.append(self.disconnect_block())
+        for i, block in enumerate(blocks):
+            if not self.validate_block(block):
+                # put the original branch back
+                for _ in range(i):
+                    self.disconnect_block()
+                for old in reversed(disconnected):
+                    self.add_block(old)
+                return i
+            self.add_block(block)
+        return -1
+
     def validate_transaction(self, T: Transaction):
         '''
         Check if the sender of the transcation can send the amount
         based off thier total in a blockchain
         '''
-        if self.user_balances[T["Sender_Public_Key"]] < T["Amount"]:
+        if self.user_balances[T.sender] < T.amount:
             return False
         return True
 
@@ -189,6 +553,8 @@ class BlockChain:
             return True
         else:
             # other blocks are block objects
+            if block.has_repeated_transactions():
+                return False
             for txn in block.transactions:
                 if txn.tid in self.accepted_transactions:
                     # we've seen this transaction before, reject block
@@ -197,13 +563,9 @@ class BlockChain:
         # same value as the current length of the chain
         if block.index != self.length:
             return False
-        hash = sha256(block.string_for_mining().encode()).hexdigest()
-        # the hash we get from the block's string representation should
-        # match the hash that is included in the block itself
-        if hash != block.hash:
-            return False
-        # the hash must meet the required difficulty
-        if not block.hash.startswith(Constants.DIFFICULTY * "0"):
+        # the hash we get from the block's header should match the
+        # hash that is included in the block and meet the difficulty
+        if not block.verify_proof_of_work():
             return False
         # the previous hash must be the hash of the current last block
         # in the blockchain
@@ -216,20 +578,100 @@ class BlockChain:
             return False
         return True
 
+    def get_block_by_hash(self, hash):
+        '''
+        Returns the block with the given hash (the genesis block is a dictionary),
+        or None if it isn't in the chain
+        '''
+        return self.block_index.get(hash)
+
+    def get_transaction_location(self, tid):
+        '''
+        Returns (block height, position in block) of an accepted transaction,
+        or None if it isn't in the chain
+        '''
+        return self.accepted_transactions.get(tid)
+
+    def get_transaction(self, tid):
+        '''
+        Returns an accepted transaction by its id, or None if it isn't in the chain
+        '''
+        location = self.get_transaction_location(tid)
+        if location is None:
+            return None
+        height, position = location
+        block = self.block_chain[height]
+        if isinstance(block, HeaderBlock):
+            # transactions below a snapshot aren't kept
+            return None
+        return block.transactions[position]
+
+    def get_history(self, address, limit=50, offset=0):
+        '''
+        Returns a page of an address's (or public key's) history, newest first,
+        as (height, tid, balance change) tuples. The tid is None for genesis
+        balances and coinbase rewards.
+        '''
+        history = self.address_history.get(to_address(address), [])
+        end = len(history) - offset
+        if end <= 0:
+            return []
+        return history[max(0, end - limit):end][::-1]
+
+    def get_balance_at(self, address, height):
+        '''
+        Returns the balance of an address (or public key) after the block
+        at the given height
+        '''
+        history = self.address_history.get(to_address(address), [])
+        end = bisect.bisect_right(history, height, key=lambda entry: entry[0])
+        return sum(delta for _, _, delta in history[:end])
+
     def get_pk_total(self, pk):
         '''
         Gets the total balance of a user throught the blockchain
+        Takes either a public key or an address
         '''
-        return self.user_balances[pk]
+        return self.user_balances[to_address(pk)]
 
-    def verify_blockchain(self):
+    def verify_blockchain(self, processes=1, checkpoints=None):
         '''
         Verifies entire blockchain. Genesis block is assumed valid
         except hash.
+        Processes other than 1 checks every signature in the chain up front
+        across a process pool (None uses every core).
+        If the chain contains a block from a previous successful verification
+        (see Checkpoint.py), only the blocks after it are verified. The final
+        balances must match the chain's own balances either way.
+        A checkpoint only vouches for the hash of its block, so unless the
+        blocks before it are the ones that were verified, their hashes and
+        links are recomputed (which is cheap next to checking signatures).
         '''
+        if checkpoints is None:
+            checkpoints = default_checkpoints
         balances = defaultdict(int) # collect running balances for ordering
         prev_hash = None
-        for block in self.block_chain:
+        blocks = self.block_chain
+        checkpoint = checkpoints.find(self)
+        if self.snapshot is not None and (checkpoint is None or checkpoint[0] < self.snapshot.height):
+            # blocks up to the snapshot are only headers, start from its balances
+            checkpoint = (self.snapshot.height, defaultdict(int, self.snapshot.balances))
+        if checkpoint is not None:
+            # everything up to the checkpoint was verified before
+            height, balances = checkpoint
+            if not self._verify_prefix(height):
+                return False
+            prev_hash = self.get_hash_at(height)
+            blocks = self.block_chain[height+1:]
+        signatures_checked = False
+        if processes != 1:
+            transactions = [T for block in blocks if not isinstance(block, dict)
+                            for T in block.transactions]
+            if Transaction.verify_batch(transactions, processes) != -1:
+                # a transaction somewhere in the chain was not authentic
+                return False
+            signatures_checked = True
+        for block in blocks:
             if isinstance(block, dict):
                 # check hash of the genesis
                 to_hash = block.copy()
@@ -240,8 +682,7 @@ class BlockChain:
                     return False
                 if not hash == block["Hash"]:
                     return False
-                for T in block["Transactions"]:
-                    balances[T[0]] = int(T[1])
+                balances.update(block.balances)
                 prev_hash = block["Hash"]
             else:
                 # check that block contains the hash of the previous block
@@ -250,9 +691,11 @@ class BlockChain:
                 # check that the hash of the block has the required difficulty
                 if not block.hash.startswith(Constants.DIFFICULTY * "0"):
                     return False
-                balances[block.miner_pk] += Constants.COINBASE
+                if block.has_repeated_transactions():
+                    return False
+                balances[block.miner_address] += Constants.COINBASE
                 for T in block.transactions:
-                    if not T.verify_transaction_authenticity():
+                    if not signatures_checked and not T.verify_transaction_authenticity():
                         # transaction was not authentic
                         return False
                     if balances[T.sender] < T.amount:
@@ -261,12 +704,46 @@ class BlockChain:
                     # update balances for sender and recipient
                     balances[T.recipient] += T.amount
                     balances[T.sender]    -= T.amount
-                hash = sha256(block.string_for_mining().encode()).hexdigest()
+                try:
+                    hash = block.compute_hash()
+                except ValueError:
+                    return False
                 if hash != block.hash:
                     return False
                 prev_hash = block.hash
+        # the chain's balances were built by add_block, make sure they
+        # agree with what the verified blocks add up to
+        if balances_digest(balances) != balances_digest(self.user_balances):
+            return False
+        checkpoints.record(self.length - 1, self.get_last_hash(), balances)
+        self.verified_height = self.length - 1
         return True
 
+    def _verify_prefix(self, height):
+        '''
+        Checks that the blocks between the verified ones and height hash to
+        what they claim and link to each other, so the chain holds the same
+        blocks that a checkpoint at height was recorded for
+        '''
+        for h in range(self.verified_height + 1, height + 1):
+            block = self.block_chain[h]
+            if block.prev_hash != self.get_hash_at(h - 1) or block.has_repeated_transactions():
+                return False
+            try:
+                if block.compute_hash() != block.hash:
+                    return False
+            except ValueError:
+                return False
+        return True
+
+    def get_hash_at(self, height):
+        '''
+        Returns the hash of the block at the given height
+        '''
+        if height == 0:
+            return self.block_chain[0]["Hash"]
+        return self.block_chain[height].hash
+
     def get_last_hash(self):
         '''
         Returns the hash of the most recently added block
@@ -285,10 +762,28 @@ class BlockChain:
         return string
 
     def copy(self):
+        '''
+        Returns an in memory copy of the chain that can be changed
+        (e.g. reorganized) without affecting this one
+        '''
         copy = BlockChain()
-        for block in self.block_chain:
-            if isinstance(block, dict):
-                continue
-            copy.add_block(block)
+        if self.store is not None and self.store.keeps_state:
+            # nothing is held in memory to copy, replay the stored blocks
+            for block in self.block_chain:
+                if isinstance(block, dict):
+                    continue
+                copy.add_block(block)
+            return copy
+        # blocks are immutable so they can be shared, only the
+        # indexes and ledger state need their own copies
+        copy.block_chain = list(self.block_chain)
+        copy.length = self.length
+        copy.accepted_transactions = dict(self.accepted_transactions)
+        copy.block_index = dict(self.block_index)
+        copy.address_history = defaultdict(list, {a: list(h) for a, h in self.address_history.items()})
+        copy.undo_log = list(self.undo_log)
+        copy.user_balances = defaultdict(int, self.user_balances)
+        copy.snapshot = self.snapshot
+        copy.verified_height = self.verified_height
         return copy
 
@@ -0,0 +1,227 @@
+'''
+Keeps every fork of the blockchain that a full node knows about
+as a tree of blocks. Forks share the blocks they have in common, and
+only the main fork (the one with the most work) has its balances and
+transactions materialized in a BlockChain. Switching forks uses the
+chain's undo journal, so it costs the depth of the fork rather than
+the length of the chain.
+'''
+
+from . import Constants
+from .BlockChain import Block, HeaderBlock
+
+
+def block_work():
+    '''
+    Expected number of hashes it takes to mine a block
+    (each hex zero of difficulty multiplies it by 16)
+    '''
+    return 16 ** Constants.DIFFICULTY
+
+
+class BlockNode:
+    '''
+    A block in the fork tree. Blocks on the main fork are kept by the
+    main BlockChain, so block is only set for blocks on side forks.
+    '''
+    __slots__ = ("hash", "parent", "height", "work", "children", "block")
+
+    def __init__(self, hash, parent, block=None):
+        self.hash = hash
+        self.parent = parent
+        self.height = 0 if parent is None else parent.height + 1
+        # total work of the fork up to and including this block
+        self.work = 0 if parent is None else parent.work + block_work()
+        self.children = []
+        self.block = block
+
+
+class BlockChainCollection:
+    def __init__(self):
+        self.main_blockchain = None
+        # hash -> BlockNode for every block on every fork
+        self.nodes = {}
+        self.root = None
+        self.tip = None
+
+    def add_blockchain_fork(self, blockchain):
+        '''
+        Adds a verified blockchain, e.g. one loaded from disk or downloaded
+        from a neighbor. The first one becomes the main fork. The blocks of
+        later ones are added to the tree, and the main fork switches to
+        them if they have more work.
+        Returns: True on success, False if the chain has a different genesis block
+        '''
+        if self.main_blockchain is None:
+            self.main_blockchain = blockchain
+            parent = None
+            for height in range(blockchain.length):
+                parent = self._add_node(blockchain.get_hash_at(height), parent)
+            self.root = self.nodes[blockchain.get_hash_at(0)]
+            self.tip = parent
+            return True
+        if blockchain.get_hash_at(0) != self.root.hash:
+            return False
+        for block in blockchain.block_chain[1:]:
+            if self.try_add_block(block) == -1:
+                # the rest of the chain builds on an invalid block
+                break
+        return True
+
+    def try_add_block(self, block, orphan_blocks=None, pending_transactions=None):
+        '''
+        Adds a block to the fork that it extends. Blocks whose parent we
+        haven't seen are kept in orphan_blocks until the parent arrives.
+        pending_transactions (tid -> Transaction) is updated with the
+        transactions that the main fork gains or loses.
+        Returns: 0 if the block is an orphan, 1 if it extended the main fork,
+                 2 if it is on a side fork (or was already added), 3 if the
+                 main fork switched to a new branch, -1 if it is invalid
+        '''
+        rc = self._connect(block, pending_transactions)
+        if rc == 0 and orphan_blocks is not None:
+            orphan_blocks.add(block)
+        if rc <= 0 or not orphan_blocks:
+            return rc
+        # the block may be the missing parent of some orphans
+        parents = [block.hash]
+        while parents:
+            hash = parents.pop()
+            for orphan in [o for o in orphan_blocks if o.prev_hash == hash]:
+                orphan_blocks.discard(orphan)
+                orphan_rc = self._connect(orphan, pending_transactions)
+                if orphan_rc > 0:
+                    parents.append(orphan.hash)
+                if orphan_rc == 3:
+                    rc = 3
+        return rc
+
+    def _connect(self, block, pending_transactions):
+        '''
+        Adds a block whose parent is in the tree
+        Returns: the same codes as try_add_block
+        '''
+        if block.hash in self.nodes:
+            return 2
+        parent = self.nodes.get(block.prev_hash)
+        if parent is None:
+            return 0
+        if parent is self.tip:
+            if not self.main_blockchain.validate_block(block):
+                return -1
+            self.main_blockchain.add_block(block)
+            self.tip = self._add_node(block.hash, parent)
+            self._update_pending(pending_transactions, [block])
+            return 1
+        # balances are only known for the main fork, so a side block's
+        # transactions are checked against the ledger if its fork takes over
+        if block.index != parent.height + 1 or not block.verify_proof_of_work():
+            return -1
+        if block.has_repeated_transactions():
+            return -1
+        if not block.verify_transaction_authenticities():
+            return -1
+        node = self._add_node(block.hash, parent, block)
+        if node.work <= self.tip.work:
+            return 2
+        return 3 if self._switch_to(node, pending_transactions) else -1
+
+    def _switch_to(self, node, pending_transactions):
+        '''
+        Makes the fork ending at node the main fork
+        Returns: True on success, False if one of its blocks was invalid
+        '''
+        branch = []
+        fork = node
+        while fork.block is not None:
+            branch.append(fork)
+            fork = fork.parent
+        branch.reverse()
+        main = self.main_blockchain
+        # blocks leaving the main fork are kept in their nodes
+        old_branch = []
+        n = self.tip
+        while n is not fork:
+            n.block = main.get_block_by_hash(n.hash)
+            old_branch.append(n)
+            n = n.parent
+        new_blocks = [n.block for n in branch]
+        bad = main.reorganize(fork.height, new_blocks)
+        if bad != -1:
+            for n in old_branch:
+                n.block = None
+            # the blocks before the bad one are valid and stay as a side fork
+            # (they have no more work than the main fork, or it would have
+            # switched to them already), as do their other children
+            self._remove(branch[bad])
+            return False
+        for n in branch:
+            n.block = None
+        self.tip = node
+        self._update_pending(pending_transactions, new_blocks, [n.block for n in old_branch])
+        return True
+
+    def _update_pending(self, pending_transactions, connected, disconnected=()):
+        if pending_transactions is None:
+            return
+        for block in connected:
+            for txn in block.transactions:
+                pending_transactions.pop(txn.tid, None)
+        for block in disconnected:
+            for txn in block.transactions:
+                if txn.tid not in self.main_blockchain.accepted_transactions:
+                    pending_transactions[txn.tid] = txn
+
+    def _add_node(self, hash, parent, block=None):
+        node = BlockNode(hash, parent, block)
+        if parent is not None:
+            parent.children.append(node)
+        self.nodes[hash] = node
+        return node
+
+    def _remove(self, node):
+        '''
+        Removes a side fork node and everything built on it
+        '''
+        node.parent.children.remove(node)
+        stack = [node]
+        while stack:
+            n = stack.pop()
+            del self.nodes[n.hash]
+            stack.extend(n.children)
+
+    def prune_short_forks(self):
+        '''
+        Discards side forks whose tips have fallen SIDE_BLOCKCHAIN_DIFFERENCE_FOR_PRUNING
+        or more blocks behind the main fork
+        '''
+        cutoff = self.tip.height - Constants.SIDE_BLOCKCHAIN_DIFFERENCE_FOR_PRUNING
+        short_tips = [n for n in self.nodes.values()
+                      if n.block is not None and not n.children and n.height <= cutoff]
+        for node in short_tips:
+            # remove blocks back to where the fork branches off
+            while node.block is not None and not node.children:
+                node.parent.children.remove(node)
+                del self.nodes[node.hash]
+                node = node.parent
+
+    def get_block_by_hash(self, hash, orphan_blocks=()):
+        '''
+        Returns the block with the given hash from any fork or from the
+        orphan blocks, or None if we don't have it. The genesis block is
+        part of the protocol, so it is never returned, and neither are the
+        header only blocks of a snapshot, since no peer could check them.
+        '''
+        node = self.nodes.get(hash)
+        if node is not None:
+            block = node.block if node.block is not None else self.main_blockchain.get_block_by_hash(hash)
+            if not isinstance(block, Block) or isinstance(block, HeaderBlock):
+                return None
+            return block
+        for block in orphan_blocks:
+            if block.hash == hash:
+                return block
+        return None
+
+    def __len__(self):
+        return len(self.nodes)
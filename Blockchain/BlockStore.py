@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+'''
+Append-only on-disk storage for the blocks of a chain.
+
+Blocks are appended to blocks.dat as length prefixed JSON records.
+blocks.idx holds one fixed size record per block (height, hash, offset,
+length) so the whole index can be read on startup and any block found
+without scanning. Block lookups read through a memory map of blocks.dat.
+The genesis block is not stored, every node builds it from genesis.json.
+'''
+import os
+import mmap
+import json
+import struct
+from .BlockChain import Block
+
+DATA_FILE = "blocks.dat"
+INDEX_FILE = "blocks.idx"
+# length of the JSON that follows in blocks.dat
+RECORD_HEADER_FORMAT = ">I"
+RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER_FORMAT)
+# height, block hash, offset of the record in blocks.dat, record length
+INDEX_FORMAT = ">I32sQI"
+INDEX_SIZE = struct.calcsize(INDEX_FORMAT)
+
+class BlockStore:
+    # only blocks are saved, BlockChain keeps the ledger state in memory
+    keeps_state = False
+
+    def __init__(self, directory):
+        '''
+        Opens (or creates) the block store in the given directory.
+        A partially written block from a crash is discarded.
+        '''
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.data_path = os.path.join(directory, DATA_FILE)
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        # height -> (offset, length) and hash -> height
+        self.offsets = {}
+        self.heights = {}
+        self.map = None
+        self._load_index()
+        self.data = open(self.data_path, "ab")
+        self.index = open(self.index_path, "ab")
+
+    def _load_index(self):
+        '''
+        Reads the index file and truncates both files after the
+        last complete block
+        '''
+        data_end = 0
+        index_end = 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as f:
+                raw = f.read()
+            data_size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+            for pos in range(0, len(raw) - INDEX_SIZE + 1, INDEX_SIZE):
+                height, hash, offset, length = struct.unpack_from(INDEX_FORMAT, raw, pos)
+                if offset + length > data_size:
+                    # the index got ahead of the data, stop at the last full block
+                    break
+                self.offsets[height] = (offset, length)
+                self.heights[hash.hex()] = height
+                data_end = offset + length
+                index_end = pos + INDEX_SIZE
+        for path, end in ((self.index_path, index_end), (self.data_path, data_end)):
+            if os.path.exists(path) and os.path.getsize(path) > end:
+                with open(path, "r+b") as f:
+                    f.truncate(end)
+
+    def append(self, block, deltas=None):
+        '''
+        Appends a block to the end of the store. Blocks must be
+        appended in height order, starting at height 1.
+        Balance deltas are accepted for compatibility with SQLiteStore
+        but not saved, they can be recomputed from the block.
+        '''
+        if block.index != len(self) + 1:
+            raise ValueError(f"Expected block {len(self) + 1}, got block {block.index}")
+        record = json.dumps(block.to_json()).encode()
+        offset = self.data.tell()
+        self.data.write(struct.pack(RECORD_HEADER_FORMAT, len(record)) + record)
+        self.data.flush()
+        os.fsync(self.data.fileno())
+        # the index is written after the data, so an index record
+        # always points at a complete block
+        length = RECORD_HEADER_SIZE + len(record)
+        self.index.write(struct.pack(INDEX_FORMAT, block.index, bytes.fromhex(block.hash), offset, length))
+        self.index.flush()
+        os.fsync(self.index.fileno())
+        self.offsets[block.index] = (offset, length)
+        self.heights[block.hash] = block.index
+
+    def pop(self, block, deltas=None):
+        '''
+        Removes the tip block when the chain is reorganized,
+        truncating both files back to the block before it
+        '''
+        height = len(self)
+        if block.index != height:
+            raise ValueError(f"Block {block.index} is not the tip of the store")
+        offset, length = self.offsets.pop(height)
+        del self.heights[block.hash]
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        # the index goes first so it never points past the data
+        self.index.truncate((height - 1) * INDEX_SIZE)
+        self.index.flush()
+        os.fsync(self.index.fileno())
+        self.data.truncate(offset)
+        self.data.flush()
+        os.fsync(self.data.fileno())
+        # append() uses tell() for the next offset, move it back to the new end
+        self.data.seek(0, os.SEEK_END)
+        self.index.seek(0, os.SEEK_END)
+
+    def _read(self, offset, length):
+        if self.map is None or offset + length > len(self.map):
+            # the data file grew since it was mapped
+            if self.map is not None:
+                self.map.close()
+            with open(self.data_path, "rb") as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        record = self.map[offset + RECORD_HEADER_SIZE:offset + length]
+        return Block.from_json(json.loads(record))
+
+    def get_by_height(self, height):
+        '''
+        Returns the block at a height, or None if it isn't stored
+        '''
+        location = self.offsets.get(height)
+        if location is None:
+            return None
+        return self._read(*location)
+
+    def get_by_hash(self, hash):
+        '''
+        Returns the block with the given hash, or None if it isn't stored
+        '''
+        height = self.heights.get(hash)
+        if height is None:
+            return None
+        return self.get_by_height(height)
+
+    def blocks(self):
+        '''
+        Yields every stored block in height order
+        '''
+        for height in range(1, len(self) + 1):
+            yield self.get_by_height(height)
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.data.close()
+        self.index.close()
+
+    def __len__(self):
+        return len(self.offsets)
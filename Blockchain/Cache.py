@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+'''
+A small bounded cache with least recently used eviction
+'''
+from collections import OrderedDict
+
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        '''
+        Returns the value stored for key (marking it as recently used),
+        or default if it isn't cached
+        '''
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        '''
+        Stores a value, evicting the least recently used entry when full
+        '''
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        '''
+        Returns a dictionary of the cache's size and hit/miss counters
+        '''
+        return {"Size": len(self.entries), "Max_Size": self.maxsize,
+                "Hits": self.hits, "Misses": self.misses}
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
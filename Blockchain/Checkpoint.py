@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+'''
+Trusted checkpoints for incremental blockchain verification.
+
+After a chain verifies, the height and hash of its tip are recorded
+together with the balances at that point. Verifying a chain that
+contains a checkpointed block can then start from the checkpoint
+instead of replaying every block from genesis. A checkpoint is found
+by its (height, hash) alone: the hash commits to the block's contents
+and everything before it, and the blocks before it are rechecked
+unless they are the ones that were verified (see verify_blockchain).
+
+Every checkpoint keeps its own copy of the balances, so the memory
+they use grows with the number of addresses times MAX_CHECKPOINTS.
+'''
+import json
+from hashlib import sha256
+from collections import OrderedDict, defaultdict
+from . import Constants
+
+def balances_digest(balances):
+    '''
+    Returns the hex sha256 of a balance dictionary.
+    Zero balances are left out, so a defaultdict that has only been read
+    from digests the same as one without those entries.
+    '''
+    state = sorted((address, int(balance)) for address, balance in balances.items() if balance)
+    return sha256(json.dumps(state).encode()).hexdigest()
+
+class Checkpoints:
+    def __init__(self, maxsize=Constants.MAX_CHECKPOINTS):
+        self.maxsize = maxsize
+        # block hash -> (height, balances)
+        self.checkpoints = OrderedDict()
+
+    def record(self, height, hash, balances):
+        '''
+        Records the balances after the block at height (with the given hash)
+        has been verified. Only the most recent maxsize checkpoints are kept.
+        '''
+        if height == 0:
+            # nothing to save by resuming from genesis
+            return
+        self.checkpoints[hash] = (height, {address: balance for address, balance in balances.items() if balance})
+        self.checkpoints.move_to_end(hash)
+        while len(self.checkpoints) > self.maxsize:
+            self.checkpoints.popitem(last=False)
+
+    def find(self, blockchain):
+        '''
+        Finds the highest checkpoint that is part of the given blockchain.
+        Returns: (height, balances) with a fresh copy of the balances,
+        or None if the chain contains no checkpointed block
+        '''
+        best = None
+        for hash, (height, balances) in self.checkpoints.items():
+            if height >= blockchain.length or blockchain.get_hash_at(height) != hash:
+                continue
+            if best is None or height > best[0]:
+                best = (height, balances)
+        if best is None:
+            return None
+        height, balances = best
+        return height, defaultdict(int, balances)
+
+    def clear(self):
+        self.checkpoints.clear()
+
+    def __len__(self):
+        return len(self.checkpoints)
+
+# checkpoints shared by every chain verified in this process
+default_checkpoints = Checkpoints()
@@ -0,0 +1,219 @@
+'''
+Long lived connections to other nodes, keyed by their (hostname, port).
+
+Relaying a block or transaction reuses the connection to each neighbor
+instead of connecting and closing every time. A connection that broke
+is reopened the next time it is needed, and an address that keeps
+failing is only retried after a delay that doubles with each failure.
+'''
+
+import time
+import select
+import socket
+import asyncio
+from .Messaging import Messaging
+from .AsyncMessaging import AsyncMessaging
+from . import Constants
+
+class Backoff:
+    def __init__(self, base=Constants.RECONNECT_BACKOFF, maximum=Constants.MAX_RECONNECT_BACKOFF):
+        self.base = base
+        self.maximum = maximum
+        # address -> (number of failures in a row, time to wait until)
+        self.failures = {}
+
+    def ready(self, addr):
+        '''
+        Returns: True if a connection to the address may be tried now
+        '''
+        entry = self.failures.get(addr)
+        return entry is None or time.monotonic() >= entry[1]
+
+    def failed(self, addr):
+        count = self.failures.get(addr, (0, 0))[0] + 1
+        delay = min(self.base * 2 ** (count - 1), self.maximum)
+        self.failures[addr] = (count, time.monotonic() + delay)
+
+    def succeeded(self, addr):
+        self.failures.pop(addr, None)
+
+def _is_open(sock):
+    '''
+    Checks that the other side hasn't closed a socket, without
+    taking any bytes that are waiting to be read from it
+    '''
+    if sock.fileno() < 0:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return not readable or sock.recv(1, socket.MSG_PEEK) != b""
+    except OSError:
+        return False
+
+class ConnectionPool:
+    def __init__(self, connections=None):
+        '''
+        Sockets the pool opens are added to the connections dict (if given)
+        so that a select loop reads whatever peers send back on them
+        '''
+        self.connections = connections
+        # (hostname, port) -> socket
+        self.sockets = {}
+        self.backoff = Backoff()
+
+    def add(self, addr, sock):
+        '''
+        Adds a connection that the peer opened to us, e.g. a miner's
+        '''
+        self.sockets[addr] = sock
+        self.backoff.succeeded(addr)
+
+    def get(self, addr):
+        '''
+        Returns: an open socket to the address, or None if it can't be
+        connected to (or is waiting out its backoff)
+        '''
+        sock = self.sockets.get(addr)
+        if sock is not None:
+            if _is_open(sock):
+                return sock
+            self.discard(addr)
+        if not self.backoff.ready(addr):
+            return None
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(Constants.NETWORK_TIMEOUT)
+        try:
+            sock.connect(addr)
+        except OSError:
+            sock.close()
+            self.backoff.failed(addr)
+            return None
+        self.backoff.succeeded(addr)
+        self.sockets[addr] = sock
+        if self.connections is not None:
+            self.connections[sock] = f"{addr[0]}:{addr[1]}"
+        # offer our features, the peer's answer is read with its other messages
+        Messaging.sendMessage(Messaging.hello(), True, sock=sock, connections=self.connections)
+        return sock
+
+    def send(self, addr, message):
+        '''
+        Sends a message over the pooled connection to an address. If the
+        connection turns out to be broken, it is reopened and the message
+        is sent once more.
+        Returns: 1 if successful, 0 otherwise
+        '''
+        for _ in range(2):
+            sock = self.get(addr)
+            if sock is None:
+                return 0
+            if Messaging.sendMessage(message, True, sock=sock, connections=self.connections):
+                return 1
+            self.discard(addr)
+        self.backoff.failed(addr)
+        return 0
+
+    def broadcast(self, addrs, message):
+        '''
+        Returns: the number of addresses the message was sent to
+        '''
+        return sum(self.send(addr, message) for addr in addrs)
+
+    def discard(self, addr):
+        sock = self.sockets.pop(addr, None)
+        if sock is not None:
+            Messaging._closeSocket(sock, self.connections)
+
+    def close(self):
+        for addr in list(self.sockets):
+            self.discard(addr)
+
+    def __contains__(self, addr):
+        return addr in self.sockets
+
+    def __len__(self):
+        return len(self.sockets)
+
+class AsyncConnectionPool:
+    def __init__(self, on_message=None):
+        '''
+        Messages that peers send back on pooled connections are passed to
+        on_message(message, addr, writer) if it is given
+        '''
+        self.on_message = on_message
+        # (hostname, port) -> writer
+        self.writers = {}
+        # one connection attempt per address at a time
+        self.locks = {}
+        self.backoff = Backoff()
+        self.readers = set()
+
+    async def get(self, addr):
+        '''
+        Returns: the writer of an open connection to the address, or None
+        if it can't be connected to (or is waiting out its backoff)
+        '''
+        lock = self.locks.setdefault(addr, asyncio.Lock())
+        async with lock:
+            writer = self.writers.get(addr)
+            if writer is not None and not writer.is_closing():
+                return writer
+            self.writers.pop(addr, None)
+            if not self.backoff.ready(addr):
+                return None
+            connection = await AsyncMessaging.connect(addr)
+            if connection is None:
+                self.backoff.failed(addr)
+                return None
+            self.backoff.succeeded(addr)
+            reader, writer = connection
+            self.writers[addr] = writer
+            # offer our features, the peer's answer is read with its other messages
+            await AsyncMessaging.sendMessage(writer, Messaging.hello())
+            task = asyncio.create_task(self._read(addr, reader, writer))
+            self.readers.add(task)
+            task.add_done_callback(self.readers.discard)
+            return writer
+
+    async def _read(self, addr, reader, writer):
+        while not writer.is_closing():
+            message = await AsyncMessaging.readMessage(reader, writer)
+            if message is not None and self.on_message is not None:
+                await self.on_message(message, addr, writer)
+        if self.writers.get(addr) is writer:
+            del self.writers[addr]
+
+    async def send(self, addr, message):
+        '''
+        Sends a message over the pooled connection to an address. If the
+        connection turns out to be broken, it is reopened and the message
+        is sent once more.
+        Returns: 1 if successful, 0 otherwise
+        '''
+        for _ in range(2):
+            writer = await self.get(addr)
+            if writer is None:
+                return 0
+            if await AsyncMessaging.sendMessage(writer, message):
+                return 1
+        self.backoff.failed(addr)
+        return 0
+
+    async def broadcast(self, addrs, message):
+        '''
+        Sends a message to every address at once
+        Returns: the number of addresses it was sent to
+        '''
+        results = await asyncio.gather(*[self.send(addr, message) for addr in addrs])
+        return sum(results)
+
+    async def close(self):
+        for writer in list(self.writers.values()):
+            await AsyncMessaging.close(writer)
+        self.writers.clear()
+
+    def __contains__(self, addr):
+        return addr in self.writers
+
+    def __len__(self):
+        return len(self.writers)
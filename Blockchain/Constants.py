@@ -1,14 +1,32 @@
-# We use a large buffer size of 256 Kb so that
-# we can handle sending full blockchains
+import os
+
+# Messages are read from sockets in chunks of up to 256 Kb
 BUF_SIZE = 262144
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024 # larger frames are rejected and the connection closed
+COMPRESSION_THRESHOLD = 1024 # messages smaller than this many bytes are sent uncompressed
+COMPRESSION_LEVEL = 6 # zlib level (1 is fastest, 9 compresses best)
 PROJECT_NAME = "JBnetwork"
 DIFFICULTY = 4 # number of leading zeros on computed hash
 COINBASE = 10 # reward for mining bloack (we do not support depreciation of value for mining blocks)
 TPB = 5 # number of transactions per block
+BLOCK_VERSION = 1 # version number packed into every block header
+ADDRESS_SIZE = 20 # bytes in an address (truncated sha256 of a public key)
+KEY_CACHE_SIZE = 4096 # number of parsed keys kept in memory for signing and verifying
+SIGNATURE_CACHE_SIZE = 100000 # number of verified transaction signatures remembered
+MAX_CHECKPOINTS = 16 # verified chain tips remembered so later verifications can resume from them (each keeps a copy of the balances)
+VERIFY_PROCESSES = 0 # processes used to check signatures when syncing a chain (0 uses every core)
+PARALLEL_VERIFY_THRESHOLD = 1000 # batches smaller than this are verified without a process pool, so only syncing a whole chain uses one (a block holds TPB transactions)
+SNAPSHOT_INTERVAL = 100 # full nodes snapshot their ledger every this many blocks
 NEIGHBOR_PING_INTERVAL = 30
+NETWORK_TIMEOUT = 5 # seconds to wait on a peer before giving up on it
+RECONNECT_BACKOFF = 0.5 # seconds before retrying a peer we failed to connect to, doubled on every failure
+MAX_RECONNECT_BACKOFF = 60
 BLOCKCHAIN_FORK_PRUNING_INTERVAL = 30 # how often we prune short forks
 # if a side fork blockchain falls behind the main branch by this amount, it will be
 # discarded the next time we run a pruning function
 SIDE_BLOCKCHAIN_DIFFERENCE_FOR_PRUNING = 3
 # The genesis hash should always be the same
-GENESIS_HASH = "12f44f7f30883cf7109451e7cfed935825644c1cc7d33653729d5dccaf03e51c"
+GENESIS_HASH = "d5001b08c8667f7059332ba1a4d477a15eae15743c9afb75838a04972b386fc6"
+# where the genesis block is read from, set JB_GENESIS_PATH to use another file
+GENESIS_PATH = os.environ.get("JB_GENESIS_PATH",
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "data", "genesis.json"))
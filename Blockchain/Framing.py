@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+'''
+Framing for messages sent over TCP.
+
+TCP is a stream, so a single recv can return part of a message or
+several messages glued together. Every message is sent as a frame: a
+header with the length of the payload and a flags byte, followed by
+the payload. A FrameReader is fed whatever recv returns and splits off
+the frames that are complete, keeping any partial frame for next time.
+'''
+import struct
+from collections import deque
+from . import Constants
+
+# payload length, flags
+FRAME_HEADER_FORMAT = ">IB"
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER_FORMAT)
+# flag bits, a frame without any has a JSON payload
+FLAG_BINARY = 0x01 # payload is in the binary encoding of WireFormat.py
+FLAG_COMPRESSED = 0x02 # payload is the next part of the connection's zlib stream
+
+def encode_frame(payload, flags=0):
+    '''
+    Returns the payload with a frame header in front of it
+    '''
+    if len(payload) > Constants.MAX_MESSAGE_SIZE:
+        raise ValueError(f"Message of {len(payload)} bytes is too large to send")
+    return struct.pack(FRAME_HEADER_FORMAT, len(payload), flags) + payload
+
+class FrameReader:
+    def __init__(self):
+        self.buffer = bytearray()
+        # (flags, payload) of complete frames that haven't been taken yet
+        self.frames = deque()
+
+    def feed(self, data):
+        '''
+        Adds received bytes to the buffer and splits off every frame that
+        is now complete.
+        Raises ValueError if a frame is larger than Constants.MAX_MESSAGE_SIZE,
+        after which the stream can't be trusted and should be closed.
+        '''
+        self.buffer += data
+        pos = 0
+        while len(self.buffer) - pos >= FRAME_HEADER_SIZE:
+            length, flags = struct.unpack_from(FRAME_HEADER_FORMAT, self.buffer, pos)
+            if length > Constants.MAX_MESSAGE_SIZE:
+                raise ValueError(f"Frame of {length} bytes is too large")
+            end = pos + FRAME_HEADER_SIZE + length
+            if end > len(self.buffer):
+                # the rest of this frame hasn't arrived yet
+                break
+            self.frames.append((flags, bytes(self.buffer[pos + FRAME_HEADER_SIZE:end])))
+            pos = end
+        if pos:
+            del self.buffer[:pos]
+
+    def next_frame(self):
+        '''
+        Returns: (flags, payload) of the oldest complete frame, or None if there isn't one
+        '''
+        return self.frames.popleft() if self.frames else None
+
+    def __len__(self):
+        '''
+        Number of buffered bytes that aren't part of a complete frame yet
+        '''
+        return len(self.buffer)
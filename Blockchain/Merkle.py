@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+'''
+Builds Merkle trees over the transactions of a block so a block header
+can commit to all of them with a single 32 byte root
+'''
+from hashlib import sha256
+
+class MerkleTree:
+    def __init__(self, leaves):
+        '''
+        Leaves are the byte strings to commit to (normally the serialized
+        transactions). Each one is hashed before building the tree.
+        '''
+        level = [sha256(leaf).digest() for leaf in leaves]
+        self.levels = [level]
+        while len(level) > 1:
+            if len(level) % 2:
+                # odd levels pair the last node with itself
+                level = level + [level[-1]]
+            level = [sha256(level[i] + level[i+1]).digest() for i in range(0, len(level), 2)]
+            self.levels.append(level)
+
+    def root(self):
+        '''
+        Returns the 32 byte root of the tree (all zeros for an empty tree)
+        '''
+        if not self.levels[0]:
+            return bytes(32)
+        return self.levels[-1][0]
+
+    def proof(self, index):
+        '''
+        Returns the list of (sibling hash, sibling is on the left) pairs
+        needed to get from the leaf at index up to the root
+        '''
+        path = []
+        for level in self.levels[:-1]:
+            if index % 2:
+                path.append((level[index-1], True))
+            elif index + 1 < len(level):
+                path.append((level[index+1], False))
+            else:
+                path.append((level[index], False))
+            index //= 2
+        return path
+
+    @staticmethod
+    def verify_proof(leaf, proof, root):
+        '''
+        Checks that a leaf is committed to by root using a path from proof()
+        '''
+        h = sha256(leaf).digest()
+        for sibling, left in proof:
+            if left:
+                h = sha256(sibling + h).digest()
+            else:
+                h = sha256(h + sibling).digest()
+        return h == root
@@ -12,8 +12,17 @@ and receiving different types of messages.
 import socket
 import json
 import http.client
+import base64
+import weakref
+import zlib
 from .BlockChain import BlockChain, Block
+from .Snapshot import Snapshot
+from .Framing import encode_frame, FrameReader, FLAG_BINARY, FLAG_COMPRESSED
+from .WireFormat import encode_message, decode_message
 from .Transaction import Transaction
+from .Signatures import DEFAULT_SCHEME, is_valid_scheme
+from .Address import is_address
+from . import Constants
 
 class MessageTypes:
     Get_Seed_Nodes = "Get_Seed_Nodes"
@@ -30,8 +39,30 @@ class MessageTypes:
     Get_Blockchain_Response = "Get_Blockchain_Response"
     Send_Transaction_Response = "Send_Transaction_Response"
     Get_Block = "Get_Block"
+    Get_Snapshot = "Get_Snapshot"
+    Get_Snapshot_Response = "Get_Snapshot_Response"
+    Hello = "Hello"
+    Hello_Response = "Hello_Response"
+
+# socket -> FrameReader holding the bytes read from it that aren't a full message yet
+_readers = weakref.WeakKeyDictionary()
+# connection (socket or asyncio writer) -> features both ends of it support
+_features = weakref.WeakKeyDictionary()
+# connection -> zlib stream of the compressed frames sent on it. One stream
+# per connection lets a message reuse what earlier ones sent (every block
+# repeats the same public keys), which compressing each alone can't.
+_compressors = weakref.WeakKeyDictionary()
+# connection (socket or asyncio reader) -> zlib stream of the compressed frames read from it
+_decompressors = weakref.WeakKeyDictionary()
 
 class Messaging:
+    # optional protocol features this node supports, offered to peers in a
+    # Hello message. Until a peer has answered with the features it shares
+    # with us, everything sent to it is plain JSON.
+    #   binary: blocks and transactions in the encoding of WireFormat.py
+    #   zlib: messages of at least Constants.COMPRESSION_THRESHOLD bytes are compressed
+    FEATURES = ("binary", "zlib")
+
     @staticmethod
     def pingNode(addr):
         '''
@@ -71,20 +102,31 @@ class Messaging:
                 return False
             return True
         elif msgtype == MessageTypes.Get_Blockchain:
-            if len(message.keys()) != 1:
+            # the index to start sending blocks from is optional
+            if len(message.keys()) != (1 if "Start_Index" not in message else 2):
+                return False
+            start_index = message.get("Start_Index", 1)
+            if type(start_index) != int or start_index < 1:
                 return False
             return True
         elif msgtype == MessageTypes.Send_Transaction:
-            if len(message.keys()) != 7:
+            # the signature scheme is optional and defaults to RSA
+            scheme = message.get("Scheme", DEFAULT_SCHEME)
+            if not is_valid_scheme(scheme):
+                return False
+            if len(message.keys()) != (8 if "Scheme" not in message else 9):
                 return False
             tid = message.get("Transaction_ID", 0)
-            if not tid or type(tid) != str:
+            if not tid or type(tid) != str or len(tid) != 64:
+                return False
+            timestamp = message.get("Timestamp", 0)
+            if not timestamp or type(timestamp) != str:
                 return False
             sender_key = message.get("Sender_Public_Key", 0)
             if not sender_key or type(sender_key) != str:
                 return False
-            recipient_key = message.get("Recipient_Public_Key", 0)
-            if not recipient_key or type(recipient_key) != str:
+            recipient = message.get("Recipient_Address", 0)
+            if not is_address(recipient):
                 return False
             amount = message.get("Amount", 0)
             if not amount or type(int(amount)) != int:
@@ -105,8 +147,8 @@ class Messaging:
             block_index = message.get("Block_Index", -1)
             if block_index == -1 or type(block_index) != int:
                 return False
-            miner_pk = message.get("Miner_PK", 0)
-            if not miner_pk or type(miner_pk) != str:
+            miner = message.get("Miner_Address", 0)
+            if not is_address(miner):
                 return False
             prev_hash = message.get("Prev_Hash", 0)
             if not prev_hash or type(prev_hash) != str:
@@ -148,8 +190,8 @@ class Messaging:
         elif msgtype == MessageTypes.Get_Neighbors_Response:
             if len(message.keys()) != 2:
                 return False
-            seed_nodes = message.get("Neigbors", 0)
-            if not seed_nodes:
+            seed_nodes = message.get("Neighbors", None)
+            if seed_nodes is None:
                 return False
             if type(seed_nodes) != list:
                 return False
@@ -196,6 +238,10 @@ class Messaging:
             return True
 
         elif msgtype == MessageTypes.Get_Blockchain_Response:
+            if len(message.keys()) == 2:
+                # the sender has no blocks from the requested index on
+                num_blocks_left = message.get("Num_Blocks_Left_To_Come", -1)
+                return type(num_blocks_left) == int and num_blocks_left == 0
             if len(message.keys()) != 8:
                 return False
             block_index = message.get("Block_Index", -1)
@@ -214,8 +260,8 @@ class Messaging:
                     return False
                 # valid genesis block
                 return True
-            miner_pk = message.get("Miner_PK", 0)
-            if not miner_pk or type(miner_pk) != str:
+            miner = message.get("Miner_Address", 0)
+            if not is_address(miner):
                 return False
             prev_hash = message.get("Prev_Hash", 0)
             if not prev_hash or type(prev_hash) != str:
@@ -253,46 +299,106 @@ class Messaging:
                 return False
             return True
 
+        elif msgtype == MessageTypes.Get_Snapshot:
+            if len(message.keys()) != 1:
+                return False
+            return True
+
+        elif msgtype == MessageTypes.Get_Snapshot_Response:
+            if len(message.keys()) != 4:
+                return False
+            height = message.get("Height", None)
+            if type(height) != int or height < 0:
+                return False
+            digest = message.get("Digest", None)
+            if type(digest) != str or len(digest) != 64:
+                return False
+            snapshot = message.get("Snapshot", None)
+            if not snapshot or type(snapshot) != str:
+                return False
+            return True
+
+        elif msgtype == MessageTypes.Hello or msgtype == MessageTypes.Hello_Response:
+            if len(message.keys()) != 2:
+                return False
+            features = message.get("Features", None)
+            if type(features) != list:
+                return False
+            for item in features:
+                if type(item) != str:
+                    return False
+            return True
+
         return False
 
     @staticmethod
-    def readMessage(sock, connections = None):
+    def _encodeMessage(message, conn=None):
         '''
-        Attempts to read from the provided socket. Handles socket issues
-        and invalid message formats. Will close sockets with issues and
-        remove them from the provided connections dictionary. Converts
-        message bytes to a python dictionary and returns it, otherwise indicates
-        an error.
-        Returns: None if invalid message or socket issue, otherwise a dict
-        representing the message
+        Returns: the bytes of a message dict framed for sending on a connection
+        (see Framing.py), encoded and compressed as its features allow.
+        The frames must be sent in the order they were encoded.
         '''
-        try:
-            data = sock.recv(Constants.BUF_SIZE)
-        except ConnectionResetError:
-            # don't exit if client ends connection,
-            # just remove the connection from the dict
-            sock.close()
-            if connections is not None:
-                del connections[sock]
-            return None
-        except socket.timeout:
-            # in cases where a socket has a timeout set, return None
-            # when we hit that timeout
-            return None
-        if not data:
-            # client may have ended the connection
-            sock.close()
-            if connections is not None:
-                del connections[sock]
-            return None
-        if connections is not None:
+        features = Messaging.getFeatures(conn) if conn is not None else ()
+        payload = None
+        flags = 0
+        if "binary" in features:
             try:
-                print(f"Handling message from {connections[sock]}...")
-            except:
+                payload = encode_message(message)
+                flags = FLAG_BINARY
+            except ValueError:
+                # no binary encoding for this message, send it as JSON
                 pass
+        if payload is None:
+            payload = json.dumps(message).encode('utf-8')
+        if "zlib" in features and len(payload) >= Constants.COMPRESSION_THRESHOLD:
+            compressor = _compressors.get(conn)
+            if compressor is None:
+                compressor = _compressors[conn] = zlib.compressobj(Constants.COMPRESSION_LEVEL)
+            # a sync flush ends the frame on a byte boundary, so the peer can
+            # decompress all of it without waiting for the next one
+            payload = compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            flags |= FLAG_COMPRESSED
+        return encode_frame(payload, flags)
+
+    @staticmethod
+    def _decompress(payload, conn):
+        '''
+        Returns: the payload of a compressed frame read from a connection
+        Raises ValueError if it is corrupt or decompresses to more than
+        Constants.MAX_MESSAGE_SIZE bytes.
+        '''
+        decompressor = _decompressors.get(conn) if conn is not None else None
+        if decompressor is None:
+            decompressor = zlib.decompressobj()
+            if conn is not None:
+                _decompressors[conn] = decompressor
         try:
-            data = str(data, 'utf-8') # convert to string
-            message = json.loads(data)
+            payload = decompressor.decompress(payload, Constants.MAX_MESSAGE_SIZE)
+        except zlib.error as e:
+            raise ValueError(f"Corrupt compressed frame: {e}")
+        if decompressor.unconsumed_tail:
+            raise ValueError("Compressed frame is too large")
+        return payload
+
+    @staticmethod
+    def _decodeFrame(flags, payload, conn=None):
+        '''
+        Converts the payload of a frame read from a connection to a
+        python dictionary and checks it.
+        Raises ValueError if a compressed frame can't be decompressed, which
+        leaves the connection's zlib stream broken, so it must be closed.
+        Returns: None if invalid message, otherwise a dict representing the message
+        '''
+        if flags & FLAG_COMPRESSED:
+            payload = Messaging._decompress(payload, conn)
+        try:
+            if flags & ~(FLAG_BINARY | FLAG_COMPRESSED):
+                # no other payload formats are defined
+                raise ValueError(f"Unknown frame flags {flags}")
+            if flags & FLAG_BINARY:
+                message = decode_message(payload)
+            else:
+                message = json.loads(str(payload, 'utf-8'))
             # check that message is a valid message form
             print(f"Message to be validated: {message}")
             if Messaging._isValidMessage(message):
@@ -306,6 +412,146 @@ class Messaging:
             pass
         return None
 
+    @staticmethod
+    def hello(response=False):
+        '''
+        Returns: a Hello message offering our features (or the response to one)
+        '''
+        msgtype = MessageTypes.Hello_Response if response else MessageTypes.Hello
+        return {"Type": msgtype, "Features": list(Messaging.FEATURES)}
+
+    @staticmethod
+    def getFeatures(conn):
+        '''
+        Returns: the features that both ends of a connection support
+        '''
+        return _features.get(conn, frozenset())
+
+    @staticmethod
+    def _noteFeatures(conn, message):
+        '''
+        Records the features a peer offered in a Hello (or its response)
+        that we support too
+        '''
+        if message.get("Type") in (MessageTypes.Hello, MessageTypes.Hello_Response):
+            _features[conn] = frozenset(message["Features"]).intersection(Messaging.FEATURES)
+
+    @staticmethod
+    def _dropStreams(*conns):
+        '''
+        Forgets the zlib streams of a closed connection
+        '''
+        for conn in conns:
+            if conn is not None:
+                _compressors.pop(conn, None)
+                _decompressors.pop(conn, None)
+
+    @staticmethod
+    def _closeSocket(sock, connections):
+        sock.close()
+        _readers.pop(sock, None)
+        Messaging._dropStreams(sock)
+        if connections is not None and sock in connections:
+            del connections[sock]
+
+    @staticmethod
+    def _receive(sock, connections):
+        '''
+        Reads whatever is available on a socket into its frame reader.
+        Closes the socket (and removes it from connections) if the other
+        side closed it or sent something that isn't a frame.
+        Returns: True if bytes were read, False otherwise
+        '''
+        try:
+            data = sock.recv(Constants.BUF_SIZE)
+        except socket.timeout:
+            # in cases where a socket has a timeout set, return
+            # when we hit that timeout
+            return False
+        except OSError:
+            # don't exit if client ends connection (or resets it),
+            # just remove the connection from the dict
+            Messaging._closeSocket(sock, connections)
+            return False
+        if not data:
+            # client may have ended the connection
+            Messaging._closeSocket(sock, connections)
+            return False
+        reader = _readers.get(sock)
+        if reader is None:
+            reader = _readers[sock] = FrameReader()
+        try:
+            reader.feed(data)
+        except ValueError as e:
+            print(e)
+            Messaging._closeSocket(sock, connections)
+            return False
+        return True
+
+    @staticmethod
+    def readMessage(sock, connections = None):
+        '''
+        Attempts to read one message from the provided socket, waiting until
+        all of it has arrived (or the socket's timeout passes). Messages
+        that arrive after it are kept for the next read. Handles socket issues
+        and invalid message formats. Will close sockets with issues and
+        remove them from the provided connections dictionary. Converts
+        message bytes to a python dictionary and returns it, otherwise indicates
+        an error.
+        Returns: None if invalid message or socket issue, otherwise a dict
+        representing the message
+        '''
+        reader = _readers.get(sock)
+        frame = reader.next_frame() if reader is not None else None
+        while frame is None:
+            if not Messaging._receive(sock, connections):
+                return None
+            frame = _readers[sock].next_frame()
+        if connections is not None:
+            try:
+                print(f"Handling message from {connections[sock]}...")
+            except:
+                pass
+        try:
+            message = Messaging._decodeFrame(*frame, sock)
+        except ValueError as e:
+            print(e)
+            Messaging._closeSocket(sock, connections)
+            return None
+        if message is not None:
+            Messaging._noteFeatures(sock, message)
+        return message
+
+    @staticmethod
+    def readMessages(sock, connections = None):
+        '''
+        Reads once from a socket that select reported as readable, so it
+        never blocks waiting for the rest of a message. Partial messages
+        are kept until the rest arrives.
+        Returns: a list of every valid message that is now complete (can be empty)
+        '''
+        Messaging._receive(sock, connections)
+        reader = _readers.get(sock)
+        messages = []
+        frame = reader.next_frame() if reader is not None else None
+        while frame is not None:
+            if connections is not None:
+                try:
+                    print(f"Handling message from {connections[sock]}...")
+                except:
+                    pass
+            try:
+                message = Messaging._decodeFrame(*frame, sock)
+            except ValueError as e:
+                print(e)
+                Messaging._closeSocket(sock, connections)
+                break
+            if message is not None:
+                Messaging._noteFeatures(sock, message)
+                messages.append(message)
+            frame = reader.next_frame()
+        return messages
+
     @staticmethod
     def _connectToNameServer(sock):
         '''
@@ -434,17 +680,14 @@ class Messaging:
             return 0
         # attempt to send message
         try:
-            msgString = json.dumps(message)
-            msgBytes = bytearray(msgString.encode('utf-8'))
+            msgBytes = Messaging._encodeMessage(message, sock)
             sock.sendall(msgBytes)
         except Exception as e:
             print(e)
             # error sending message
             return 0
         if not keepSocketOpen:
-            sock.close()
-            if connections is not None:
-                del connections[sock]
+            Messaging._closeSocket(sock, connections)
         return 1
 
     @staticmethod
@@ -454,53 +697,88 @@ class Messaging:
         Transaction object with that data (or None if error occurs)
         '''
         try:
-            temp_txn = Transaction(txn_dict["Sender_Public_Key"],
-                                   txn_dict["Recipient_Public_Key"],
-                                   txn_dict["Amount"],
-                                   txn_dict["Transaction_ID"],
-                                   txn_dict["Signature"])
+            if not txn_dict["Signature"]:
+                return None
+            temp_txn = Transaction.from_json(txn_dict)
         except:
             return None
         return temp_txn
 
     @staticmethod
-    def getBlockchain(neighbor):
+    def getSnapshot(neighbor):
+        '''
+        Gets the latest ledger snapshot from a specified neighbor and checks
+        that it isn't corrupt (see Snapshot.py). The neighbor's digest only
+        says what it sent, so the snapshot must still be checked against a
+        trusted digest before its balances are used (see BlockChain.from_snapshot).
+        Returns: a Snapshot if successful, None otherwise
+        '''
+        message = {"Type": MessageTypes.Get_Snapshot}
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(5)
+        try:
+            sock.connect(neighbor)
+        except:
+            # issue connecting to desired full node
+            return None
+        snapshot = None
+        if Messaging.sendMessage(message, True, sock=sock):
+            response = Messaging.readMessage(sock)
+            if response is not None and response.get("Type", "") == MessageTypes.Get_Snapshot_Response:
+                try:
+                    snapshot = Snapshot.from_bytes(base64.b64decode(response["Snapshot"]))
+                except ValueError:
+                    # corrupt or tampered snapshot
+                    snapshot = None
+                if snapshot is not None and snapshot.height != response["Height"]:
+                    snapshot = None
+        sock.close()
+        return snapshot
+
+    @staticmethod
+    def getBlockchain(neighbor, base=None):
         '''
         Gets an entire blockchain from a specified neighbor and
-        validates it.
-        Returns: a BlockChain object if successful, None otherwise
+        validates it. If a base chain is given (e.g. one started from a
+        snapshot), only the blocks after it are requested and they are
+        added to a copy of it.
+        Returns: a BlockChain object if successful (the base itself if the
+        neighbor has no blocks after it), None otherwise
         '''
         blocks = []
+        start_index = 1 if base is None else base.length
         message = {"Type": MessageTypes.Get_Blockchain}
+        if base is not None:
+            message["Start_Index"] = start_index
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.connect(neighbor)
-        rc = Messaging.sendMessage(message, True, neighbor, sock=sock, connections=dict())
+        # offer our features first, so the blocks can come back in binary
+        rc = Messaging.sendMessage(Messaging.hello(), True, neighbor, sock=sock, connections=dict())
+        rc = rc and Messaging.sendMessage(message, True, neighbor, sock=sock, connections=dict())
         if not rc:
             # issue sending message
             return None
         # now read responses from the neighbor, each response should
         # contain a block and the number of remaining of blocks to expect
         sock.settimeout(5)
-        response = Messaging.readMessage(sock)
-        if response is None:
-            print("Request for Blockchain timed out")
-            # issue with response from neighbor
-            return None
-        # handle responses from full node
-        elif response.get("Type", "") == MessageTypes.Get_Blockchain_Response:
-            blocks_left_to_come = response["Blocks_Left_To_Come"]
-        expected_number_of_blocks = blocks_left_to_come + 1
+        blocks_left_to_come = 1
         while blocks_left_to_come:
             response = Messaging.readMessage(sock)
-            if response is None:
+            if response is not None and response.get("Type", "") == MessageTypes.Hello_Response:
+                continue
+            if response is None or response.get("Type", "") != MessageTypes.Get_Blockchain_Response:
+                print("Request for Blockchain timed out")
                 # issue getting one of the blocks from neighbor
                 return None
+            if "Block_Index" not in response:
+                if blocks:
+                    # the neighbor said more blocks were coming
+                    return None
+                # the neighbor has no blocks after the ones we have
+                break
             block_index = response["Block_Index"]
-            blocks_left_to_come = response["Blocks_Left_To_Come"]
-            if blocks_left_to_come != expected_number_of_blocks - len(blocks) - 1:
-                # block with invalid index received
-                return None
-            if expected_number_of_blocks - blocks_left_to_come - 1 != block_index:
+            blocks_left_to_come = response["Num_Blocks_Left_To_Come"]
+            if block_index != start_index + len(blocks):
                 # block with invalid index received
                 return None
             transactions_dicts = response["Transactions"]
@@ -513,17 +791,22 @@ class Messaging:
                     return None
                 transaction_objects.append(txn_object)
             hash = response["Hash"]
-            miner_pk = response["Miner_PK"]
+            miner = response["Miner_Address"]
             prev_hash = response["Prev_Hash"]
             nonce = response["Nonce"]
-            temp_block = Block(block_index, prev_hash, miner_pk, nonce, transaction_objects, hash)
+            temp_block = Block(block_index, prev_hash, miner, nonce, transaction_objects, hash)
             # store block in list of blocks
             blocks.append(temp_block)
 
-        if len(blocks) != expected_number_of_blocks:
-            return None
-        temp_blockchain = BlockChain(blocks)
-        if not temp_blockchain.verify_blockchain():
+        if base is not None and not blocks:
+            return base
+        if base is None:
+            temp_blockchain = BlockChain(blocks)
+        else:
+            temp_blockchain = base.copy()
+            for block in blocks:
+                temp_blockchain.add_block(block)
+        if not temp_blockchain.verify_blockchain(processes=Constants.VERIFY_PROCESSES):
             # invalid blockchain
             return None
         return temp_blockchain
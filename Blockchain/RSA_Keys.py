@@ -6,8 +6,14 @@ from base64 import b64encode
 from Crypto.Hash import SHA256
 from Crypto.PublicKey import RSA
 from Crypto.Signature import pkcs1_15
+from .Cache import LRUCache
+from . import Constants
 import random
 
+# parsed key objects keyed by their PEM string, so each key is only
+# imported once no matter how many transactions it signs
+_key_cache = LRUCache(Constants.KEY_CACHE_SIZE)
+
 class RSA_Keys:
     def generate_keys():
         '''
@@ -19,21 +25,44 @@ class RSA_Keys:
         private_key = new_key.exportKey("PEM")
         return public_key, private_key
 
-    def sign(secret_key: str, message: str):
+    def import_key(key):
+        '''
+        Returns the parsed RSA key object for a PEM key (str or bytes),
+        reusing a previously parsed object when there is one
+        '''
+        if isinstance(key, bytes):
+            key = key.decode()
+        key_obj = _key_cache.get(key)
+        if key_obj is None:
+            key_obj = RSA.import_key(key)
+            _key_cache.put(key, key_obj)
+        return key_obj
+
+    def key_cache_stats():
+        '''
+        Returns the size and hit/miss counters of the parsed key cache
+        '''
+        return _key_cache.stats()
+
+    def sign(secret_key: str, message):
         '''
-        Uses the private key to sign the message
+        Uses the private key to sign the message (str or bytes)
         '''
-        digest = SHA256.new(message.encode())
-        return pkcs1_15.new(RSA.import_key(secret_key)).sign(digest)
+        if isinstance(message, str):
+            message = message.encode()
+        digest = SHA256.new(message)
+        return pkcs1_15.new(RSA_Keys.import_key(secret_key)).sign(digest)
 
-    def verify(public_key: str, message: str, signature: str):
+    def verify(public_key: str, message, signature: bytes):
         '''
-        Uses public key to verify a transaction
+        Uses public key to verify a transaction (str or bytes)
         Returns True on valid and False on invalid
         '''
-        digest = SHA256.new(message.encode())
+        if isinstance(message, str):
+            message = message.encode()
+        digest = SHA256.new(message)
         try:
-            pkcs1_15.new(RSA.import_key(public_key)).verify(digest, signature)
+            pkcs1_15.new(RSA_Keys.import_key(public_key)).verify(digest, signature)
         except Exception as e:
             return False
         return True
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+'''
+SQLite backed storage for a chain and its ledger state.
+
+Unlike BlockStore, which only saves blocks, this keeps the balances and
+accepted transactions in the database too, so a BlockChain built on it
+doesn't hold the chain or the ledger in memory. Blocks, transactions and
+balances are indexed by hash, height, tid and address for point lookups.
+Each block is written in a single database transaction.
+'''
+import json
+import sqlite3
+from .BlockChain import Block
+from .Transaction import Transaction
+from . import Constants
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key     TEXT PRIMARY KEY,
+    value   TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blocks (
+    height      INTEGER PRIMARY KEY,
+    hash        TEXT NOT NULL UNIQUE,
+    prev_hash   TEXT NOT NULL,
+    miner       TEXT NOT NULL,
+    nonce       INTEGER NOT NULL,
+    data        TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    tid         TEXT PRIMARY KEY,
+    height      INTEGER NOT NULL REFERENCES blocks(height),
+    position    INTEGER NOT NULL,
+    sender      TEXT NOT NULL,
+    recipient   TEXT NOT NULL,
+    amount      INTEGER NOT NULL,
+    data        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transactions_height ON transactions(height);
+CREATE INDEX IF NOT EXISTS transactions_sender ON transactions(sender);
+CREATE INDEX IF NOT EXISTS transactions_recipient ON transactions(recipient);
+CREATE INDEX IF NOT EXISTS blocks_miner ON blocks(miner);
+CREATE TABLE IF NOT EXISTS balances (
+    address     TEXT PRIMARY KEY,
+    balance     INTEGER NOT NULL
+);
+"""
+# blocks read from the database at a time when iterating over a range of them
+READ_BATCH = 100
+
+class SQLiteStore:
+    # BlockChain keeps its balances and transaction ids here instead of in memory
+    keeps_state = True
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        # height of the tip, kept here so appending doesn't count the blocks
+        self.height = self.conn.execute("SELECT COALESCE(MAX(height), 0) FROM blocks").fetchone()[0]
+        self.balances = Balances(self)
+        self.transaction_ids = TransactionIds(self)
+
+    def genesis_hash(self):
+        '''
+        Returns the hash of the genesis block the store was started with,
+        or None for a new store
+        '''
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'genesis_hash'").fetchone()
+        return row[0] if row else None
+
+    def init_genesis(self, genesis, balances):
+        '''
+        Saves the genesis hash and balances in a new store
+        '''
+        with self.conn:
+            self.conn.execute("INSERT INTO meta (key, value) VALUES ('genesis_hash', ?)", (genesis["Hash"],))
+            self.conn.executemany("INSERT INTO balances (address, balance) VALUES (?, ?)",
+                                  list(balances.items()))
+
+    def append(self, block, deltas=None):
+        '''
+        Saves a block, its transactions, and the balance changes it makes
+        (address -> delta) in one database transaction
+        '''
+        if block.index != self.height + 1:
+            raise ValueError(f"Expected block {self.height + 1}, got block {block.index}")
+        with self.conn:
+            self.conn.execute("INSERT INTO blocks (height, hash, prev_hash, miner, nonce, data) VALUES (?, ?, ?, ?, ?, ?)",
+                              (block.index, block.hash, block.prev_hash, block.miner_address, block.nonce,
+                               json.dumps(block.to_json())))
+            self.conn.executemany("INSERT INTO transactions (tid, height, position, sender, recipient, amount, data) "
+                                  "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                  [(t.tid, block.index, i, t.sender, t.recipient, t.amount, t.to_string())
+                                   for i, t in enumerate(block.transactions)])
+            if deltas:
+                self.conn.executemany("INSERT INTO balances (address, balance) VALUES (?, ?) "
+                                      "ON CONFLICT(address) DO UPDATE SET balance = balance + excluded.balance",
+                                      list(deltas.items()))
+        self.height = block.index
+
+    def pop(self, block, deltas):
+        '''
+        Removes the tip block, its transactions and its balance changes
+        in one database transaction
+        '''
+        if block.index != self.height:
+            raise ValueError(f"Block {block.index} is not the tip of the store")
+        with self.conn:
+            self.conn.execute("DELETE FROM transactions WHERE height = ?", (block.index,))
+            self.conn.execute("DELETE FROM blocks WHERE height = ?", (block.index,))
+            self.conn.executemany("UPDATE balances SET balance = balance - ? WHERE address = ?",
+                                  [(delta, address) for address, delta in deltas.items()])
+            self.conn.execute("DELETE FROM balances WHERE balance = 0")
+        self.height = block.index - 1
+
+    def get_by_height(self, height):
+        '''
+        Returns the block at a height, or None if it isn't stored
+        '''
+        row = self.conn.execute("SELECT data FROM blocks WHERE height = ?", (height,)).fetchone()
+        return Block.from_json(json.loads(row[0])) if row else None
+
+    def get_by_hash(self, hash):
+        '''
+        Returns the block with the given hash, or None if it isn't stored
+        '''
+        row = self.conn.execute("SELECT data FROM blocks WHERE hash = ?", (hash,)).fetchone()
+        return Block.from_json(json.loads(row[0])) if row else None
+
+    def get_range(self, start, stop):
+        '''
+        Returns the stored blocks from height start up to (not including) stop
+        '''
+        rows = self.conn.execute("SELECT data FROM blocks WHERE height >= ? AND height < ? ORDER BY height",
+                                 (start, stop))
+        return [Block.from_json(json.loads(data)) for (data,) in rows]
+
+    def has_hash(self, hash):
+        return self.conn.execute("SELECT 1 FROM blocks WHERE hash = ?", (hash,)).fetchone() is not None
+
+    def get_hash_at(self, height):
+        row = self.conn.execute("SELECT hash FROM blocks WHERE height = ?", (height,)).fetchone()
+        return row[0] if row else None
+
+    def get_transaction(self, tid):
+        '''
+        Returns (height, position in block, Transaction) for an accepted
+        transaction, or None if it isn't in the chain
+        '''
+        row = self.conn.execute("SELECT height, position, data FROM transactions WHERE tid = ?", (tid,)).fetchone()
+        if not row:
+            return None
+        return row[0], row[1], Transaction.from_json(json.loads(row[2]))
+
+    def get_balance(self, address):
+        row = self.conn.execute("SELECT balance FROM balances WHERE address = ?", (address,)).fetchone()
+        return row[0] if row else 0
+
+    def blocks(self):
+        '''
+        Yields every stored block in height order
+        '''
+        for (data,) in self.conn.execute("SELECT data FROM blocks ORDER BY height"):
+            yield Block.from_json(json.loads(data))
+
+    def block_index(self, genesis):
+        '''
+        Returns a dictionary style view of the stored blocks by hash
+        for BlockChain.block_index
+        '''
+        return BlockHashes(self, genesis)
+
+    def address_history(self, genesis):
+        '''
+        Returns a dictionary style view of each address's history
+        for BlockChain.address_history
+        '''
+        return AddressHistory(self, genesis)
+
+    def block_list(self, genesis):
+        '''
+        Returns a list style view of the stored chain for BlockChain.block_chain
+        '''
+        return StoredBlocks(self, genesis)
+
+    def close(self):
+        self.conn.close()
+
+    def __len__(self):
+        return self.height
+
+class Balances:
+    '''
+    Read only dictionary style view of the balances table.
+    Like the defaultdict it replaces, missing addresses have a balance of 0.
+    '''
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, address):
+        return self.store.get_balance(address)
+
+    def get(self, address, default=0):
+        row = self.store.conn.execute("SELECT balance FROM balances WHERE address = ?", (address,)).fetchone()
+        return row[0] if row else default
+
+    def items(self):
+        return self.store.conn.execute("SELECT address, balance FROM balances").fetchall()
+
+    def copy(self):
+        return dict(self.items())
+
+    def __contains__(self, address):
+        return self.store.conn.execute("SELECT 1 FROM balances WHERE address = ?", (address,)).fetchone() is not None
+
+    def __len__(self):
+        return self.store.conn.execute("SELECT COUNT(*) FROM balances").fetchone()[0]
+
+class TransactionIds:
+    '''
+    Dictionary style view of accepted transactions, tid -> (height, position in block)
+    '''
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, tid, default=None):
+        row = self.store.conn.execute("SELECT height, position FROM transactions WHERE tid = ?", (tid,)).fetchone()
+        return tuple(row) if row else default
+
+    def items(self):
+        return [(tid, (height, position)) for tid, height, position in
+                self.store.conn.execute("SELECT tid, height, position FROM transactions")]
+
+    def __contains__(self, tid):
+        return self.store.conn.execute("SELECT 1 FROM transactions WHERE tid = ?", (tid,)).fetchone() is not None
+
+    def __len__(self):
+        return self.store.conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+
+class AddressHistory:
+    '''
+    Dictionary style view of address -> list of (height, tid, balance change),
+    built from the indexed transaction and block tables
+    '''
+    def __init__(self, store, genesis):
+        self.store = store
+        self.genesis = genesis
+
+    def get(self, address, default=None):
+        history = [(0, None, self.genesis.balances[address])] if address in self.genesis.balances else []
+        rows = self.store.conn.execute(
+            "SELECT height, position, tid, -amount FROM transactions WHERE sender = ? "
+            "UNION ALL SELECT height, position, tid, amount FROM transactions WHERE recipient = ? "
+            # the coinbase sorts after the block's transactions, as add_block records it
+            "UNION ALL SELECT height, 2147483647, NULL, ? FROM blocks WHERE miner = ? "
+            "ORDER BY 1, 2", (address, address, Constants.COINBASE, address))
+        history.extend((height, tid, delta) for height, _, tid, delta in rows)
+        if not history:
+            return default
+        return history
+
+class BlockHashes:
+    '''
+    Dictionary style view of the stored blocks by hash
+    '''
+    def __init__(self, store, genesis):
+        self.store = store
+        self.genesis = genesis
+
+    def get(self, hash, default=None):
+        if hash == self.genesis["Hash"]:
+            return self.genesis
+        block = self.store.get_by_hash(hash)
+        return block if block is not None else default
+
+    def __contains__(self, hash):
+        return hash == self.genesis["Hash"] or self.store.has_hash(hash)
+
+class StoredBlocks:
+    '''
+    List style view of a chain's blocks that reads them from the store
+    as they are needed. Index 0 is the genesis dictionary.
+    '''
+    def __init__(self, store, genesis):
+        self.store = store
+        self.genesis = genesis
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return BlockRange(self, range(*i.indices(len(self))))
+        if i < 0:
+            i += len(self)
+        if i == 0:
+            return self.genesis
+        block = self.store.get_by_height(i)
+        if block is None:
+            raise IndexError(i)
+        return block
+
+    def __iter__(self):
+        yield self.genesis
+        yield from self.store.blocks()
+
+    def __len__(self):
+        return len(self.store) + 1
+
+class BlockRange:
+    '''
+    A slice of StoredBlocks. Its blocks are read from the store a batch
+    at a time while it is iterated over, so sending or verifying part of
+    the chain doesn't load all of it into memory.
+    '''
+    def __init__(self, blocks, heights):
+        self.blocks = blocks
+        self.heights = heights
+
+    def __iter__(self):
+        heights = self.heights
+        if heights.step != 1:
+            for i in heights:
+                yield self.blocks[i]
+            return
+        start, stop = heights.start, heights.stop
+        if start == 0 and stop > 0:
+            yield self.blocks.genesis
+            start = 1
+        while start < stop:
+            end = min(start + READ_BATCH, stop)
+            batch = self.blocks.store.get_range(start, end)
+            yield from batch
+            if len(batch) < end - start:
+                # the chain was cut short while we were reading it
+                return
+            start = end
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return BlockRange(self.blocks, self.heights[i])
+        return self.blocks[self.heights[i]]
+
+    def __len__(self):
+        return len(self.heights)
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+'''
+The signature schemes a wallet and its transactions can use
+'''
+from .RSA_Keys import RSA_Keys
+from .Ed25519_Keys import Ed25519_Keys
+
+class SignatureSchemes:
+    RSA = "RSA"
+    Ed25519 = "Ed25519"
+
+# the scheme transactions use when they don't name one
+DEFAULT_SCHEME = SignatureSchemes.RSA
+
+_KEYS = {SignatureSchemes.RSA: RSA_Keys, SignatureSchemes.Ed25519: Ed25519_Keys}
+
+def get_keys(scheme):
+    '''
+    Returns the class that generates keys, signs and verifies for a scheme
+    Raises ValueError for unknown schemes
+    '''
+    try:
+        return _KEYS[scheme]
+    except KeyError:
+        raise ValueError(f"Unknown signature scheme: {scheme}")
+
+def is_valid_scheme(scheme):
+    return scheme in _KEYS
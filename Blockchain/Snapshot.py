@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+'''
+Ledger snapshots for bootstrapping new nodes.
+
+A snapshot holds the balances and accepted transactions of a chain at
+some height, together with the headers of every block up to it. It is
+written in a compact binary file that ends with the sha256 digest of
+everything before it. A new node can check the digest, check that the
+headers link back to the genesis block with the required difficulty,
+and then start its chain from the snapshot (see BlockChain.from_snapshot)
+so that only the blocks after it have to be downloaded and replayed.
+
+Nothing in the block headers commits to the balances, and the digest
+at the end of the file comes from whoever wrote it. A node only starts
+from a snapshot whose digest its operator gave it.
+'''
+import os
+import struct
+from hashlib import sha256
+from .BlockChain import Block, HEADER_SIZE
+from . import Constants
+
+MAGIC = b"JBSS"
+SNAPSHOT_VERSION = 1
+# magic, version, height, number of balances, number of transactions
+PREFIX_FORMAT = ">4sIIII"
+PREFIX_SIZE = struct.calcsize(PREFIX_FORMAT)
+# address, balance
+BALANCE_FORMAT = ">20sq"
+BALANCE_SIZE = struct.calcsize(BALANCE_FORMAT)
+# tid, block height, position in block
+TRANSACTION_FORMAT = ">32sII"
+TRANSACTION_SIZE = struct.calcsize(TRANSACTION_FORMAT)
+DIGEST_SIZE = 32
+
+class Snapshot:
+    def __init__(self, headers, balances, transactions):
+        '''
+        Headers are the binary headers of blocks 1 to height, balances is
+        address -> balance and transactions is tid -> (height, position)
+        '''
+        self.headers = list(headers)
+        self.height = len(self.headers)
+        self.balances = {address: int(balance) for address, balance in balances.items() if balance}
+        self.transactions = dict(transactions.items())
+
+    @staticmethod
+    def from_blockchain(blockchain):
+        '''
+        Takes a snapshot of the tip of a chain
+        '''
+        headers = [blockchain.block_chain[height].header() for height in range(1, blockchain.length)]
+        return Snapshot(headers, blockchain.user_balances, blockchain.accepted_transactions)
+
+    def _body(self):
+        parts = [struct.pack(PREFIX_FORMAT, MAGIC, SNAPSHOT_VERSION, self.height,
+                             len(self.balances), len(self.transactions))]
+        parts.extend(self.headers)
+        # sorted so that equal ledgers always give the same digest
+        for address in sorted(self.balances):
+            parts.append(struct.pack(BALANCE_FORMAT, bytes.fromhex(address), self.balances[address]))
+        for tid in sorted(self.transactions):
+            height, position = self.transactions[tid]
+            parts.append(struct.pack(TRANSACTION_FORMAT, bytes.fromhex(tid), height, position))
+        return b"".join(parts)
+
+    def to_bytes(self):
+        body = self._body()
+        return body + sha256(body).digest()
+
+    def digest(self):
+        '''
+        Returns the hex digest that the snapshot is committed by
+        '''
+        return sha256(self._body()).hexdigest()
+
+    def block_hash(self):
+        '''
+        Returns the hash of the block the snapshot was taken at
+        (None for a snapshot of just the genesis block)
+        '''
+        if not self.headers:
+            return None
+        return sha256(self.headers[-1]).hexdigest()
+
+    @staticmethod
+    def from_bytes(data):
+        '''
+        Reads a snapshot written by to_bytes.
+        Raises ValueError if it is malformed or its digest doesn't match.
+        '''
+        if len(data) < PREFIX_SIZE + DIGEST_SIZE:
+            raise ValueError("Snapshot is too short")
+        body, digest = data[:-DIGEST_SIZE], data[-DIGEST_SIZE:]
+        if sha256(body).digest() != digest:
+            raise ValueError("Snapshot digest does not match its contents")
+        magic, version, height, num_balances, num_transactions = struct.unpack_from(PREFIX_FORMAT, body)
+        if magic != MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError("Not a snapshot file or unsupported version")
+        expected = PREFIX_SIZE + height * HEADER_SIZE + num_balances * BALANCE_SIZE + num_transactions * TRANSACTION_SIZE
+        if len(body) != expected:
+            raise ValueError("Snapshot length does not match its contents")
+        pos = PREFIX_SIZE
+        headers = [body[pos + i * HEADER_SIZE:pos + (i + 1) * HEADER_SIZE] for i in range(height)]
+        pos += height * HEADER_SIZE
+        balances = {}
+        for address, balance in struct.iter_unpack(BALANCE_FORMAT, body[pos:pos + num_balances * BALANCE_SIZE]):
+            balances[address.hex()] = balance
+        pos += num_balances * BALANCE_SIZE
+        transactions = {}
+        for tid, block_height, position in struct.iter_unpack(TRANSACTION_FORMAT, body[pos:]):
+            transactions[tid.hex()] = (block_height, position)
+        return Snapshot(headers, balances, transactions)
+
+    def verify_headers(self, genesis_hash):
+        '''
+        Checks that the headers form a chain from the genesis block and
+        that every block met the required difficulty
+        '''
+        prev_hash = genesis_hash
+        for height, header in enumerate(self.headers, 1):
+            fields = Block.unpack_header(header)
+            if fields["Version"] != Constants.BLOCK_VERSION or fields["Block_Index"] != height:
+                return False
+            if fields["Prev_Hash"] != prev_hash:
+                return False
+            if not fields["Hash"].startswith(Constants.DIFFICULTY * "0"):
+                return False
+            prev_hash = fields["Hash"]
+        # every transaction must be in a block the snapshot covers
+        for height, position in self.transactions.values():
+            if not 1 <= height <= self.height:
+                return False
+        return True
+
+    def save(self, path):
+        '''
+        Writes the snapshot to a temporary file and renames it into
+        place, so a crash never leaves a partially written snapshot
+        '''
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(self.to_bytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def load(path):
+        with open(path, "rb") as f:
+            return Snapshot.from_bytes(f.read())
+
+class Snapshots:
+    def __init__(self, path=None, interval=Constants.SNAPSHOT_INTERVAL):
+        '''
+        Keeps the latest snapshot of a chain, taken every interval blocks.
+        If a path is given the snapshot is saved there and loaded from
+        there on restart.
+        '''
+        self.path = path
+        self.interval = interval
+        self.latest = None
+        if path is not None and os.path.exists(path):
+            try:
+                self.latest = Snapshot.load(path)
+            except ValueError:
+                # corrupt snapshot, a new one is taken at the next interval
+                pass
+
+    def update(self, blockchain):
+        '''
+        Takes a snapshot if the chain's tip is at a multiple of the interval
+        Returns: True if a new snapshot was taken
+        '''
+        height = blockchain.length - 1
+        if height == 0 or height % self.interval:
+            return False
+        if self.latest is not None and self.latest.block_hash() == blockchain.get_last_hash():
+            return False
+        self.latest = Snapshot.from_blockchain(blockchain)
+        if self.path is not None:
+            self.latest.save(self.path)
+        return True
@@ -1,31 +1,109 @@
 #!/usr/bin/env python3
 import json
 import datetime
+import os
+import multiprocessing
+from hashlib import sha256
 from .RSA_Keys import RSA_Keys as RK
+from .Signatures import DEFAULT_SCHEME, get_keys
 from .Wallet import Wallet
+from .Address import to_address
+from .Cache import LRUCache
+from . import Constants
+
+# (transaction digest, signature) pairs that have already been verified,
+# so a transaction accepted into the mempool isn't checked again when
+# it shows up in a block or a synced chain
+_verified_signatures = LRUCache(Constants.SIGNATURE_CACHE_SIZE)
+
+def _verify_signature(item):
+    '''
+    Pool worker for Transaction.verify_batch
+    '''
+    scheme, sender, message, signature = item
+    return get_keys(scheme).verify(sender, message, signature)
 
 class Transaction:
-    def __init__(self, sender, recipient, amount, tid=None, signature=None):
+    # a node can hold millions of these, so skip the per object dict
+    __slots__ = ("tid", "timestamp", "sender_pk", "sender", "recipient", "amount", "signature", "scheme", "_sealed",
+                 "_unsigned_bytes", "_digest")
+
+    def __init__(self, sender, recipient, amount, tid=None, signature=None, scheme=DEFAULT_SCHEME,
+                 timestamp=None):
+        '''
+        Sender is the sender's public key, recipient is an address
+        (a public key is converted to its address).
+        The transaction id is a hash of the contents, a provided tid that
+        doesn't match makes the transaction fail verification.
+        Once the transaction has a signature it can't be modified.
+        '''
+        # creation time, keeps otherwise identical payments distinct
+        if not timestamp:
+            self.timestamp = str(datetime.datetime.now())
+        else:
+            self.timestamp = timestamp
+        if isinstance(sender, bytes):
+            sender = sender.decode()
+        # the full key is only kept to check the signature,
+        # balances are keyed by the sender's address
+        self.sender_pk = sender
+        self.sender = to_address(sender)
+        self.recipient = to_address(recipient)
+        self.amount = int(amount)
+        # signature scheme of the sender's keys (see Signatures.py)
+        self.scheme = scheme
         if not tid:
-            self.tid = str(datetime.datetime.now())
+            self.tid = self.compute_tid()
         else:
             self.tid = tid
-        self.sender = sender
-        self.recipient = recipient
-        self.amount = amount
         if not signature:
             self.signature = None
         else:
-            self.signature = signature
+            # signatures off the wire are lists of ints, keep them as bytes
+            self.signature = bytes(signature)
+            self._sealed = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, "_sealed", False):
+            raise AttributeError(f"Transaction {self.tid} is signed and can no longer be modified")
+        object.__setattr__(self, name, value)
+        if not name.startswith("_"):
+            # the cached serializations no longer match the fields
+            for cached in ("_unsigned_bytes", "_digest"):
+                object.__setattr__(self, cached, None)
+
+    def __reduce__(self):
+        return (Transaction, (self.sender_pk, self.recipient, self.amount, self.tid,
+                              self.signature, self.scheme, self.timestamp))
+
+    def __eq__(self, other):
+        return isinstance(other, Transaction) and self.tid == other.tid
+
+    def __hash__(self):
+        return hash(self.tid)
+
+    def compute_tid(self):
+        '''
+        Returns the content address of the transaction: the hex sha256
+        of everything in it except the id and the signature
+        '''
+        j = {}
+        j["Timestamp"]          = self.timestamp
+        j["Sender_Public_Key"]  = str(self.sender_pk)
+        j["Recipient_Address"]  = str(self.recipient)
+        j["Amount"]             = int(self.amount)
+        if self.scheme != DEFAULT_SCHEME:
+            j["Scheme"] = self.scheme
+        return sha256(json.dumps(j).encode()).hexdigest()
 
     def generate_transaction(Wallet, amount, recipient_key):
         '''
         Uses a wallet to create a transaction
 
-        Takes a public key of a recipient and an amount
+        Takes an address (or public key) of a recipient and an amount
         and creates a transaction sending them that amount
         '''
-        T = Transaction(Wallet.public_key, recipient_key, amount)
+        T = Transaction(Wallet.public_key, recipient_key, amount, scheme=Wallet.scheme)
         T.sign(Wallet.secret_key)
         return T
 
@@ -36,42 +114,145 @@ class Transaction:
         '''
         if not self.signature:
             return False
-        return RK.verify(self.sender, self.to_string(False), self.signature)
+        key = self.signature_cache_key()
+        if _verified_signatures.get(key):
+            return True
+        if self.tid != self.compute_tid():
+            # id doesn't match the contents
+            return False
+        try:
+            keys = get_keys(self.scheme)
+        except ValueError:
+            return False
+        if not keys.verify(self.sender_pk, self.canonical(False), self.signature):
+            return False
+        _verified_signatures.put(key, True)
+        return True
+
+    def signature_cache_key(self):
+        '''
+        Key for the verified signature cache: a digest of the signed
+        transaction contents (which include the sender's key) and the signature
+        '''
+        return (self.digest(), self.signature)
+
+    @staticmethod
+    def signature_cache_stats():
+        '''
+        Returns the size and hit/miss counters of the verified signature cache
+        '''
+        return _verified_signatures.stats()
+
+    @staticmethod
+    def verify_batch(transactions, processes=None):
+        '''
+        Verifies the signatures of a list of transactions, spreading the
+        checks across a pool of processes (all cores if processes is not given).
+        Small batches are checked in the calling process since starting
+        a pool would cost more than it saves.
+        Returns: index of the first transaction that is not authentic, -1 if all are
+        '''
+        if processes is None or processes == 0:
+            processes = os.cpu_count()
+        if processes == 1 or len(transactions) < Constants.PARALLEL_VERIFY_THRESHOLD:
+            results = map(Transaction.verify_transaction_authenticity, transactions)
+        else:
+            # only send signatures we haven't verified before to the pool
+            keys = [t.signature_cache_key() for t in transactions]
+            results = [bool(_verified_signatures.get(key)) for key in keys]
+            # unsigned transactions and ids that don't match the contents
+            # fail without a signature check
+            todo = [i for i, valid in enumerate(results)
+                    if not valid and transactions[i].signature
+                    and transactions[i].tid == transactions[i].compute_tid()]
+            items = [(transactions[i].scheme, transactions[i].sender_pk,
+                      transactions[i].canonical(False), transactions[i].signature)
+                     for i in todo]
+            if items:
+                with multiprocessing.Pool(processes) as pool:
+                    checked = pool.map(_verify_signature, items,
+                                       chunksize=max(1, len(items) // (processes * 4)))
+                for i, valid in zip(todo, checked):
+                    results[i] = valid
+                    if valid:
+                        _verified_signatures.put(keys[i], True)
+        for i, valid in enumerate(results):
+            if not valid:
+                return i
+        return -1
 
     def sign(self, sk):
         '''
         Signs transaction with secret key
         '''
-        self.signature = RK.sign(sk, self.to_string(False))
+        self.signature = get_keys(self.scheme).sign(sk, self.canonical(False))
+        self._sealed = True
         return self.signature
 
+    def canonical(self, sig=True):
+        '''
+        Returns the canonical byte serialization of the transaction,
+        which is what gets signed and hashed. Only the unsigned one is
+        kept (it is signed, verified and digested), the signed one is
+        built on each call so a stored transaction doesn't hold a second
+        copy of itself.
+        '''
+        if sig and self.signature:
+            return json.dumps(self.to_json(True)).encode()
+        if self._unsigned_bytes is None:
+            object.__setattr__(self, "_unsigned_bytes", json.dumps(self.to_json(False)).encode())
+        return self._unsigned_bytes
+
+    def digest(self):
+        '''
+        Returns the sha256 digest of the unsigned canonical serialization
+        '''
+        if self._digest is None:
+            object.__setattr__(self, "_digest", sha256(self.canonical(False)).digest())
+        return self._digest
+
     def to_json(self, sig=True):
         '''
         Returns a json of the transaction
+        (a new dictionary each call, so callers may add message fields to it)
         '''
         j = {}
         j["Transaction_ID"]         = str(self.tid)
-        j["Sender_Public_Key"]      = str(self.sender)
-        j["Recipient_Public_Key"]   = str(self.recipient)
+        j["Timestamp"]              = self.timestamp
+        j["Sender_Public_Key"]      = str(self.sender_pk)
+        j["Recipient_Address"]      = str(self.recipient)
         j["Amount"]                 = int(self.amount)
-        if self.signature and sig:
+        if self.scheme != DEFAULT_SCHEME:
+            # RSA transactions leave the scheme out so they serialize as they always have
+            j["Scheme"] = self.scheme
+        if sig and self.signature:
             j["Signature"] = list(self.signature) # convert bytes to list of ints
         return j
 
+    @staticmethod
+    def from_json(j):
+        '''
+        Builds a Transaction from the dictionary made by to_json
+        '''
+        return Transaction(j["Sender_Public_Key"], j["Recipient_Address"], j["Amount"],
+                           j["Transaction_ID"], j.get("Signature"),
+                           j.get("Scheme", DEFAULT_SCHEME), j["Timestamp"])
+
     def to_string(self, sig=True):
         '''
         Makes the json of the transcation a string
         '''
-        return json.dumps(self.to_json(sig))
+        return self.canonical(sig).decode()
 
     def __str__(self, sig=True):
         '''
         Makes the json of the transcation a string
         '''
-        return json.dumps(self.to_json(sig))
+        return self.canonical(sig).decode()
 
     def copy(self):
-        copy = Transaction(self.sender, self.recipient, self.amount, self.tid, self.signature)
+        copy = Transaction(self.sender_pk, self.recipient, self.amount, self.tid, self.signature, self.scheme,
+                           self.timestamp)
         return copy
 
 if __name__=="__main__":
@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 '''
-Class to handle a wallet with RSA keys
+Class to handle a wallet with RSA or Ed25519 keys
 '''
+from .Address import to_address
+from .Signatures import DEFAULT_SCHEME
 
 class Wallet:
-    def __init__(self, keys):
+    def __init__(self, keys, scheme=DEFAULT_SCHEME):
         pk, sk = keys
         self.secret_key = sk
         self.public_key = pk
+        self.address = to_address(pk)
+        # signature scheme the keys belong to (see Signatures.py)
+        self.scheme = scheme
         balance = None
 
     def update_balance(self, amount):
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+'''
+Compact binary encoding of the messages that carry blocks and transactions.
+
+In JSON every hash is 64 hex characters and a signature is a list of up
+to 256 numbers. Here hashes and addresses are packed as raw bytes, the
+fixed size fields of blocks and transactions as struct headers and the
+rest (keys, timestamps, signatures) as length prefixed byte strings.
+decode_message returns the same dict that the JSON of the message would
+decode to (signatures included), so handlers don't need to know which
+encoding a message arrived in, and can relay it to peers in either one.
+
+Only peers that agreed to it are sent binary messages, see Messaging.
+'''
+import struct
+
+# message types that have a binary encoding -> their code
+MESSAGE_CODES = {"Send_Transaction": 1, "Send_Block": 2, "Get_Blockchain_Response": 3}
+MESSAGE_TYPES = {code: msgtype for msgtype, code in MESSAGE_CODES.items()}
+CODE_FORMAT = ">B"
+CODE_SIZE = struct.calcsize(CODE_FORMAT)
+# block index, prev hash, hash, miner address, nonce, number of transactions
+BLOCK_FORMAT = ">I32s32s20sQI"
+BLOCK_SIZE = struct.calcsize(BLOCK_FORMAT)
+# blocks left to come in a Get_Blockchain_Response
+REMAINING_FORMAT = ">I"
+REMAINING_SIZE = struct.calcsize(REMAINING_FORMAT)
+# tid, recipient address, amount, then the lengths of the
+# timestamp, sender public key, scheme and signature that follow it
+TRANSACTION_FORMAT = ">32s20sqBHBH"
+TRANSACTION_SIZE = struct.calcsize(TRANSACTION_FORMAT)
+# number of previous message recipients, then per recipient
+# the length of its hostname, its port and the hostname
+COUNT_FORMAT = ">H"
+COUNT_SIZE = struct.calcsize(COUNT_FORMAT)
+RECIPIENT_FORMAT = ">BH"
+RECIPIENT_SIZE = struct.calcsize(RECIPIENT_FORMAT)
+
+TRANSACTION_KEYS = {"Transaction_ID", "Timestamp", "Sender_Public_Key", "Recipient_Address", "Amount"}
+OPTIONAL_TRANSACTION_KEYS = {"Scheme", "Signature"}
+BLOCK_KEYS = {"Type", "Block_Index", "Prev_Hash", "Hash", "Miner_Address", "Nonce", "Transactions"}
+MESSAGE_KEYS = {
+    "Send_Transaction": TRANSACTION_KEYS | {"Type", "Previous_Message_Recipients"},
+    "Send_Block": BLOCK_KEYS | {"Previous_Message_Recipients"},
+    "Get_Blockchain_Response": BLOCK_KEYS | {"Num_Blocks_Left_To_Come"},
+}
+
+def _hex_bytes(value, size):
+    '''
+    Packs a hex string, refusing any that wouldn't unpack to the same string
+    '''
+    data = bytes.fromhex(value)
+    if len(data) != size or data.hex() != value:
+        raise ValueError(f"{value!r} is not {size} bytes of lowercase hex")
+    return data
+
+def _check_keys(fields, required, optional=frozenset()):
+    keys = fields.keys()
+    if not required <= keys or not keys <= required | optional:
+        raise ValueError(f"Unexpected fields {sorted(keys ^ required)}")
+
+def _encode_transaction(txn, parts):
+    _check_keys(txn, TRANSACTION_KEYS, OPTIONAL_TRANSACTION_KEYS)
+    if type(txn["Amount"]) != int:
+        raise ValueError("Amount is not an int")
+    timestamp = txn["Timestamp"].encode()
+    sender = txn["Sender_Public_Key"].encode()
+    # an empty scheme or signature is how their absence is encoded
+    scheme = txn["Scheme"].encode() if "Scheme" in txn else b""
+    signature = bytes(txn["Signature"]) if "Signature" in txn else b""
+    if ("Scheme" in txn and not scheme) or ("Signature" in txn and not signature):
+        raise ValueError("Empty scheme or signature")
+    parts.append(struct.pack(TRANSACTION_FORMAT, _hex_bytes(txn["Transaction_ID"], 32),
+                             _hex_bytes(txn["Recipient_Address"], 20), txn["Amount"],
+                             len(timestamp), len(sender), len(scheme), len(signature)))
+    parts.extend((timestamp, sender, scheme, signature))
+
+def _encode_recipients(recipients, parts):
+    parts.append(struct.pack(COUNT_FORMAT, len(recipients)))
+    for host, port in recipients:
+        host = host.encode()
+        parts.append(struct.pack(RECIPIENT_FORMAT, len(host), port))
+        parts.append(host)
+
+def encode_message(message):
+    '''
+    Returns the binary encoding of a message.
+    Raises ValueError if the message has no binary encoding (its type
+    doesn't have one, or it has fields that wouldn't survive the trip).
+    '''
+    msgtype = message.get("Type")
+    if msgtype not in MESSAGE_CODES:
+        raise ValueError(f"{msgtype} messages have no binary encoding")
+    optional = OPTIONAL_TRANSACTION_KEYS if msgtype == "Send_Transaction" else frozenset()
+    _check_keys(message, MESSAGE_KEYS[msgtype], optional)
+    parts = [struct.pack(CODE_FORMAT, MESSAGE_CODES[msgtype])]
+    try:
+        if msgtype == "Send_Transaction":
+            transaction = {key: message[key] for key in message.keys() & (TRANSACTION_KEYS | OPTIONAL_TRANSACTION_KEYS)}
+            _encode_transaction(transaction, parts)
+        else:
+            if type(message["Block_Index"]) != int or type(message["Nonce"]) != int:
+                raise ValueError("Block index or nonce is not an int")
+            parts.append(struct.pack(BLOCK_FORMAT, message["Block_Index"], _hex_bytes(message["Prev_Hash"], 32),
+                                     _hex_bytes(message["Hash"], 32), _hex_bytes(message["Miner_Address"], 20),
+                                     message["Nonce"], len(message["Transactions"])))
+            if msgtype == "Get_Blockchain_Response":
+                parts.append(struct.pack(REMAINING_FORMAT, message["Num_Blocks_Left_To_Come"]))
+            for txn in message["Transactions"]:
+                _encode_transaction(txn, parts)
+        if msgtype != "Get_Blockchain_Response":
+            _encode_recipients(message["Previous_Message_Recipients"], parts)
+    except (struct.error, TypeError, AttributeError) as e:
+        raise ValueError(f"Can't encode {msgtype} message: {e}")
+    return b"".join(parts)
+
+def _take(payload, pos, size):
+    end = pos + size
+    if end > len(payload):
+        raise ValueError("Message is truncated")
+    return bytes(payload[pos:end]), end
+
+def _decode_transaction(payload, pos):
+    tid, recipient, amount, timestamp_len, sender_len, scheme_len, signature_len = \
+        struct.unpack_from(TRANSACTION_FORMAT, payload, pos)
+    pos += TRANSACTION_SIZE
+    timestamp, pos = _take(payload, pos, timestamp_len)
+    sender, pos = _take(payload, pos, sender_len)
+    scheme, pos = _take(payload, pos, scheme_len)
+    signature, pos = _take(payload, pos, signature_len)
+    txn = {"Transaction_ID": tid.hex(), "Timestamp": timestamp.decode(), "Sender_Public_Key": sender.decode(),
+           "Recipient_Address": recipient.hex(), "Amount": amount}
+    if scheme:
+        txn["Scheme"] = scheme.decode()
+    if signature:
+        # a list of ints like the JSON, so the message can be relayed as JSON
+        txn["Signature"] = list(signature)
+    return txn, pos
+
+def _decode_recipients(payload, pos):
+    count, = struct.unpack_from(COUNT_FORMAT, payload, pos)
+    pos += COUNT_SIZE
+    recipients = []
+    for _ in range(count):
+        host_len, port = struct.unpack_from(RECIPIENT_FORMAT, payload, pos)
+        host, pos = _take(payload, pos + RECIPIENT_SIZE, host_len)
+        recipients.append([host.decode(), port])
+    return recipients, pos
+
+def decode_message(payload):
+    '''
+    Reads a message written by encode_message.
+    Raises ValueError if it is malformed.
+    '''
+    payload = memoryview(payload)
+    try:
+        code, = struct.unpack_from(CODE_FORMAT, payload)
+        msgtype = MESSAGE_TYPES.get(code)
+        if msgtype is None:
+            raise ValueError(f"Unknown binary message type {code}")
+        pos = CODE_SIZE
+        if msgtype == "Send_Transaction":
+            message, pos = _decode_transaction(payload, pos)
+            message["Type"] = msgtype
+        else:
+            index, prev_hash, hash, miner, nonce, num_transactions = struct.unpack_from(BLOCK_FORMAT, payload, pos)
+            pos += BLOCK_SIZE
+            message = {"Type": msgtype, "Block_Index": index, "Miner_Address": miner.hex(),
+                       "Prev_Hash": prev_hash.hex(), "Nonce": nonce, "Hash": hash.hex()}
+            if msgtype == "Get_Blockchain_Response":
+                message["Num_Blocks_Left_To_Come"], = struct.unpack_from(REMAINING_FORMAT, payload, pos)
+                pos += REMAINING_SIZE
+            transactions = []
+            for _ in range(num_transactions):
+                txn, pos = _decode_transaction(payload, pos)
+                transactions.append(txn)
+            message["Transactions"] = transactions
+        if msgtype != "Get_Blockchain_Response":
+            message["Previous_Message_Recipients"], pos = _decode_recipients(payload, pos)
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"Malformed binary message: {e}")
+    if pos != len(payload):
+        raise ValueError("Binary message has trailing bytes")
+    return message
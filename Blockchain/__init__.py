@@ -0,0 +1,6 @@
+from . import Constants
+from .Transaction import Transaction
+from .BlockChain import BlockChain, Block
+from .BlockChainCollection import BlockChainCollection
+from .Messaging import Messaging, MessageTypes
+from .AsyncMessaging import AsyncMessaging
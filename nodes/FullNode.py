@@ -1,24 +1,333 @@
-'''
-Implimentation of a Full Node
-Josh Bottelberghe
-'''
-from context import Blockchain
-from Blockchain import Constants, BlockChain, Block, Transaction, Messaging, MessageTypes
-
-class FullNode:
-    def __init__(self, addr):
-        self.addr = addr
-        self.miners = set()
-        self.connections = set()
-
-        self.blockchain = BlockChain()
-
-    def run(self):
-        pass
-
-
-
-
-
-if __name__=="__main__":
-    pass
\ No newline at end of file
+#!/usr/bin/env python3
+'''
+Implimentation of a Full Node
+Josh Bottelberghe
+
+An asyncio version of the full node in oldFullNode.py that speaks the
+same protocol. Every connection is served by its own task and blocks
+and transactions are relayed to neighbors in the background, so one
+slow or dead neighbor can't hold up the rest of the node.
+'''
+import os
+import sys
+import time
+import base64
+import asyncio
+from context import Blockchain
+from Blockchain import Constants, BlockChain, BlockChainCollection, Block, Transaction, Messaging, MessageTypes, AsyncMessaging
+from Blockchain.Signatures import DEFAULT_SCHEME
+from Blockchain.BlockStore import BlockStore
+from Blockchain.SQLiteStore import SQLiteStore
+from Blockchain.Snapshot import Snapshots
+from Blockchain.ConnectionPool import AsyncConnectionPool
+
+class FullNode:
+    def __init__(self, addr, blockchain=None, snapshots=None):
+        self.addr = addr
+        # (hostname, port) pairs of other full nodes in the system
+        self.neighbors = set()
+        # (hostname, port) of each miner working for us -> writer of its connection
+        self.miners = {}
+        # writers of every open connection
+        self.connections = set()
+        # long lived connections to our neighbors that blocks and transactions
+        # are relayed over, whatever they send back on them is handled as usual
+        self.pool = AsyncConnectionPool(self.handle_message)
+        # every fork we know about, the main one is self.blockchain
+        self.blockchains_collection = BlockChainCollection()
+        self.blockchains_collection.add_blockchain_fork(blockchain if blockchain is not None else BlockChain())
+        # snapshots of our ledger that we serve to new nodes
+        self.snapshots = snapshots if snapshots is not None else Snapshots()
+        self.orphan_blocks = set()
+        # pending transactions (i.e., not yet added to blockchain) keyed by tid
+        self.pending_transactions = dict()
+        self.block_hashes_seen_before = set()
+        # tells us whether we are waiting on miners for a block
+        self.currently_mining = False
+        # relays running in the background (kept so they aren't garbage collected)
+        self.tasks = set()
+
+    @property
+    def blockchain(self):
+        return self.blockchains_collection.main_blockchain
+
+    async def run(self):
+        '''
+        Serves connections until cancelled, pinging neighbors and
+        pruning short forks in the background
+        '''
+        server = await asyncio.start_server(self.handle_connection, "", self.addr[1])
+        maintenance = asyncio.create_task(self.maintain())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            maintenance.cancel()
+            await self.pool.close()
+
+    async def maintain(self):
+        latest_ping = 0
+        latest_prune = time.time()
+        while True:
+            if time.time() - latest_ping > Constants.NEIGHBOR_PING_INTERVAL:
+                # remove neighbors from the set if they aren't active anymore
+                neighbors = [n for n in self.neighbors if n != self.addr]
+                alive = await asyncio.gather(*[AsyncMessaging.pingNode(n) for n in neighbors])
+                for neighbor, rc in zip(neighbors, alive):
+                    if not rc:
+                        print(f"Discarding inactive connection: {neighbor}")
+                        self.neighbors.discard(neighbor)
+                latest_ping = time.time()
+            if time.time() - latest_prune > Constants.BLOCKCHAIN_FORK_PRUNING_INTERVAL:
+                # prune the blockchain collection so that short forks are discarded
+                self.blockchains_collection.prune_short_forks()
+                latest_prune = time.time()
+            await asyncio.sleep(1)
+
+    async def handle_connection(self, reader, writer):
+        '''
+        Reads and handles messages from one connection until it closes
+        '''
+        peer = writer.get_extra_info("peername")[:2]
+        self.connections.add(writer)
+        try:
+            while not writer.is_closing():
+                message = await AsyncMessaging.readMessage(reader, writer)
+                if message is not None:
+                    print(f"Handling message from {peer[0]}:{peer[1]}...")
+                    await self.handle_message(message, peer, writer)
+        finally:
+            self.connections.discard(writer)
+            if self.miners.get(peer) is writer:
+                del self.miners[peer]
+            await AsyncMessaging.close(writer)
+
+    def background(self, coroutine):
+        '''
+        Runs a coroutine without waiting for it to finish
+        '''
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def relay(self, message):
+        '''
+        Forwards a message to every neighbor that hasn't already seen it,
+        without waiting for them
+        '''
+        seen = set(tuple(r) for r in message.get("Previous_Message_Recipients", []))
+        message["Previous_Message_Recipients"] = list(seen | {self.addr})
+        self.background(self.pool.broadcast(self.neighbors - seen - {self.addr}, message))
+
+    async def start_mining_new_block(self):
+        '''
+        Sends our miners a new block to mine, made of pending transactions
+        that the main fork's balances can pay for
+        '''
+        temp_user_balances = {}
+        transactions_json_list = []
+        for txn in self.pending_transactions.values():
+            if len(transactions_json_list) == Constants.TPB:
+                break
+            # keep a running total of user balances so that the block
+            # isn't inherently inconsistent when we mine it
+            balance = temp_user_balances.get(txn.sender, self.blockchain.user_balances.get(txn.sender, 0))
+            if txn.amount <= balance:
+                temp_user_balances[txn.sender] = balance - txn.amount
+                transactions_json_list.append(txn.to_json())
+        if not transactions_json_list:
+            return
+        message = {"Type": MessageTypes.Start_New_Block, "Transactions": transactions_json_list,
+                   "Prev_Hash": self.blockchain.get_last_hash(), "Block_Index": self.blockchain.length}
+        # set before waiting on the miners, a block from one of them
+        # may be handled while the others are still being sent to
+        self.currently_mining = True
+        await asyncio.gather(*[AsyncMessaging.sendMessage(w, message) for w in list(self.miners.values())])
+
+    async def handle_message(self, message, peer, writer):
+        '''
+        Handles behavior for different message types that a full node
+        expects to receive. Ignores messages that are irrelevant to
+        full nodes. Responses are sent back over the same connection.
+        '''
+        msgtype = message.get("Type", 0)
+        if msgtype == MessageTypes.Get_Neighbors:
+            response = {"Type": MessageTypes.Get_Neighbors_Response, "Neighbors": list(self.neighbors)}
+            await AsyncMessaging.sendMessage(writer, response)
+        elif msgtype == MessageTypes.Hello:
+            # tell the peer which of its features we support, the messaging
+            # layer uses them on this connection from now on
+            await AsyncMessaging.sendMessage(writer, Messaging.hello(response=True))
+        elif msgtype == MessageTypes.Get_Neighbors_Response:
+            for neigh in message.get("Neighbors", []):
+                self.neighbors.add(tuple(neigh))
+        elif msgtype == MessageTypes.Join_As_Miner:
+            # we accept every miner that wants to work for us and
+            # keep its connection open to send it blocks to mine
+            self.miners[peer] = writer
+            response = {"Type": MessageTypes.Join_As_Miner_Response, "Decision": "Yes"}
+            await AsyncMessaging.sendMessage(writer, response)
+        elif msgtype == MessageTypes.Send_Block:
+            await self.handle_block(message, peer)
+        elif msgtype == MessageTypes.Get_Block:
+            block = self.blockchains_collection.get_block_by_hash(message["Hash"], self.orphan_blocks)
+            if block:
+                response = {"Type": MessageTypes.Send_Block, "Block_Index": block.index,
+                            "Miner_Address": block.miner_address, "Prev_Hash": block.prev_hash,
+                            "Nonce": block.nonce, "Hash": block.hash,
+                            "Transactions": [txn.to_json() for txn in block.transactions],
+                            "Previous_Message_Recipients": []}
+                await AsyncMessaging.sendMessage(writer, response)
+        elif msgtype == MessageTypes.Send_Transaction:
+            await self.handle_transaction(message, writer)
+        elif msgtype == MessageTypes.Get_Blockchain:
+            # send blocks back one by one, starting from the requested index;
+            # each send waits for the peer to keep up instead of buffering the chain
+            bc_length = self.blockchain.length
+            start_index = message.get("Start_Index", 1)
+            if self.blockchain.snapshot is not None:
+                # blocks up to the snapshot we started from are only headers
+                start_index = max(start_index, self.blockchain.snapshot.height + 1)
+            if start_index >= bc_length:
+                # nothing to send, say so rather than leave the requester waiting
+                response = {"Type": MessageTypes.Get_Blockchain_Response, "Num_Blocks_Left_To_Come": 0}
+                await AsyncMessaging.sendMessage(writer, response)
+            for block in self.blockchain.block_chain[start_index:bc_length]:
+                response = {"Type": MessageTypes.Get_Blockchain_Response, "Block_Index": block.index,
+                            "Miner_Address": block.miner_address, "Prev_Hash": block.prev_hash,
+                            "Num_Blocks_Left_To_Come": bc_length-block.index-1, "Nonce": block.nonce,
+                            "Hash": block.hash, "Transactions": [txn.to_json() for txn in block.transactions]}
+                if not await AsyncMessaging.sendMessage(writer, response):
+                    break
+        elif msgtype == MessageTypes.Get_Snapshot:
+            snapshot = self.snapshots.latest
+            if snapshot is not None:
+                response = {"Type": MessageTypes.Get_Snapshot_Response, "Height": snapshot.height,
+                            "Digest": snapshot.digest(), "Snapshot": base64.b64encode(snapshot.to_bytes()).decode()}
+                await AsyncMessaging.sendMessage(writer, response)
+
+    async def handle_block(self, message, peer):
+        hash = message["Hash"]
+        if hash in self.block_hashes_seen_before:
+            # prevents us from dealing with blocks that we've already handled before
+            return
+        self.block_hashes_seen_before.add(hash)
+        transactions = [Messaging.transactionDictToObject(txn) for txn in message["Transactions"]]
+        if None in transactions:
+            return
+        new_block = Block(message["Block_Index"], message["Prev_Hash"], message["Miner_Address"],
+                          message["Nonce"], transactions, hash)
+        if peer in self.miners:
+            # if any of the block's transactions aren't pending anymore another
+            # block with them was accepted first, so this one is stale
+            if any(txn.tid not in self.pending_transactions for txn in transactions):
+                return
+            self.currently_mining = False
+        rc = self.blockchains_collection.try_add_block(new_block, self.orphan_blocks, self.pending_transactions)
+        if rc == 1 or rc == 3:
+            if self.snapshots.update(self.blockchain):
+                # operators start other nodes from it with --snapshot <digest>
+                print(f"Snapshot at block {self.snapshots.latest.height}: {self.snapshots.latest.digest()}")
+            # block is in our main blockchain fork, forward it and mine on top of it
+            self.relay(message)
+            await self.start_mining_new_block()
+        elif rc == 0:
+            # block was an orphan, try to get its parent from our neighbors;
+            # they send it back over the pooled connections
+            request = {"Type": MessageTypes.Get_Block, "Hash": new_block.prev_hash}
+            self.background(self.pool.broadcast(self.neighbors - {self.addr}, request))
+
+    async def handle_transaction(self, message, writer):
+        # When we get a transaction, verify that it's been signed
+        # correcty and then broadcast it
+        tid = message["Transaction_ID"]
+        if tid in self.pending_transactions:
+            # transaction ids are hashes of the contents, so a transaction we
+            # already hold is recognized before checking its signature
+            return
+        new_transaction = Transaction(message["Sender_Public_Key"], message["Recipient_Address"],
+                                      int(message["Amount"]), tid, bytes(message["Signature"]),
+                                      message.get("Scheme", DEFAULT_SCHEME), message["Timestamp"])
+        valid = "No"
+        if new_transaction.verify_transaction_authenticity():
+            print(f"Valid transaction recieved. TID: {tid}")
+            if tid not in self.blockchain.accepted_transactions:
+                self.pending_transactions[tid] = new_transaction
+                self.relay(message)
+            # tell sender whether or not we thought the transaction was valid
+            # (will be used by lightweight nodes)
+            if self.blockchain.validate_transaction(new_transaction):
+                valid = "Yes"
+        response = {"Type": MessageTypes.Send_Transaction_Response, "Valid": valid}
+        await AsyncMessaging.sendMessage(writer, response)
+        if not self.currently_mining:
+            await self.start_mining_new_block()
+
+    def bootstrap(self, trusted_host=None):
+        '''
+        Finds neighbors through the trusted host (or the seed nodes) and
+        switches to the fork with the most work among their blockchains
+        '''
+        seeds = [trusted_host] if trusted_host is not None else (Messaging.getActiveSeedNodes() or [])
+        for node in seeds:
+            self.neighbors.add(tuple(node))
+            for neighbor in Messaging.getNeighbors(tuple(node)) or []:
+                self.neighbors.add(tuple(neighbor))
+        self.neighbors.discard(self.addr)
+        print(f"{len(self.neighbors)} neighbors discovered: {self.neighbors}")
+        # a chain started from a snapshot only needs the blocks after it
+        base = self.blockchain if self.blockchain.snapshot is not None else None
+        for n in self.neighbors:
+            bc = Messaging.getBlockchain(n, base)
+            if bc is not None and bc is not base:
+                self.blockchains_collection.add_blockchain_fork(bc)
+
+USAGE = ("Usage: FullNode.py <port> [--trusted <trusted_hostname:port> [--snapshot <digest>]] "
+         "[--store <directory> | --sqlite <file>]")
+
+def main():
+    if len(sys.argv) < 2 or len(sys.argv) % 2 != 0 or len(sys.argv) > 8:
+        print(USAGE)
+        exit(-1)
+    port = int(sys.argv[1])
+    options = dict(zip(sys.argv[2::2], sys.argv[3::2]))
+    if set(options) - {"--trusted", "--snapshot", "--store", "--sqlite"} or ("--store" in options and "--sqlite" in options):
+        print(USAGE)
+        exit(-1)
+    if "--snapshot" in options and ("--trusted" not in options or "--store" in options or "--sqlite" in options):
+        print(USAGE)
+        exit(-1)
+    trusted_host = None
+    if "--trusted" in options:
+        try:
+            host, trusted_port = options["--trusted"].split(":")
+            trusted_host = (host, int(trusted_port))
+        except ValueError:
+            print(USAGE)
+            exit(-1)
+
+    snapshot_path = None
+    if "--store" in options:
+        bc = BlockChain(store=BlockStore(options["--store"]))
+        snapshot_path = os.path.join(options["--store"], "snapshot.dat")
+    elif "--sqlite" in options:
+        bc = BlockChain(store=SQLiteStore(options["--sqlite"]))
+    else:
+        bc = None
+        if "--snapshot" in options:
+            # start from the trusted host's ledger snapshot so that only
+            # the blocks after it have to be downloaded and replayed
+            snapshot = Messaging.getSnapshot(trusted_host)
+            if snapshot is not None:
+                bc = BlockChain.from_snapshot(snapshot, options["--snapshot"])
+            if bc is None:
+                print("Snapshot could not be fetched or does not match its digest")
+    node = FullNode(("localhost", port), bc, Snapshots(snapshot_path))
+    node.bootstrap(trusted_host)
+    try:
+        asyncio.run(node.run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__=="__main__":
+    main()
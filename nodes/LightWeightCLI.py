@@ -3,22 +3,22 @@
 A simple CLI Lightweight Client
 '''
 
-from BlockChain import BlockChain, Block
-from Transaction import Transaction
-from RSA_Keys import RSA_Keys as RK
-from Wallet import Wallet
+from context import Blockchain
+from Blockchain import BlockChain, Block, Transaction, Messaging, MessageTypes
+from Blockchain.Wallet import Wallet
+from Blockchain.Signatures import DEFAULT_SCHEME, get_keys
 import json, sys
-from Messaging import Messaging,  MessageTypes
 import socket
 from Crypto.Math._IntegerGMP import IntegerGMP
 
 def prompt():
     print("                                         \n\
 Choose one of these options:                        \n\
-    g (filename) generate wallet file              \n\
+    g (filename) [RSA|Ed25519] generate wallet file\n\
     l (filename) load wallet file                   \n\
     t (amount) send a transaction, then (user name)   \n\
     b check balance of the loaded wallet           \n\
+    h show the last 50 transactions of the wallet  \n\
     u update blockchain                            \n\
     q quit                                         \n\
     ")
@@ -28,12 +28,13 @@ def load_wallet(filename):
     with open(filename) as f:
         data = json.load(f)
         print("\nWallet loaded from file", filename)
-        return Wallet([data["pk"], data["sk"]])
+        return Wallet([data["pk"], data["sk"]], data.get("scheme", DEFAULT_SCHEME))
 
-def generate_wallet(filename):
+def generate_wallet(filename, scheme=DEFAULT_SCHEME):
     d = {}
-    pk, sk = RK.generate_keys()
+    pk, sk = get_keys(scheme).generate_keys()
     d["pk"], d["sk"]  = str(pk.decode()), str(sk.decode())
+    d["scheme"] = scheme
     with open(filename, "w") as f:
         json.dump(d, f)
     print("New keys stored in file", filename)
@@ -51,7 +52,7 @@ def create_and_send_transaction(wallet, recipient, amount, trusted_node):
         return
     # re-decorate the recipient's public key
     # recipient = decorate_recipient_public_key(recipient)
-    T = Transaction(wallet.public_key, recipient, amount)
+    T = Transaction(wallet.public_key, recipient, amount, scheme=wallet.scheme)
     T.sign(wallet.secret_key)
     try:
         send_transaction(T, trusted_node)
@@ -69,7 +70,7 @@ def send_transaction(T: Transaction, trusted_node):
     message["Previous_Message_Recipients"] = []
     # message["Transaction_ID"] = str(T.tid)
     # message["Sender_Public_Key"] = str(T.sender)
-    # message["Recipient_Public_Key"] = str(T.recipient)
+    # message["Recipient_Address"] = str(T.recipient)
     # message["Amount"] = T.amount
     # message["Signature"] = list(T.signature) # send bytes as array of ints
     sock.connect(trusted_node)
@@ -91,11 +92,23 @@ def send_transaction(T: Transaction, trusted_node):
             print("Transaction currently invalid according to trusted node")
     except:
         return
+    finally:
+        # the full node leaves the connection open for us to close
+        sock.close()
 
 
-def get_blockchain(trusted_node) -> BlockChain:
+def get_blockchain(trusted_node, snapshot_digest=None) -> BlockChain:
     try:
-        bc = Messaging.getBlockchain(trusted_node)
+        # start from the trusted node's ledger snapshot (if we were given
+        # its digest) so only the blocks after it are downloaded and replayed
+        base = None
+        if snapshot_digest is not None:
+            snapshot = Messaging.getSnapshot(trusted_node)
+            if snapshot is not None:
+                base = BlockChain.from_snapshot(snapshot, snapshot_digest)
+            if base is None:
+                print("Snapshot could not be fetched or does not match its digest")
+        bc = Messaging.getBlockchain(trusted_node, base)
         if bc is not None:
             print("Updated local Blockchain copy")
             return bc
@@ -108,7 +121,20 @@ def get_blockchain(trusted_node) -> BlockChain:
         
 
 def get_wallet_balance(wallet: Wallet, blockchain_copy: BlockChain):
-    return blockchain_copy.user_balances[wallet.public_key]
+    return blockchain_copy.user_balances[wallet.address]
+
+def print_wallet_history(wallet: Wallet, blockchain_copy: BlockChain, count=50):
+    snapshot = blockchain_copy.snapshot
+    for height, tid, delta in blockchain_copy.get_history(wallet.address, count):
+        if tid is None:
+            if height == 0:
+                tid = "genesis"
+            elif snapshot is not None and height == snapshot.height:
+                # balance the chain was started with
+                tid = "snapshot"
+            else:
+                tid = "coinbase"
+        print(f"block {height:>6}  {delta:>+10}  {tid}")
 
 def read_default_users():
     with open("DefaultUsers.json") as f:
@@ -118,17 +144,19 @@ def read_default_users():
 
 def main():
 
-    if len(sys.argv) != 1 and len(sys.argv) != 3:
-        print("Usage: python3 LightWeightCLI.py <trusted host> <port of trusted host>")
+    if len(sys.argv) not in (1, 3, 4):
+        print("Usage: python3 LightWeightCLI.py <trusted host> <port of trusted host> [snapshot digest]")
         exit(-1)
     trusted_node_provided = False
     trusted_node = None
-    if len(sys.argv) == 3:
+    # digest of the trusted node's snapshot to start from
+    snapshot_digest = sys.argv[3] if len(sys.argv) == 4 else None
+    if len(sys.argv) >= 3:
         try:
             trusted_node = (sys.argv[1], int(sys.argv[2]))
             trusted_node_provided = True
         except:
-            print("Usage: python3 LightWeightCLI.py <trusted host> <port on trusted host>")
+            print("Usage: python3 LightWeightCLI.py <trusted host> <port on trusted host> [snapshot digest]")
             exit(-1)
     if trusted_node_provided:
         if not Messaging.pingNode(trusted_node):
@@ -160,7 +188,10 @@ def main():
         try:
             choice = choice.split(" ")
             if choice[0] == "g":
-                generate_wallet(choice[1])
+                if len(choice) > 2:
+                    generate_wallet(choice[1], choice[2])
+                else:
+                    generate_wallet(choice[1])
             elif choice[0] == "l":
                 wallet = load_wallet(choice[1])
             elif choice[0] == "t":
@@ -182,8 +213,14 @@ def main():
                         print(get_wallet_balance(wallet, blockchain_copy))
                     except:
                         print("Cannot get balance for wallet's public key")
+            elif choice[0] == "h":
+                if wallet is None:
+                    print("Load a valid wallet first")
+                else:
+                    print()
+                    print_wallet_history(wallet, blockchain_copy)
             elif choice[0] == "u":
-                bc_copy = get_blockchain(trusted_node)
+                bc_copy = get_blockchain(trusted_node, snapshot_digest)
                 if bc_copy is not None:
                     blockchain_copy = bc_copy
             choice = prompt()
@@ -5,20 +5,47 @@ Implementation of a miner node
 import sys
 from context import Blockchain
 from Blockchain import Constants, BlockChain, Block, Transaction, Messaging, MessageTypes
+from Blockchain.Address import to_address
 from hashlib import sha256
 import select
 import socket
 import random
+import os
+import queue
+import multiprocessing
 
 N = 500000 # determines number of nonce values to test before
           # pausing mining to listen for new messages
+NONCE_SPAN = 2 ** 32 # size of each worker's nonce range when mining without a limit
+STOP_CHECK_INTERVAL = 1000 # how often parallel workers check if another worker won
+
+def _mine_range(prefix, difficulty, start, count, found, results):
+    '''
+    Worker for parallel mining. Tests the nonces in [start, start + count)
+    and reports the first one that meets the difficulty, unless another
+    worker finds a hash first.
+    '''
+    target = difficulty * "0"
+    state = sha256(prefix)
+    for nonce in range(start, start + count):
+        if nonce % STOP_CHECK_INTERVAL == 0 and found.is_set():
+            return
+        hash = Block.hash_nonce(state, nonce)
+        if hash.startswith(target):
+            found.set()
+            results.put((nonce, hash))
+            return
 
 class Miner:
-    def __init__(self, pk):
+    def __init__(self, pk, processes=1):
         self.Node = None
         self.block = None
         self.pk = pk
+        # coinbase rewards are paid to the address of the miner's key
+        self.address = to_address(pk)
         self.difficulty = Constants.DIFFICULTY
+        # number of worker processes to mine with, 1 mines in this process
+        self.processes = processes
 
     # this is here for testing purposes
     def override_difficulty(self, d):
@@ -63,14 +90,16 @@ class Miner:
             readable, _, _ = select.select([parent], [], [], 0.05)
             # if so, deal with it
             if readable:
-                res = Messaging.readMessage(parent)
-                if res is None or res.get("Type", '') != MessageTypes.Start_New_Block:
+                # a newer block to mine replaces any older one read at the same time
+                jobs = [m for m in Messaging.readMessages(parent) if m.get("Type", '') == MessageTypes.Start_New_Block]
+                if not jobs:
                     continue
+                res = jobs[-1]
                 try:
                     transactions = res.get("Transactions", [])
                     previous_hash = res.get("Prev_Hash", '')
                     block_index = res.get("Block_Index", -1)
-                    block = Block(block_index, previous_hash, '')
+                    block = Block(block_index, previous_hash, self.address)
                     for t in transactions:
                         block.add_transaction(Messaging.transactionDictToObject(t))
                 except Exception as e:
@@ -78,8 +107,8 @@ class Miner:
                     block = None
             elif hash:
                 # We found a hash before receiving a new block to mine; send back block
-                message = {"Type": MessageTypes.Send_Block, "Block_Index": block.index, "Miner_PK": self.pk,
-                            "Prev_Hash": block.prev_hash, "Nonce": block.nonce, "Hash": hash,
+                message = {"Type": MessageTypes.Send_Block, "Block_Index": block.index, "Miner_Address": self.address,
+                            "Prev_Hash": block.prev_hash, "Nonce": self.block.nonce, "Hash": hash,
                             "Transactions": [txn.to_json() for txn in block.transactions], "Previous_Message_Recipients": []}
                 print(f"Message from miner to parent full node after finding a block: \n{message}")
                 Messaging.sendMessage(message, True, None, parent)
@@ -91,18 +120,19 @@ class Miner:
             if block:
                 hash = None
                 mining = True
-                self.block.index = block.index
-                self.block.transactions = block.transactions
-                self.block.prev_hash = block.prev_hash
-                self.block.nonce = block.nonce
-                self.block.hash = None
+                # mined blocks can't be modified, so start from a fresh one
+                self.block = Block(block.index, block.prev_hash, self.address,
+                                   block.nonce, block.transactions)
             else:
                 mining = False
 
             # if we are mining, mine for a bit
             if mining and block:
                 print("starting to mine")
-                hash = self.mine(N)
+                if self.processes > 1:
+                    hash = self.mine_parallel(N * self.processes)
+                else:
+                    hash = self.mine(N)
 
     def mine(self, iterations=None):
         '''
@@ -115,8 +145,11 @@ class Miner:
         i = 0
 
         self.block.nonce = random.randint(0, Constants.DIFFICULTY * 100000000)
+        # everything before the nonce is hashed once, each nonce only
+        # hashes its own short suffix on a copy of that state
+        state = self.block.mining_state()
 
-        hash = sha256(self.block.string_for_mining().encode()).hexdigest()
+        hash = Block.hash_nonce(state, self.block.nonce)
         while not hash.startswith(self.difficulty * "0"):
             # only mine a select number of times
             if iterations:
@@ -124,10 +157,57 @@ class Miner:
                 if i >= iterations:
                     return None
             self.block.nonce += 1
-            hash = sha256(self.block.string_for_mining().encode()).hexdigest()
+            hash = Block.hash_nonce(state, self.block.nonce)
         self.block.hash = hash
         return hash
 
+    def mine_parallel(self, iterations=None, processes=None):
+        '''
+        Finds an appropriate sha256 hash for a block using a pool of
+        processes, each searching a disjoint range of nonce values.
+        All workers stop as soon as one of them finds a hash.
+
+        Iterations: total number of nonce values to try across all workers
+        before giving up and returning None
+        Processes: number of workers, defaults to self.processes
+        (or every core if that is not set above 1)
+        '''
+        if not processes:
+            processes = self.processes if self.processes > 1 else os.cpu_count()
+        if iterations:
+            span = -(-iterations // processes)
+        else:
+            span = NONCE_SPAN
+
+        start = random.randint(0, Constants.DIFFICULTY * 100000000)
+        prefix = self.block.mining_prefix()
+        found = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=_mine_range,
+                                           args=(prefix, self.difficulty, start + i * span,
+                                                 span, found, results))
+                   for i in range(processes)]
+        for w in workers:
+            w.start()
+
+        result = None
+        while result is None:
+            try:
+                result = results.get(timeout=0.1)
+            except queue.Empty:
+                # every worker ran out of nonces without finding a hash
+                if not any(w.is_alive() for w in workers) and results.empty():
+                    break
+        # stop any workers that are still searching
+        found.set()
+        for w in workers:
+            w.join()
+
+        if result is None:
+            return None
+        self.block.nonce, self.block.hash = result
+        return self.block.hash
+
     @staticmethod
     def decorate_miner_public_key(miner_pk):
         beginning = "-----BEGIN PUBLIC KEY-----"
@@ -135,13 +215,14 @@ class Miner:
         return beginning + miner_pk + ending
 
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print("Usage: python3 Miner.py <Miner public key> <Full node host> <Full node port>")
+    if len(sys.argv) != 4 and len(sys.argv) != 5:
+        print("Usage: python3 Miner.py <Miner public key> <Full node host> <Full node port> [processes]")
         exit(1)
     miner_pk = Miner.decorate_miner_public_key(sys.argv[1])
     host = sys.argv[2]
     port = sys.argv[3]
     full_node_addr = (host, int(port))
-    miner = Miner(miner_pk)
+    processes = int(sys.argv[4]) if len(sys.argv) == 5 else 1
+    miner = Miner(miner_pk, processes)
     miner.block = Block("0", "0", miner_pk)
     miner.run(full_node_addr)
@@ -11,12 +11,19 @@ expected from a full node in our system.
 
 import socket
 import sys
+import os
+import base64
 import select, time
 from context import Blockchain
-from Blockchain import Constants, BlockChain, Block, Transaction, Messaging, MessageTypes
+from Blockchain import Constants, BlockChain, BlockChainCollection, Block, Transaction, Messaging, MessageTypes
+from Blockchain.Signatures import DEFAULT_SCHEME
+from Blockchain.BlockStore import BlockStore
+from Blockchain.SQLiteStore import SQLiteStore
+from Blockchain.Snapshot import Snapshots
+from Blockchain.ConnectionPool import ConnectionPool
 
 def try_start_mining_new_block(currently_mining, transactions_being_mined,
-                               miners, pending_transactions, connections, 
+                               miners, pending_transactions, pool,
                                blockchains_collection):
     '''
     This function is called when our handle_message function determines
@@ -31,7 +38,7 @@ def try_start_mining_new_block(currently_mining, transactions_being_mined,
     temp_user_balances = blockchains_collection.main_blockchain.user_balances.copy()
     transactions_obj_list = [] 
     transactions_json_list = []
-    for txn in pending_transactions:
+    for txn in pending_transactions.values():
         if len(transactions_json_list) == Constants.TPB:
             break
         # keep a running total of user balances as we determine the next
@@ -46,23 +53,15 @@ def try_start_mining_new_block(currently_mining, transactions_being_mined,
         block_index = blockchains_collection.main_blockchain.length
         message = {"Type": MessageTypes.Start_New_Block, "Transactions": transactions_json_list,
                     "Prev_Hash": prev_hash, "Block_Index": block_index}
-        for miner in miners:
-            # send this start_new_block message to all of our miners
-            miner_string = f"{miner[0]}:{miner[1]}"
-            miner_sock = None
-            try:
-                # the socket with our miner still exists, use it
-                miner_sock = [sock for sock in connections.keys() if connections[sock] == miner_string][0]
-                Messaging.sendMessage(message, True, miner, miner_sock, connections)
-            except:
-                # try a new socket with our miner
-                Messaging.sendMessage(message, True, miner, None, connections)
+        # send this start_new_block message to all of our miners over
+        # the connections they joined on
+        pool.broadcast(miners, message)
         currently_mining = True
         transactions_being_mined = transactions_obj_list
 
 
-def handle_message(sock, message, neighbors, miners, connections, orphan_blocks, pending_transactions, block_hashes_seen_before,
-                  main_sock, currently_mining, transactions_being_mined):
+def handle_message(sock, message, neighbors, miners, blockchains_collection, connections, orphan_blocks, pending_transactions, block_hashes_seen_before,
+                  main_sock, currently_mining, transactions_being_mined, snapshots, pool):
     '''
     Handles behavior for different message types that a full node
     expects to receive. Ignores messages that are irrelevant to
@@ -76,6 +75,10 @@ def handle_message(sock, message, neighbors, miners, connections, orphan_blocks,
         response = {"Type": MessageTypes.Get_Neighbors_Response, "Neighbors": neighbors}
         # send our neighbors to the full node that is requesting them
         Messaging.sendMessage(response, False, sock=sock, connections=connections)
+    elif msgtype == MessageTypes.Hello:
+        # tell the peer which of its features we support, the messaging
+        # layer uses them on this connection from now on
+        Messaging.sendMessage(Messaging.hello(response=True), True, sock=sock, connections=connections)
     elif msgtype == MessageTypes.Get_Neighbors_Response:
         for neigh in message.get("Neighbors", []):
             neighbors.add(tuple(neigh))
@@ -87,6 +90,7 @@ def handle_message(sock, message, neighbors, miners, connections, orphan_blocks,
         miner_addr = connections[sock].split(":")
         miner_addr_tuple = (miner_addr[0], int(miner_addr[1]))
         miners.add(miner_addr_tuple)
+        pool.add(miner_addr_tuple, sock)
         # send decision to miner so it knows we accepted it and will send
         # tasks its way soon; keep socket open and save it
         Messaging.sendMessage(response, True, sock=sock, connections=connections)
@@ -98,7 +102,7 @@ def handle_message(sock, message, neighbors, miners, connections, orphan_blocks,
         else:
             block_hashes_seen_before.add(hash)
         transactions = [Messaging.transactionDictToObject(txn) for txn in message["Transactions"]]
-        new_block = Block(message["Block_Index"], message["Prev_Hash"], message["Miner_PK"],
+        new_block = Block(message["Block_Index"], message["Prev_Hash"], message["Miner_Address"],
                           message["Nonce"], transactions, message["Hash"])
         if sock.getpeername() in miners:
             # Block came from miner. If all transactions included in the block are still in
@@ -108,38 +112,40 @@ def handle_message(sock, message, neighbors, miners, connections, orphan_blocks,
             # with some of the transactions included already, OR another one of our miners already
             # mined a block with some of those transactions, and so we should discard the block.
             for txn in transactions:
-                pending_transaction_tids = [t.tid for t in pending_transactions]
-                if txn.tid not in pending_transaction_tids:
+                if txn.tid not in pending_transactions:
                     return
             # Try to add it if valid
             rc = blockchains_collection.try_add_block(new_block, orphan_blocks, pending_transactions)
             if rc == 1:
+                if snapshots.update(blockchains_collection.main_blockchain):
+                    # operators start other nodes from it with --snapshot <digest>
+                    print(f"Snapshot at block {snapshots.latest.height}: {snapshots.latest.digest()}")
                 # block is in our main blockchain fork, forward block to neighbors
                 message["Previous_Message_Recipients"] = [main_sock.getsockname()]
-                for n in neighbors:
-                    Messaging.sendMessage(message, addr=n)
+                pool.broadcast(neighbors, message)
 
             try_start_mining_new_block(currently_mining, transactions_being_mined, miners, pending_transactions,
-                                       connections, blockchains_collection)
+                                       pool, blockchains_collection)
 
         else:
             # Otherwise, the block is coming from a full node. Try to add it to a blockchain fork.
             rc = blockchains_collection.try_add_block(new_block, orphan_blocks, pending_transactions)
             if rc == 1 or rc == 3:
+                if snapshots.update(blockchains_collection.main_blockchain):
+                    # operators start other nodes from it with --snapshot <digest>
+                    print(f"Snapshot at block {snapshots.latest.height}: {snapshots.latest.digest()}")
                 # block is in our main blockchain fork, forward block to neigbors
                 message["Previous_Message_Recipients"].append(main_sock.getsockname())
-                for n in neighbors:
-                    Messaging.sendMessage(message, addr=n)
+                pool.broadcast(neighbors, message)
             elif rc == 0:
                 # block was an orphan, try to get its parent from our neighbors
                 message = {"Type": MessageTypes.Get_Block, "Hash": new_block.hash}
-                for n in neighbors:
-                    Messaging.sendMessage(message, addr=n)
+                pool.broadcast(neighbors, message)
 
             # start mining a new block if the incoming block adds onto our main chain
             if rc == 1 or rc == 3:
                 try_start_mining_new_block(currently_mining, transactions_being_mined, miners, pending_transactions,
-                                           connections, blockchains_collection)
+                                           pool, blockchains_collection)
 
     elif msgtype == MessageTypes.Get_Block:
         desired_block_hash = message["Hash"]
@@ -148,71 +154,90 @@ def handle_message(sock, message, neighbors, miners, connections, orphan_blocks,
         if block:
             # send the block to the requesting full node
             message = {"Type": MessageTypes.Send_Block, "Block_Index": block.index,
-                       "Miner_PK": block.miner_pk, "Prev_Hash": block.prev_hash,
+                       "Miner_Address": block.miner_address, "Prev_Hash": block.prev_hash,
                        "Nonce": block.nonce, "Hash": block.hash, "Transactions": [txn.to_json() for txn in block.transactions],
                        "Previous_Message_Recipients": []}
-            Messaging.sendMessage(message, sock=sock)
+            # the connection stays open, the requester may be relaying to us over it
+            Messaging.sendMessage(message, True, sock=sock, connections=connections)
     elif msgtype == MessageTypes.Send_Transaction:
         # When we get a transaction, verify that it's been signed
         # correcty and then broadcast it. If we aren't mining right now,
         # and we now have TPB pending_transactions, start mining.
         tid = message["Transaction_ID"]
         sender_pk = message["Sender_Public_Key"]
-        recipient_pk = message["Recipient_Public_Key"]
+        recipient = message["Recipient_Address"]
         amount = int(message["Amount"])
         signature = bytes(message["Signature"]) # create bytes from array of ints
         prev_recipients = message["Previous_Message_Recipients"]
-        new_transaction = Transaction(sender_pk, recipient_pk, amount, tid, signature)
+        scheme = message.get("Scheme", DEFAULT_SCHEME)
+        # transaction ids are hashes of the contents, so a transaction we
+        # already hold is recognized before checking its signature
+        if tid in pending_transactions:
+            return
+        new_transaction = Transaction(sender_pk, recipient, amount, tid, signature, scheme,
+                                      message["Timestamp"])
         if new_transaction.verify_transaction_authenticity():
             print(f"Valid transaction recieved. TID: {tid}")
             # transaction is valid, so we can broadcast it after adding ourselves
             # to the previous recipients list (as long as we haven't seen this
             # transaction before)
 
-            # compare to pending_transactions
-            for txn in pending_transactions:
-                if tid == txn.tid:
-                    return
-            pending_transactions.add(new_transaction)
             # compare to accepted transactions in our main blockchain fork
             if tid not in blockchains_collection.main_blockchain.accepted_transactions:
                 # not seen before
+                pending_transactions[tid] = new_transaction
                 prev_recipients.append(main_sock.getsockname())
                 message["Previous_Message_Recipients"] = prev_recipients
                 print("Forwarding transaction to neighbors")
-                for n in neighbors:
-                    Messaging.sendMessage(message, addr=n)
+                pool.broadcast(neighbors, message)
             # tell sender whether or not we though the transaction was valid
-            # (will be used by lightweight nodes)
-            if blockchains_collection.main_blockchain.user_balances.get(sender_pk, 0) < amount:
+            # (will be used by lightweight nodes). The connection is left open
+            # since neighbors relay transactions to us over the same one.
+            if blockchains_collection.main_blockchain.user_balances.get(new_transaction.sender, 0) < amount:
                 # sender balance too low -> not valid
                 response = {"Type": MessageTypes.Send_Transaction_Response, "Valid": "No"}
             else:
                 # sender balance sufficient -> valid
                 response = {"Type": MessageTypes.Send_Transaction_Response, "Valid": "Yes"}
                 print(f"pending_transactions: {pending_transactions}")
-            Messaging.sendMessage(response, False, sock=sock)
+            Messaging.sendMessage(response, True, sock=sock, connections=connections)
         else:
             # transaction not authentic -> not valid
             response = {"Type": MessageTypes.Send_Transaction_Response, "Valid": "No"}
-            Messaging.sendMessage(response, False, sock=sock)
+            Messaging.sendMessage(response, True, sock=sock, connections=connections)
         
         # if we aren't mining right now, send a block to miners with up to
         # TPB pending_transactions
         if not currently_mining:
             try_start_mining_new_block(currently_mining, transactions_being_mined, miners, pending_transactions,
-                                       connections, blockchains_collection)
+                                       pool, blockchains_collection)
             
 
     elif msgtype == MessageTypes.Get_Blockchain:
-        # send blocks back one by one
+        # send blocks back one by one, starting from the requested index
         bc_length = blockchains_collection.main_blockchain.length
-        for block in blockchains_collection.main_blockchain.block_chain[1:]:
+        start_index = message.get("Start_Index", 1)
+        snapshot = blockchains_collection.main_blockchain.snapshot
+        if snapshot is not None:
+            # blocks up to the snapshot we started from are only headers
+            start_index = max(start_index, snapshot.height + 1)
+        if start_index >= bc_length:
+            # nothing to send, say so rather than leave the requester waiting
+            message = {"Type": MessageTypes.Get_Blockchain_Response, "Num_Blocks_Left_To_Come": 0}
+            Messaging.sendMessage(message, True, sock=sock, connections=connections)
+        for block in blockchains_collection.main_blockchain.block_chain[start_index:]:
             # don't send genesis block, it's part of the protocol, so others will have it
             message = {"Type": MessageTypes.Get_Blockchain_Response, "Block_Index": block.index,
-                        "Miner_PK": block.miner_pk, "Prev_Hash": block.prev_hash, "Num_Blocks_Left_To_Come": bc_length-block.index-1,
+                        "Miner_Address": block.miner_address, "Prev_Hash": block.prev_hash, "Num_Blocks_Left_To_Come": bc_length-block.index-1,
                         "Nonce": block.nonce, "Hash": block.hash, "Transactions": [txn.to_json() for txn in block.transactions]}
             Messaging.sendMessage(message, True, sock=sock, connections=connections)
+    elif msgtype == MessageTypes.Get_Snapshot:
+        # send our latest ledger snapshot so the requester can skip replaying the chain
+        snapshot = snapshots.latest
+        if snapshot is not None:
+            response = {"Type": MessageTypes.Get_Snapshot_Response, "Height": snapshot.height,
+                        "Digest": snapshot.digest(), "Snapshot": base64.b64encode(snapshot.to_bytes()).decode()}
+            Messaging.sendMessage(response, True, sock=sock, connections=connections)
 
 def ping_nodes(nodes: set, self_address: tuple):
     '''
@@ -231,33 +256,47 @@ def ping_nodes(nodes: set, self_address: tuple):
         print(f"Discarding inactive connection: {node}")
         nodes.discard(node)
 
+USAGE = ("Usage: FullNode.py <port> [--trusted <trusted_hostname:port> [--snapshot <digest>]] "
+         "[--store <directory> | --sqlite <file>]")
+
 def main():
-    if len(sys.argv) < 2 or len(sys.argv) > 4:
-        print("Usage: FullNode.py <port> [--trusted <trusted_hostname:port>]")
+    if len(sys.argv) < 2 or len(sys.argv) % 2 != 0 or len(sys.argv) > 8:
+        print(USAGE)
         exit(-1)
 
     port = int(sys.argv[1])
     trusted_host = None
-    if len(sys.argv) > 2:
-        if sys.argv[2] == "--trusted":
+    store_directory = None
+    sqlite_path = None
+    snapshot_digest = None
+    for flag, value in zip(sys.argv[2::2], sys.argv[3::2]):
+        if flag == "--trusted":
             # read in and store trusted host
             try:
-                trusted_host = sys.argv[3]
-                trusted_host = trusted_host.split(":")
+                trusted_host = value.split(":")
                 trusted_host = (trusted_host[0], int(trusted_host[1]))
             except:
-                print("Usage: FullNode.py <port> [--trusted <trusted_hostname:port>]")
+                print(USAGE)
                 exit(-1)
+        elif flag == "--store":
+            # directory to keep our blocks in across restarts
+            store_directory = value
+        elif flag == "--sqlite":
+            # database to keep the chain and balances in instead of memory
+            sqlite_path = value
+        elif flag == "--snapshot":
+            # digest of the trusted host's snapshot to start from
+            snapshot_digest = value
         else:
-            print("Usage: FullNode.py <port> [--trusted <trusted_hostname:port>]")
+            print(USAGE)
             exit(-1)
             
     # stores (hostname, port) pairs of other full nodes in the system
     neighbors = set()
     # stores (hostname, port) pairs of miners that are working for it
     miners = set()
-    # set of pending transactions (i.e., not yet added to blockchain)
-    pending_transactions = set()
+    # pending transactions (i.e., not yet added to blockchain) keyed by tid
+    pending_transactions = dict()
     # create set of orphan blocks
     orphan_blocks = set()
     # create set of block hashes that we have seen before
@@ -304,39 +343,54 @@ def main():
     else:
         print(f"{len(neighbors)} neighbors discovered: {neighbors}")
 
-    # The blockchains_collection will hold multiple forks of the blockchain
-    # (if needed) and abstract the appending of blocks
+    # The blockchains_collection will hold every fork of the blockchain as a
+    # tree of blocks (forks share their common blocks) and abstract the appending
+    # of blocks. Only the main fork has its balances kept in a BlockChain.
     blockchains_collection = BlockChainCollection()
     # create a blockchain with a genesis block (this block is defined by
-    # the protocol, so any new full node can create it)
-    bc = BlockChain()
+    # the protocol, so any new full node can create it), plus any blocks
+    # we saved before restarting
+    if store_directory is not None and sqlite_path is not None:
+        print(USAGE)
+        exit(-1)
+    if snapshot_digest is not None and (trusted_host is None or store_directory is not None or sqlite_path is not None):
+        print(USAGE)
+        exit(-1)
+    if store_directory is not None:
+        bc = BlockChain(store=BlockStore(store_directory))
+        print(f"Loaded {bc.length - 1} blocks from {store_directory}")
+    elif sqlite_path is not None:
+        bc = BlockChain(store=SQLiteStore(sqlite_path))
+        print(f"Opened {bc.length - 1} blocks in {sqlite_path}")
+    else:
+        bc = None
+        if snapshot_digest is not None:
+            # start from the trusted host's ledger snapshot so that only
+            # the blocks after it have to be downloaded and replayed
+            snapshot = Messaging.getSnapshot(trusted_host)
+            if snapshot is not None:
+                bc = BlockChain.from_snapshot(snapshot, snapshot_digest)
+            if bc is not None:
+                print(f"Started from a snapshot at block {snapshot.height}")
+            else:
+                print("Snapshot could not be fetched or does not match its digest")
+        if bc is None:
+            bc = BlockChain()
     blockchains_collection.add_blockchain_fork(bc)
+    # snapshots of our ledger that we serve to new nodes
+    snapshots = Snapshots(os.path.join(store_directory, "snapshot.dat") if store_directory is not None else None)
     
-    # try to get blockchains from neighbors and make the longest
-    # one our active fork (also store other forks of equal length)
-    longest_bc_length = 0
-    longest_bc = None
-    tied_length_blockchains = []
+    # try to get blockchains from neighbors; their blocks are added to the
+    # tree and the fork with the most work becomes our main fork. A chain
+    # started from a snapshot only needs the blocks after it.
+    main_bc = blockchains_collection.main_blockchain
+    base = main_bc if main_bc.snapshot is not None else None
     for n in neighbors:
-        bc = Messaging.getBlockchain(n)
-        if not bc:
+        bc = Messaging.getBlockchain(n, base)
+        if bc is None or bc is base:
+            # failed, or the neighbor has nothing we don't
             continue
-        if len(bc.block_chain) > longest_bc:
-            # found a new longest fork, store this one for now
-            longest_bc = bc
-            longest_bc_length = bc.length
-        elif len(bc.block_chain) == longest_bc:
-            # found a fork with same length as current longest
-            # fork, store it as well
-            tied_length_blockchains.append(bc)
-    # store the longest blockchain fork in our blockchain collection
-    if longest_bc is not None:
-        blockchains_collection.add_blockchain_fork(longest_bc)
-    # store all other blockchain forks of equal lenth in our blockchain collection
-    for tlbc in tied_length_blockchains:
-        # the longest blockchain could have changed, so check lengths again
-        if tlbc.length == longest_bc_length:
-            blockchains_collection.add_blockchain_fork(tlbc)
+        blockchains_collection.add_blockchain_fork(bc)
 
     main_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     main_sock.bind(("", port))
@@ -344,6 +398,9 @@ def main():
 
     # dict of socket connections
     connections = {main_sock: f"localhost:{port}"}
+    # long lived connections to our neighbors and miners, which
+    # blocks and transactions are relayed over
+    pool = ConnectionPool(connections)
 
     first_ping = True
     latest_ping = time.time()
@@ -354,10 +411,13 @@ def main():
         if int(time.time() - latest_ping) > int(Constants.NEIGHBOR_PING_INTERVAL) or first_ping:
             # remove neighbors from the set if they aren't active anymore
             ping_nodes(neighbors, main_sock.getsockname())
+            first_ping = False
+            latest_ping = time.time()
 
         # prune the blockchain collection so that short forks are discarded
         if int(time.time() - latest_prune) > int(Constants.BLOCKCHAIN_FORK_PRUNING_INTERVAL):
             blockchains_collection.prune_short_forks()
+            latest_prune = time.time()
 
         # listen for a second for a readable socket
         readable, writeable, exceptional = select.select([conn for conn in connections.keys() if conn.fileno() >= 0], [], [], 1)
@@ -373,12 +433,11 @@ def main():
             # otherwise, we have another node making a request or closing
             # a connection
             else:
-                # read from the socket
-                message = Messaging.readMessage(sock, connections)
-                if message is not None:
+                # read from the socket, which may complete any number of messages
+                for message in Messaging.readMessages(sock, connections):
                     handle_message(sock, message, neighbors, miners, blockchains_collection,
                                    connections, orphan_blocks, pending_transactions, block_hashes_seen_before,
-                                   main_sock, currently_mining, transactions_being_mined)
+                                   main_sock, currently_mining, transactions_being_mined, snapshots, pool)
         # handle any issues with sockets
         for sock in exceptional:
             if sock == main_sock:
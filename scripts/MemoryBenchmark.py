@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+'''
+Compares the memory used per transaction by a chain of dict backed
+transactions with int list signatures (the old representation) and
+the __slots__ based Transaction with bytes signatures, both right after
+the transactions are built and after they have been hashed and
+serialized, the way a node holds the transactions of its chain
+
+Usage: python3 MemoryBenchmark.py [number of transactions]
+'''
+import os
+import sys
+import tracemalloc
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from Blockchain import Transaction, Block, Constants
+from Blockchain.Address import to_address
+
+SIGNATURE_SIZE = 256 # bytes in a 2048 bit RSA signature
+NUM_SENDERS = 1000
+
+class DictTransaction:
+    '''
+    The old transaction layout: a plain object with a __dict__
+    and the signature kept as a list of ints
+    '''
+    def __init__(self, sender, recipient, amount, tid, signature, scheme):
+        self.tid = tid
+        self.sender_pk = sender
+        self.sender = to_address(sender)
+        self.recipient = to_address(recipient)
+        self.amount = amount
+        self.signature = list(signature)
+        self.scheme = scheme
+
+class DictBlock:
+    def __init__(self, index, prev_hash, miner, nonce, transactions, hash):
+        self.index = index
+        self.prev_hash = prev_hash
+        self.miner_address = to_address(miner)
+        self.nonce = nonce
+        self.transactions = transactions
+        self.hash = hash
+
+def fake_key(i):
+    return "-----BEGIN PUBLIC KEY-----\n" + f"{i:08d}" * 49 + "\n-----END PUBLIC KEY-----"
+
+def build_chain(transaction_class, block_class, n):
+    '''
+    Builds n transactions in blocks of Constants.TPB, the way they
+    would be parsed off the wire (every string is its own object)
+    '''
+    keys = [fake_key(i) for i in range(NUM_SENDERS)]
+    addresses = [to_address(k) for k in keys]
+    blocks = []
+    transactions = []
+    for i in range(n):
+        signature = os.urandom(SIGNATURE_SIZE)
+        transactions.append(transaction_class("".join(keys[i % NUM_SENDERS]),
+                                              addresses[(i + 1) % NUM_SENDERS],
+                                              i % 100 + 1, f"{i:064x}", signature, "RSA"))
+        if len(transactions) == Constants.TPB:
+            index = len(blocks) + 1
+            blocks.append(block_class(index, f"{index - 1:064x}", addresses[0], index,
+                                      transactions, f"{index:064x}"))
+            transactions = []
+    return blocks
+
+def use_chain(blocks):
+    '''
+    Does what a node does with the blocks of its chain: digests their
+    transactions (to look up their signatures), hashes them into Merkle
+    roots and serializes them
+    '''
+    for block in blocks:
+        block.merkle_root()
+        for t in block.transactions:
+            t.digest()
+            t.to_json()
+            t.to_string()
+
+def measure(transaction_class, block_class, n, used=False):
+    '''
+    Returns the number of bytes allocated per transaction, after
+    the chain has been used if used is True
+    '''
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    blocks = build_chain(transaction_class, block_class, n)
+    if used:
+        use_chain(blocks)
+    allocated = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del blocks
+    return allocated / n
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    # the old layout cached nothing, so using it allocates nothing that is kept
+    before = measure(DictTransaction, DictBlock, n)
+    print(f"Transactions: {n}")
+    print(f"dict + int list signatures: {before:.0f} bytes per transaction")
+    for state, used in (("built", False), ("hashed and serialized", True)):
+        after = measure(Transaction, Block, n, used)
+        print(f"__slots__ + bytes signatures, {state}: {after:.0f} bytes per transaction, "
+              f"saved {before - after:.0f} ({100 * (before - after) / before:.1f}%)")
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+'''
+Compares the size of Send_Block messages and the time to encode and
+decode them in JSON and in the binary encoding of WireFormat.py, for
+blocks of 5, 100 and 1000 transactions (or the sizes given)
+
+Usage: python3 WireBenchmark.py [block sizes...]
+'''
+import os
+import sys
+import json
+import timeit
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from Blockchain import Transaction, MessageTypes
+from Blockchain.Address import to_address
+from Blockchain.WireFormat import encode_message, decode_message
+
+SIGNATURE_SIZE = 256 # bytes in a 2048 bit RSA signature
+NUM_SENDERS = 1000
+
+def fake_key(i):
+    return "-----BEGIN PUBLIC KEY-----\n" + f"{i:08d}" * 49 + "\n-----END PUBLIC KEY-----"
+
+def block_message(num_transactions):
+    '''
+    Builds a Send_Block message the way a full node relays it
+    '''
+    transactions = []
+    for i in range(num_transactions):
+        sender = fake_key(i % NUM_SENDERS)
+        recipient = to_address(fake_key((i + 1) % NUM_SENDERS))
+        txn = Transaction(sender, recipient, i % 100 + 1, signature=os.urandom(SIGNATURE_SIZE))
+        transactions.append(txn.to_json())
+    return {"Type": MessageTypes.Send_Block, "Block_Index": 1, "Miner_Address": to_address(fake_key(0)),
+            "Prev_Hash": "00" * 32, "Nonce": 12345, "Hash": "00ab" * 16, "Transactions": transactions,
+            "Previous_Message_Recipients": [["127.0.0.1", 8000]]}
+
+def best_time(function, repeat=5):
+    '''
+    Returns the fastest of several runs of a function, in milliseconds
+    '''
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number * 1000
+
+if __name__ == "__main__":
+    sizes = [int(size) for size in sys.argv[1:]] or [5, 100, 1000]
+    print(f"{'txns':>6} {'encoding':>8} {'bytes':>10} {'encode ms':>10} {'decode ms':>10}")
+    for size in sizes:
+        message = block_message(size)
+        json_bytes = json.dumps(message).encode()
+        binary_bytes = encode_message(message)
+        assert decode_message(binary_bytes) == json.loads(json_bytes)
+        results = [
+            ("json", json_bytes, lambda: json.dumps(message).encode(), lambda: json.loads(json_bytes)),
+            ("binary", binary_bytes, lambda: encode_message(message), lambda: decode_message(binary_bytes)),
+        ]
+        for name, data, encode, decode in results:
+            print(f"{size:>6} {name:>8} {len(data):>10} {best_time(encode):>10.3f} {best_time(decode):>10.3f}")
+        print(f"{size:>6} {'saved':>8} {100 * (1 - len(binary_bytes) / len(json_bytes)):>9.1f}%")
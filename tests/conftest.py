@@ -0,0 +1,51 @@
+import os
+import sys
+import json
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# the nodes import the package through nodes/context.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'nodes')))
+
+from Blockchain import Block, Constants, Transaction
+from Blockchain.Wallet import Wallet
+from Blockchain.Checkpoint import default_checkpoints
+
+WALLETS_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'wallets.json')
+
+@pytest.fixture
+def wallets():
+    with open(WALLETS_PATH) as f:
+        return {name: Wallet(keys) for name, keys in json.load(f).items()}
+
+@pytest.fixture(autouse=True)
+def easy_difficulty(monkeypatch):
+    # keep mining fast and checkpoints from leaking between tests
+    monkeypatch.setattr(Constants, "DIFFICULTY", 1)
+    default_checkpoints.clear()
+    yield
+    default_checkpoints.clear()
+
+def mine(index, prev_hash, miner, transactions):
+    '''
+    Returns a block with a nonce that meets the difficulty
+    '''
+    block = Block(index, prev_hash, miner, 0, list(transactions))
+    state = block.mining_state()
+    nonce = 0
+    while not Block.hash_nonce(state, nonce).startswith(Constants.DIFFICULTY * "0"):
+        nonce += 1
+    return Block(index, prev_hash, miner, nonce, list(transactions), Block.hash_nonce(state, nonce))
+
+def grow(chain, miner, payer, payee, count):
+    '''
+    Mines count blocks on top of a chain, each paying payee from payer
+    once, and adds them to it
+    Returns: the new blocks
+    '''
+    blocks = []
+    for _ in range(count):
+        T = Transaction.generate_transaction(payer, chain.length, payee.public_key)
+        block = mine(chain.length, chain.get_last_hash(), miner.public_key, [T])
+        assert chain.validate_block(block) and chain.add_block(block)
+        blocks.append(block)
+    return blocks
@@ -0,0 +1,98 @@
+from conftest import mine, grow
+from Blockchain import Block, BlockChain, BlockChainCollection, Transaction
+
+def test_block_repeating_its_last_transaction_is_rejected(wallets):
+    chain = BlockChain()
+    josh, mary = wallets["Josh"], wallets["Mary"]
+    transactions = [Transaction.generate_transaction(josh, amount, mary.public_key) for amount in (100, 1, 2)]
+    block = mine(1, chain.get_last_hash(), josh.public_key, transactions)
+    # the Merkle root of [A, B, C, C] is the root of [A, B, C]
+    forged = Block(1, block.prev_hash, block.miner_address, block.nonce,
+                   transactions + [transactions[-1]], block.hash)
+    assert forged.verify_proof_of_work()
+    assert not chain.validate_block(forged)
+
+    collection = BlockChainCollection()
+    collection.add_blockchain_fork(BlockChain())
+    assert collection.try_add_block(forged) == -1
+    # and as a side fork, where it is only checked until its fork takes over
+    other = mine(1, chain.get_last_hash(), mary.public_key, [])
+    assert collection.try_add_block(other) == 1
+    assert collection.try_add_block(forged) == -1
+
+    forged_chain = BlockChain([forged])
+    assert not forged_chain.verify_blockchain()
+    assert chain.validate_block(block)
+
+def test_checkpoint_does_not_vouch_for_forged_prefix(wallets):
+    josh, mary = wallets["Josh"], wallets["Mary"]
+    T = Transaction.generate_transaction(josh, 10, mary.public_key)
+    b1 = mine(1, BlockChain().get_hash_at(0), josh.public_key, [T])
+    b2 = mine(2, b1.hash, josh.public_key, [])
+    chain = BlockChain([b1, b2])
+    assert chain.verify_blockchain()
+    # copies share the verified blocks and resume from the checkpoint
+    assert chain.copy().verify_blockchain()
+
+    # block 1 keeps its real hash but its transaction has a zero signature
+    forged_T = Transaction(T.sender_pk, T.recipient, T.amount, T.tid, bytes(len(T.signature)),
+                           T.scheme, T.timestamp)
+    forged_b1 = Block(1, b1.prev_hash, b1.miner_address, b1.nonce, [forged_T], b1.hash)
+    assert not BlockChain([forged_b1, b2]).verify_blockchain()
+
+def test_failed_switch_only_removes_the_invalid_block(wallets):
+    josh, mary = wallets["Josh"], wallets["Mary"]
+    genesis = BlockChain().get_hash_at(0)
+    collection = BlockChainCollection()
+    collection.add_blockchain_fork(BlockChain())
+    m1 = mine(1, genesis, josh.public_key, [])
+    m2 = mine(2, m1.hash, josh.public_key, [])
+    assert collection.try_add_block(m1) == 1 and collection.try_add_block(m2) == 1
+    # a side fork where one of two children of s1 spends more than it has
+    s1 = mine(1, genesis, mary.public_key, [])
+    s2_good = mine(2, s1.hash, mary.public_key, [])
+    overspend = Transaction.generate_transaction(mary, 10**12, josh.public_key)
+    s2_bad = mine(2, s1.hash, mary.public_key, [overspend])
+    s3_bad = mine(3, s2_bad.hash, mary.public_key, [])
+    for block in (s1, s2_good, s2_bad):
+        assert collection.try_add_block(block) == 2
+    # s3_bad outweighs the main fork, switching to it fails at s2_bad
+    assert collection.try_add_block(s3_bad) == -1
+    assert collection.main_blockchain.get_last_hash() == m2.hash
+    assert s2_bad.hash not in collection.nodes and s3_bad.hash not in collection.nodes
+    assert s1.hash in collection.nodes and s2_good.hash in collection.nodes
+    # so the valid sibling can still take over
+    s3_good = mine(3, s2_good.hash, mary.public_key, [])
+    assert collection.try_add_block(s3_good) == 3
+    assert collection.main_blockchain.get_last_hash() == s3_good.hash
+
+def ledger(chain, addresses):
+    return ([chain.get_hash_at(h) for h in range(chain.length)], dict(chain.accepted_transactions),
+            {a: chain.user_balances[a] for a in addresses}, {a: chain.get_history(a) for a in addresses})
+
+def test_reorganize_restores_balances_and_history(wallets):
+    josh, mary, miner = wallets["Josh"], wallets["Mary"], wallets["Brad"]
+    addresses = [josh.address, mary.address, miner.address]
+    chain = BlockChain()
+    a1, a2, a3 = grow(chain, josh, josh, mary, 3)
+    before = ledger(chain, addresses)
+
+    # a competing branch after a1, paid to another miner by Mary instead
+    fork = BlockChain([a1])
+    branch = grow(fork, miner, mary, josh, 3)
+    assert chain.reorganize(1, branch) == -1
+    assert ledger(chain, addresses) == ledger(fork, addresses)
+    assert a2.transactions[0].tid not in chain.accepted_transactions
+
+    # a branch whose second block is invalid leaves the chain as it was
+    overspend = Transaction.generate_transaction(mary, 10**12, josh.public_key)
+    bad = mine(3, branch[0].hash, miner.public_key, [overspend])
+    assert chain.reorganize(2, [bad]) == 0
+    assert ledger(chain, addresses) == ledger(fork, addresses)
+    assert chain.reorganize(1, [a2, a3, mine(4, a3.hash, josh.public_key, [overspend])]) == 2
+    assert ledger(chain, addresses) == ledger(fork, addresses)
+
+    # and switching back gives the original ledger
+    assert chain.reorganize(1, [a2, a3]) == -1
+    assert ledger(chain, addresses) == before
+    assert chain.verify_blockchain()
@@ -0,0 +1,103 @@
+import socket
+import asyncio
+import pytest
+from Blockchain import Messaging, MessageTypes
+from Blockchain.ConnectionPool import Backoff, ConnectionPool, AsyncConnectionPool
+from Blockchain.AsyncMessaging import AsyncMessaging
+
+PING = {"Type": MessageTypes.Get_Neighbors}
+
+def test_backoff_doubles_up_to_its_maximum(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("Blockchain.ConnectionPool.time.monotonic", lambda: now[0])
+    backoff = Backoff(base=1, maximum=5)
+    addr = ("127.0.0.1", 1)
+    assert backoff.ready(addr)
+    waits = []
+    for _ in range(5):
+        backoff.failed(addr)
+        start = now[0]
+        while not backoff.ready(addr):
+            now[0] += 0.5
+        waits.append(now[0] - start)
+    assert waits == [1, 2, 4, 5, 5]
+    backoff.failed(addr)
+    backoff.succeeded(addr)
+    assert backoff.ready(addr)
+
+def test_pool_reuses_its_connection_and_reopens_it():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    server.settimeout(5)
+    addr = server.getsockname()
+    pool = ConnectionPool()
+    try:
+        assert pool.send(addr, PING) == 1 and pool.send(addr, PING) == 1
+        peer, _ = server.accept()
+        peer.settimeout(5)
+        # the hello the pool opens with, then both messages on one connection
+        assert Messaging.readMessage(peer)["Type"] == MessageTypes.Hello
+        assert Messaging.readMessage(peer) == PING and Messaging.readMessage(peer) == PING
+        # and no second connection
+        server.settimeout(0.2)
+        with pytest.raises(socket.timeout):
+            server.accept()
+
+        # once the peer hangs up the next send reconnects
+        peer.close()
+        server.settimeout(5)
+        assert pool.send(addr, PING) == 1
+        peer, _ = server.accept()
+        peer.settimeout(5)
+        assert Messaging.readMessage(peer)["Type"] == MessageTypes.Hello
+        assert Messaging.readMessage(peer) == PING
+        peer.close()
+    finally:
+        pool.close()
+        server.close()
+
+def test_pool_backs_off_from_an_unreachable_address():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    addr = server.getsockname()
+    # bound but not listening, so connecting is refused
+    pool = ConnectionPool()
+    try:
+        assert pool.send(addr, PING) == 0
+        assert not pool.backoff.ready(addr) and addr not in pool
+        assert pool.get(addr) is None
+    finally:
+        server.close()
+
+def test_async_pool_reuses_its_connection():
+    async def run():
+        connections = []
+        received = []
+
+        async def peer(reader, writer):
+            connections.append(writer)
+            while True:
+                message = await AsyncMessaging.readMessage(reader, writer)
+                if message is None:
+                    break
+                received.append(message["Type"])
+
+        server = await asyncio.start_server(peer, "127.0.0.1", 0)
+        addr = server.sockets[0].getsockname()[:2]
+        pool = AsyncConnectionPool()
+        try:
+            assert await pool.broadcast([addr, addr], PING) == 2
+            assert await pool.send(addr, PING) == 1
+            for _ in range(50):
+                if len(received) == 4:
+                    break
+                await asyncio.sleep(0.05)
+            return len(connections), received
+        finally:
+            await pool.close()
+            server.close()
+
+    connections, received = asyncio.run(run())
+    assert connections == 1
+    assert received == [MessageTypes.Hello] + [MessageTypes.Get_Neighbors] * 3
@@ -0,0 +1,61 @@
+import json
+import socket
+import struct
+import pytest
+from Blockchain import Constants, Messaging, MessageTypes
+from Blockchain.Framing import FrameReader, FRAME_HEADER_FORMAT, FLAG_BINARY, encode_frame
+
+def test_partial_frames_wait_for_the_rest():
+    frame = encode_frame(b"hello world", FLAG_BINARY)
+    reader = FrameReader()
+    for i in range(len(frame) - 1):
+        reader.feed(frame[i:i + 1])
+        assert reader.next_frame() is None
+    assert len(reader) == len(frame) - 1
+    reader.feed(frame[-1:])
+    assert reader.next_frame() == (FLAG_BINARY, b"hello world")
+    assert len(reader) == 0
+
+def test_glued_frames_are_split():
+    frames = [encode_frame(b"one"), encode_frame(b""), encode_frame(b"three", FLAG_BINARY)]
+    reader = FrameReader()
+    # two and a half frames in one read, then the rest
+    data = b"".join(frames) + encode_frame(b"four")[:5]
+    reader.feed(data)
+    assert [reader.next_frame() for _ in range(3)] == [(0, b"one"), (0, b""), (FLAG_BINARY, b"three")]
+    assert reader.next_frame() is None
+    reader.feed(encode_frame(b"four")[5:])
+    assert reader.next_frame() == (0, b"four")
+
+def test_oversized_frames_are_refused(monkeypatch):
+    monkeypatch.setattr(Constants, "MAX_MESSAGE_SIZE", 16)
+    with pytest.raises(ValueError):
+        encode_frame(b"x" * 17)
+    reader = FrameReader()
+    # refused from the header alone, before the payload arrives
+    with pytest.raises(ValueError):
+        reader.feed(struct.pack(FRAME_HEADER_FORMAT, 17, 0))
+
+def test_socket_reads_split_and_glued_messages():
+    a, b = socket.socketpair()
+    b.settimeout(5)
+    messages = [{"Type": MessageTypes.Get_Neighbors}, {"Type": MessageTypes.Get_Seed_Nodes}]
+    data = b"".join(encode_frame(json.dumps(m).encode()) for m in messages)
+    # the first message a byte short, then the rest of it glued to the second
+    a.sendall(data[:len(data) // 2 - 1])
+    assert Messaging.readMessages(b) == []
+    a.sendall(data[len(data) // 2 - 1:])
+    assert Messaging.readMessage(b) == messages[0]
+    assert Messaging.readMessage(b) == messages[1]
+    a.close()
+    b.close()
+
+def test_oversized_message_closes_the_socket(monkeypatch):
+    monkeypatch.setattr(Constants, "MAX_MESSAGE_SIZE", 16)
+    a, b = socket.socketpair()
+    b.settimeout(5)
+    connections = {b: "peer"}
+    a.sendall(struct.pack(FRAME_HEADER_FORMAT, 17, 0))
+    assert Messaging.readMessage(b, connections) is None
+    assert b.fileno() < 0 and b not in connections
+    a.close()
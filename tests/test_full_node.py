@@ -0,0 +1,56 @@
+import asyncio
+from conftest import mine
+from FullNode import FullNode
+from Blockchain import Transaction, MessageTypes, AsyncMessaging
+
+def test_node_serves_clients_and_miners_concurrently(wallets):
+    josh, mary = wallets["Josh"], wallets["Mary"]
+    T = Transaction.generate_transaction(josh, 5, mary.public_key)
+
+    async def run():
+        node = FullNode(("127.0.0.1", 0))
+        server = await asyncio.start_server(node.handle_connection, "127.0.0.1", 0)
+        addr = server.sockets[0].getsockname()[:2]
+        try:
+            # a peer that stalls halfway through a frame holds up nobody else
+            _, stalled = await AsyncMessaging.connect(addr)
+            stalled.write(b"\x00\x00")
+            await stalled.drain()
+
+            miner_reader, miner = await AsyncMessaging.connect(addr)
+            await AsyncMessaging.sendMessage(miner, {"Type": MessageTypes.Join_As_Miner})
+            joined = await AsyncMessaging.readMessage(miner_reader, miner, timeout=5)
+            assert joined == {"Type": MessageTypes.Join_As_Miner_Response, "Decision": "Yes"}
+
+            message = T.to_json()
+            message["Type"] = MessageTypes.Send_Transaction
+            message["Previous_Message_Recipients"] = []
+            response = await asyncio.wait_for(AsyncMessaging.request(addr, message), 5)
+            assert response == {"Type": MessageTypes.Send_Transaction_Response, "Valid": "Yes"}
+
+            # the miner is sent the transaction to mine and sends back the block
+            job = await AsyncMessaging.readMessage(miner_reader, miner, timeout=5)
+            assert job["Type"] == MessageTypes.Start_New_Block
+            assert [t["Transaction_ID"] for t in job["Transactions"]] == [T.tid]
+            block = mine(job["Block_Index"], job["Prev_Hash"], mary.public_key,
+                         [Transaction.from_json(t) for t in job["Transactions"]])
+            found = {"Type": MessageTypes.Send_Block, "Block_Index": block.index,
+                     "Miner_Address": block.miner_address, "Prev_Hash": block.prev_hash,
+                     "Nonce": block.nonce, "Hash": block.hash,
+                     "Transactions": [t.to_json() for t in block.transactions],
+                     "Previous_Message_Recipients": []}
+            await AsyncMessaging.sendMessage(miner, found)
+            for _ in range(50):
+                if node.blockchain.length == 2:
+                    break
+                await asyncio.sleep(0.1)
+            for writer in (stalled, miner):
+                await AsyncMessaging.close(writer)
+            return node
+        finally:
+            server.close()
+
+    node = asyncio.run(run())
+    assert node.blockchain.get_last_hash() != node.blockchain.get_hash_at(0)
+    assert T.tid in node.blockchain.accepted_transactions
+    assert not node.pending_transactions and not node.currently_mining
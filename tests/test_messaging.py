@@ -0,0 +1,167 @@
+import json
+import time
+import socket
+import struct
+import asyncio
+from conftest import mine
+from Blockchain import BlockChain, Transaction, Messaging, MessageTypes
+from Blockchain.WireFormat import encode_message, decode_message
+from Blockchain.Framing import FRAME_HEADER_FORMAT, FRAME_HEADER_SIZE, FLAG_COMPRESSED, encode_frame
+from Blockchain.AsyncMessaging import AsyncMessaging
+from Blockchain.ConnectionPool import AsyncConnectionPool
+
+def send_transaction_message(wallets):
+    T = Transaction.generate_transaction(wallets["Josh"], 5, wallets["Mary"].public_key)
+    message = T.to_json()
+    message["Type"] = MessageTypes.Send_Transaction
+    message["Previous_Message_Recipients"] = [["127.0.0.1", 8000]]
+    return T, message
+
+def test_binary_message_decodes_like_json(wallets):
+    T, message = send_transaction_message(wallets)
+    decoded = decode_message(encode_message(message))
+    assert decoded == json.loads(json.dumps(message))
+    assert Transaction.from_json(decoded).verify_transaction_authenticity()
+
+def test_binary_message_relayed_as_json(wallets):
+    T, message = send_transaction_message(wallets)
+    decoded = decode_message(encode_message(message))
+
+    async def relay():
+        received = asyncio.get_running_loop().create_future()
+
+        async def json_only_peer(reader, writer):
+            # an older node: ignores the Hello and only reads JSON frames
+            while not received.done():
+                length, flags = struct.unpack(FRAME_HEADER_FORMAT, await reader.readexactly(FRAME_HEADER_SIZE))
+                frame = json.loads(await reader.readexactly(length))
+                assert flags == 0
+                if frame["Type"] == MessageTypes.Send_Transaction:
+                    received.set_result(frame)
+            writer.close()
+
+        server = await asyncio.start_server(json_only_peer, "127.0.0.1", 0)
+        pool = AsyncConnectionPool()
+        try:
+            addr = server.sockets[0].getsockname()[:2]
+            assert await pool.send(addr, decoded) == 1
+            return await asyncio.wait_for(received, 5)
+        finally:
+            await pool.close()
+            server.close()
+
+    relayed = asyncio.run(relay())
+    assert bytes(relayed["Signature"]) == T.signature
+    assert relayed["Transaction_ID"] == T.tid
+
+def corrupt_compressed_frame():
+    return encode_frame(b"not a zlib stream", FLAG_COMPRESSED)
+
+def test_corrupt_compressed_frame_closes_socket():
+    a, b = socket.socketpair()
+    b.settimeout(5)
+    connections = {b: "peer"}
+    a.sendall(corrupt_compressed_frame())
+    assert Messaging.readMessage(b, connections) is None
+    assert b.fileno() < 0 and b not in connections
+    a.close()
+
+def test_corrupt_compressed_frame_closes_async_connection():
+    async def read():
+        async def peer(reader, writer):
+            writer.write(corrupt_compressed_frame())
+            await writer.drain()
+            await reader.read()
+            writer.close()
+
+        server = await asyncio.start_server(peer, "127.0.0.1", 0)
+        try:
+            reader, writer = await AsyncMessaging.connect(server.sockets[0].getsockname()[:2])
+            message = await AsyncMessaging.readMessage(reader, writer, timeout=5)
+            return message, writer.is_closing()
+        finally:
+            server.close()
+
+    assert asyncio.run(read()) == (None, True)
+
+def serve_blockchain(blockchain, request):
+    '''
+    Runs Messaging.getBlockchain against a full node serving a chain
+    Returns: what it returned and how long it took
+    '''
+    from FullNode import FullNode
+
+    async def run():
+        node = FullNode(("127.0.0.1", 0), blockchain)
+        server = await asyncio.start_server(node.handle_connection, "127.0.0.1", 0)
+        try:
+            addr = server.sockets[0].getsockname()[:2]
+            start = time.monotonic()
+            result = await asyncio.to_thread(request, addr)
+            return result, time.monotonic() - start
+        finally:
+            server.close()
+
+    return asyncio.run(run())
+
+def test_up_to_date_chain_gets_an_empty_response(wallets):
+    b1 = mine(1, BlockChain().get_hash_at(0), wallets["Josh"].public_key, [])
+    base = BlockChain([b1])
+    result, elapsed = serve_blockchain(BlockChain([b1]), lambda addr: Messaging.getBlockchain(addr, base))
+    assert result is base
+    assert elapsed < 1
+    # a node with only the genesis block has no blocks to send either
+    result, elapsed = serve_blockchain(BlockChain(), Messaging.getBlockchain)
+    assert result.length == 1 and elapsed < 1
+
+def neighbors_message():
+    # large and repetitive enough to be compressed
+    neighbors = [[f"node{i}.example.com", 8000 + i] for i in range(200)]
+    return {"Type": MessageTypes.Get_Neighbors_Response, "Neighbors": neighbors}
+
+def greet(sock, peer, features):
+    '''
+    Has sock offer our features and peer answer with the given ones
+    '''
+    Messaging.sendMessage(Messaging.hello(), True, sock=sock)
+    assert Messaging.readMessage(peer)["Type"] == MessageTypes.Hello
+    Messaging.sendMessage({"Type": MessageTypes.Hello_Response, "Features": features}, True, sock=peer)
+    assert Messaging.readMessage(sock)["Type"] == MessageTypes.Hello_Response
+
+def next_flags(sock):
+    header = sock.recv(FRAME_HEADER_SIZE, socket.MSG_PEEK)
+    return struct.unpack(FRAME_HEADER_FORMAT, header)[1]
+
+def test_compressed_round_trip():
+    a, b = socket.socketpair()
+    b.settimeout(5)
+    greet(a, b, list(Messaging.FEATURES))
+    assert "zlib" in Messaging.getFeatures(a)
+    message = neighbors_message()
+    # every message continues the connection's zlib stream
+    for _ in range(3):
+        assert Messaging.sendMessage(message, True, sock=a)
+        assert next_flags(b) & FLAG_COMPRESSED
+        assert Messaging.readMessage(b) == message
+    # small messages aren't worth compressing
+    assert Messaging.sendMessage({"Type": MessageTypes.Get_Neighbors}, True, sock=a)
+    assert not next_flags(b) & FLAG_COMPRESSED
+    assert Messaging.readMessage(b) == {"Type": MessageTypes.Get_Neighbors}
+    a.close()
+    b.close()
+
+def test_no_compression_for_peers_without_it():
+    a, b = socket.socketpair()
+    b.settimeout(5)
+    message = neighbors_message()
+    # a peer that never answered the hello, then one that only speaks binary
+    Messaging.sendMessage(message, True, sock=a)
+    assert next_flags(b) == 0
+    assert Messaging.readMessage(b) == message
+    greet(a, b, ["binary"])
+    assert Messaging.getFeatures(a) == {"binary"}
+    Messaging.sendMessage(message, True, sock=a)
+    assert not next_flags(b) & FLAG_COMPRESSED
+    assert Messaging.readMessage(b) == message
+    a.close()
+    b.close()
@@ -0,0 +1,40 @@
+from Miner import Miner
+from Blockchain import Block, BlockChain
+
+def first_valid_nonce(block, difficulty, start):
+    state = block.mining_state()
+    nonce = start
+    while not Block.hash_nonce(state, nonce).startswith(difficulty * "0"):
+        nonce += 1
+    return nonce
+
+def test_parallel_search_finds_the_first_nonce_of_its_range(wallets, monkeypatch):
+    miner = Miner(wallets["Josh"].public_key, processes=2)
+    miner.override_difficulty(2)
+    prev_hash = BlockChain().get_hash_at(0)
+    # both searches start from nonce 0
+    monkeypatch.setattr("Miner.random.randint", lambda a, b: 0)
+
+    miner.block = Block(1, prev_hash, miner.address)
+    hash = miner.mine()
+    nonce = miner.block.nonce
+    assert nonce == first_valid_nonce(miner.block, 2, 0)
+
+    span = 4 * (nonce + 1)
+    miner.block = Block(1, prev_hash, miner.address)
+    assert miner.mine_parallel(2 * span, processes=2) is not None
+    found = miner.block
+    assert found.verify_proof_of_work() and found.hash.startswith("00")
+    # whichever worker won, it found the first valid nonce of its range
+    worker_start = found.nonce // span * span
+    assert found.nonce == first_valid_nonce(found, 2, worker_start)
+    if found.nonce < span:
+        assert (found.nonce, found.hash) == (nonce, hash)
+
+def test_parallel_search_gives_up_after_its_iterations(wallets, monkeypatch):
+    miner = Miner(wallets["Josh"].public_key, processes=2)
+    # no nonce meets an impossible difficulty
+    miner.override_difficulty(64)
+    miner.block = Block(1, BlockChain().get_hash_at(0), miner.address)
+    assert miner.mine_parallel(2000, processes=2) is None
+    assert miner.block.hash is None
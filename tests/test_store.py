@@ -0,0 +1,70 @@
+import os
+from conftest import grow
+from Blockchain import BlockChain
+from Blockchain.BlockStore import BlockStore, DATA_FILE
+from Blockchain.SQLiteStore import SQLiteStore, BlockRange
+
+def same_chain(chain, other, addresses):
+    assert other.length == chain.length
+    assert [other.get_hash_at(h) for h in range(other.length)] == [chain.get_hash_at(h) for h in range(chain.length)]
+    for address in addresses:
+        assert other.user_balances[address] == chain.user_balances[address]
+        assert other.get_history(address) == chain.get_history(address)
+    assert other.verify_blockchain()
+
+def test_block_store_reopens_to_the_same_chain(wallets, tmp_path):
+    josh, mary = wallets["Josh"], wallets["Mary"]
+    chain = BlockChain(store=BlockStore(str(tmp_path)))
+    blocks = grow(chain, josh, josh, mary, 4)
+    chain.disconnect_block()
+    chain.store.close()
+    reopened = BlockChain(store=BlockStore(str(tmp_path)))
+    same_chain(BlockChain(blocks[:3]), reopened, [josh.address, mary.address])
+    # a block cut off by a crash is dropped when the store is reopened
+    grow(reopened, josh, josh, mary, 1)
+    reopened.store.close()
+    data_path = os.path.join(str(tmp_path), DATA_FILE)
+    os.truncate(data_path, os.path.getsize(data_path) - 10)
+    same_chain(BlockChain(blocks[:3]), BlockChain(store=BlockStore(str(tmp_path))), [josh.address, mary.address])
+
+def test_sqlite_chain_is_read_lazily(wallets, tmp_path):
+    josh, mary = wallets["Josh"], wallets["Mary"]
+    store = SQLiteStore(str(tmp_path / "chain.db"))
+    chain = BlockChain(store=store)
+    statements = []
+    store.conn.set_trace_callback(statements.append)
+    blocks = grow(chain, josh, josh, mary, 4)
+    # the tip height is kept, not counted on every append
+    assert not [s for s in statements if "COUNT" in s]
+    assert len(store) == 4 and chain.length == 5
+
+    tail = chain.block_chain[2:]
+    assert isinstance(tail, BlockRange) and len(tail) == 3
+    assert [b.hash for b in tail] == [b.hash for b in blocks[1:]]
+    # it can be iterated again, e.g. by verify_blockchain
+    assert [b.hash for b in tail] == [b.hash for b in blocks[1:]]
+    assert chain.block_chain[0:2][0] is chain.block_chain[0]
+
+    statements.clear()
+    assert blocks[2].hash in chain.block_index
+    assert "deadbeef" not in chain.block_index
+    assert not [s for s in statements if "data" in s]
+
+    chain.disconnect_block()
+    assert len(store) == 3 and len(chain.block_chain[1:]) == 3
+    assert chain.verify_blockchain()
+
+def test_sqlite_store_reopens_to_the_same_chain(wallets, tmp_path):
+    josh, mary = wallets["Josh"], wallets["Mary"]
+    path = str(tmp_path / "chain.db")
+    chain = BlockChain(store=SQLiteStore(path))
+    blocks = grow(chain, josh, josh, mary, 4)
+    chain.disconnect_block()
+    chain.store.close()
+    reopened = BlockChain(store=SQLiteStore(path))
+    assert len(reopened.store) == 3
+    memory = BlockChain(blocks[:3])
+    same_chain(memory, reopened, [josh.address, mary.address])
+    for T in blocks[1].transactions:
+        assert reopened.get_transaction_location(T.tid) == memory.get_transaction_location(T.tid)
+    assert blocks[3].transactions[0].tid not in reopened.accepted_transactions
@@ -0,0 +1,27 @@
+import json
+from Blockchain import Block, Constants, Transaction
+
+def test_batch_reports_the_first_bad_transaction(wallets, monkeypatch):
+    josh, mary = wallets["Josh"], wallets["Mary"]
+    good = [Transaction.generate_transaction(josh, amount, mary.public_key) for amount in (1, 2)]
+    T = Transaction.generate_transaction(josh, 3, mary.public_key)
+    bad_signature = Transaction(T.sender_pk, T.recipient, T.amount, T.tid, bytes(len(T.signature)),
+                                T.scheme, T.timestamp)
+    unsigned = Transaction(josh.public_key, mary.public_key, 4)
+    transactions = [good[0], bad_signature, good[1], unsigned]
+    assert Transaction.verify_batch(transactions, processes=1) == 1
+    # small enough batches skip the pool, make this one use it
+    monkeypatch.setattr(Constants, "PARALLEL_VERIFY_THRESHOLD", 1)
+    assert Transaction.verify_batch(transactions, processes=2) == 1
+    block = Block(1, "00" * 32, josh.public_key, 0, transactions)
+    assert block.verify_transaction_authenticities(send_bad_transaction=True, processes=2) is bad_signature
+
+def test_serializations_are_built_fresh(wallets):
+    T = Transaction.generate_transaction(wallets["Josh"], 5, wallets["Mary"].public_key)
+    message = T.to_json()
+    message["Type"] = "Send_Transaction"
+    # nothing a caller does to the json leaks into the transaction
+    assert "Type" not in T.to_json()
+    assert json.loads(T.canonical()) == T.to_json()
+    assert json.loads(T.canonical(False)) == T.to_json(False)
+    assert T.verify_transaction_authenticity()